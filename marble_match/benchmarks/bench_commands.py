@@ -0,0 +1,131 @@
+"""Times cog commands end to end without Discord, on synthetic guilds in a temporary database
+
+Run from the marble_match directory:
+
+    python -m benchmarks.bench_commands --guilds 2 --members 1000 --history 20 --bets 3 --matches 200
+
+Matches are challenged, accepted, bet on and settled through the commands, then histories and leaderboards are
+read. Every command is awaited on its own, so latencies don't include waiting on other commands.
+
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.harness import World, find_match, invoke
+
+
+def percentile(samples: list, p: float) -> float:
+    """Returns nearest-rank percentile p of sorted samples"""
+    return samples[max(0, min(len(samples) - 1, math.ceil(p / 100 * len(samples)) - 1))]
+
+
+class Timings:
+    """Latencies, statements and commits of every run of each command"""
+
+    def __init__(self, world: World):
+        self.world = world
+        self.runs = {}
+
+    async def measure(self, name: str, command, cog, ctx, *args):
+        statements, commits = self.world.counter.snapshot()
+        start = time.perf_counter()
+        await invoke(command, cog, ctx, *args)
+        elapsed = time.perf_counter() - start
+        after = self.world.counter.snapshot()
+        self.runs.setdefault(name, []).append((elapsed, after[0] - statements, after[1] - commits))
+
+    def report(self) -> str:
+        lines = [f'{"command":<15}{"runs":>6}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+                 f'{"queries":>10}{"commits":>10}']
+        for name, runs in self.runs.items():
+            latencies = sorted(run[0] * 1000 for run in runs)
+            queries = sum(run[1] for run in runs) / len(runs)
+            commits = sum(run[2] for run in runs) / len(runs)
+            lines.append(f'{name:<15}{len(runs):>6}{percentile(latencies, 50):>10.2f}'
+                         f'{percentile(latencies, 95):>10.2f}{percentile(latencies, 99):>10.2f}'
+                         f'{queries:>10.1f}{commits:>10.1f}')
+        return '\n'.join(lines)
+
+
+async def run_commands(world: World, matches: int, bets: int, reads: int) -> Timings:
+    match_cog, bet_cog = world.cogs['MatchCog'], world.cogs['BetCog']
+    history_cog, stats_cog = world.cogs['HistoryCog'], world.cogs['StatsCog']
+    timings = Timings(world)
+
+    # Disjoint pairs of members play matches, the rest of each guild bets on them
+    pairs, bettors = [], {}
+    per_guild = math.ceil(matches / len(world.guilds))
+    for guild in world.guilds:
+        players = guild.members[:per_guild * 2]
+        pairs += list(zip(players[::2], players[1::2]))
+        bettors[guild.id] = guild.members[per_guild * 2:]
+    pairs = pairs[:matches]
+
+    for challenger, recipient in pairs:
+        await timings.measure('match', match_cog.match, match_cog, world.context(challenger), recipient, 10)
+    for challenger, recipient in pairs:
+        await timings.measure('accept', match_cog.accept, match_cog, world.context(recipient))
+
+    match_ids = {challenger.id: await find_match(challenger) for challenger, _ in pairs}
+
+    for _ in range(bets):
+        challenger, recipient = random.choice(pairs)
+        bettor = random.choice(bettors[challenger.guild.id])
+        await timings.measure('bet', bet_cog.bet, bet_cog, world.context(bettor),
+                              random.choice((challenger, recipient)), match_ids[challenger.id], random.randint(1, 5))
+
+    for challenger, recipient in pairs:
+        await timings.measure('winner', match_cog.match_win, match_cog, world.context(challenger),
+                              random.choice((challenger, recipient)))
+
+    members = [member for guild in world.guilds for member in guild.members]
+    for _ in range(reads):
+        await timings.measure('match_history', history_cog.match_history, history_cog,
+                              world.context(random.choice(members)), None, None)
+    for _ in range(reads):
+        await timings.measure('bet_history', history_cog.bet_history, history_cog,
+                              world.context(random.choice(members)), None, None)
+    for _ in range(reads):
+        await timings.measure('leaderboard', stats_cog.leaderboard, stats_cog,
+                              world.context(random.choice(members)), 'wins', None)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=2)
+    parser.add_argument('--members', type=int, default=1000, help='members of each guild')
+    parser.add_argument('--history', type=int, default=20, help='finished matches per member')
+    parser.add_argument('--bets', type=int, default=3, help='bets on each finished match')
+    parser.add_argument('--matches', type=int, default=200, help='matches played through the commands')
+    parser.add_argument('--bet-commands', type=int, default=500, help='bets placed through the commands')
+    parser.add_argument('--reads', type=int, default=200, help='runs of each history and leaderboard command')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.matches * 2 >= args.members * args.guilds:
+        parser.error('--matches needs fewer than half of all members, the rest bet')
+
+    logging.getLogger('marble_match').setLevel(logging.CRITICAL)
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        world = World(os.path.join(directory, 'bench.db'), args.guilds, args.members, args.history, args.bets)
+        print(f'seeded {args.guilds} guilds of {args.members} members, {args.history} matches per member and '
+              f'{args.bets} bets per match in {world.seconds:.1f}s\n')
+        try:
+            timings = asyncio.run(run_commands(world, args.matches, args.bet_commands, args.reads))
+        finally:
+            world.close()
+
+    print(timings.report())
+
+
+if __name__ == '__main__':
+    main()
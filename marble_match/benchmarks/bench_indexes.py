@@ -0,0 +1,121 @@
+"""Compares the hot lookups before and after the index migration on a synthetic database
+
+Run from the marble_match directory:
+
+    python -m benchmarks.bench_indexes --users 20000 --matches 200000 --bets 3
+
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import database.migrations as migrations
+
+# Hot lookups as run by database_operation, with a function returning parameters for a random row
+LOOKUPS = [
+    ('get_player_id', "SELECT * FROM users WHERE uuid=? AND server_id=?",
+     lambda s: [s['uuid'](), 1]),
+    ('get_player_info_all_by_server', "SELECT * FROM users WHERE server_id=?",
+     lambda s: [2]),
+    ('find_match_by_player_id', "SELECT * FROM matches WHERE participant1=? OR participant2=?",
+     lambda s: [s['user'](), s['user']()]),
+    ('get_match_history_info_all', "SELECT * FROM matches_history WHERE participant1=? OR participant2=?",
+     lambda s: [s['user'](), s['user']()]),
+    ('get_bet_info_match_all', "SELECT * FROM bets WHERE match_id=?",
+     lambda s: [s['match']()]),
+    ('find_bet', "SELECT * FROM bets WHERE match_id=? AND better_id=?",
+     lambda s: [s['match'](), s['user']()]),
+    ('get_bet_history_info_all', "SELECT * FROM bets_history WHERE better_id=?",
+     lambda s: [s['user']()]),
+]
+
+
+def seed(connection: sqlite3.Connection, users: int, matches: int, bets: int):
+    """Fills an unindexed schema with users, active matches, history and bets"""
+    now = datetime.datetime.utcnow()
+    cur = connection.cursor()
+    # A second, small guild so server_id lookups have something to filter out
+    cur.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(i, 100000 + i, f'user{i}', 100, 1 if i > users // 10 else 2, 0, 0)
+                     for i in range(1, users + 1)])
+    cur.executemany("INSERT INTO matches VALUES (?, ?, 0, ?, ?, 1, 'melee', 'Bo3')",
+                    [(i, 5, random.randint(1, users), random.randint(1, users))
+                     for i in range(1, matches // 10 + 1)])
+    cur.executemany("INSERT INTO matches_history VALUES (?, ?, ?, ?, ?, ?, 'melee', 'Bo3')",
+                    [(i, 5, random.randint(1, users), random.randint(1, users), random.randint(1, users), now)
+                     for i in range(1, matches + 1)])
+    cur.executemany("INSERT INTO bets VALUES (NULL, ?, ?, ?, ?)",
+                    [(3, i, random.randint(1, users), random.randint(1, users))
+                     for i in range(1, matches // 10 + 1) for _ in range(bets)])
+    cur.executemany("INSERT INTO bets_history VALUES (NULL, ?, ?, ?, ?, ?, ?)",
+                    [(3, i, random.randint(1, users), random.randint(1, users), random.randint(1, users), now)
+                     for i in range(1, matches + 1) for _ in range(bets)])
+    connection.commit()
+
+
+def run_lookups(connection: sqlite3.Connection, samplers: dict, repeat: int) -> dict:
+    """Returns dict of lookup name to (mean seconds, query plan)"""
+    results = {}
+    cur = connection.cursor()
+    for name, query, params in LOOKUPS:
+        cur.execute(f'EXPLAIN QUERY PLAN {query}', params(samplers))
+        plan = '; '.join(row[3] for row in cur.fetchall())
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            cur.execute(query, params(samplers))
+            cur.fetchall()
+        results[name] = ((time.perf_counter() - start) / repeat, plan)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--matches', type=int, default=200000, help='matches_history rows, a tenth are active')
+    parser.add_argument('--bets', type=int, default=3, help='bets per match')
+    parser.add_argument('--repeat', type=int, default=50, help='executions per lookup')
+    args = parser.parse_args()
+
+    random.seed(0)
+    samplers = {
+        'user': lambda: random.randint(1, args.users),
+        'uuid': lambda: 100000 + random.randint(1, args.users),
+        'match': lambda: random.randint(1, max(1, args.matches // 10)),
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, 'bench.db'),
+                                     detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+
+        # Schema as it was before indexes
+        migrations.migrate(connection, target=1)
+        start = time.perf_counter()
+        seed(connection, args.users, args.matches, args.bets)
+        print(f'seeded {args.users} users, {args.matches} matches, {args.bets} bets per match '
+              f'in {time.perf_counter() - start:.1f}s\n')
+
+        before = run_lookups(connection, samplers, args.repeat)
+
+        start = time.perf_counter()
+        migrations.migrate(connection)
+        print(f'migrated to version {migrations.get_version(connection)} in {time.perf_counter() - start:.2f}s\n')
+
+        after = run_lookups(connection, samplers, args.repeat)
+        connection.close()
+
+    print(f'{"lookup":<32}{"before ms":>12}{"after ms":>12}{"speedup":>10}')
+    for name, _, _ in LOOKUPS:
+        speedup = before[name][0] / after[name][0] if after[name][0] else float('inf')
+        print(f'{name:<32}{before[name][0] * 1000:>12.3f}{after[name][0] * 1000:>12.3f}{speedup:>9.1f}x')
+    print()
+    for name, _, _ in LOOKUPS:
+        print(f'{name}\n  before: {before[name][1]}\n  after:  {after[name][1]}')
+
+
+if __name__ == '__main__':
+    main()
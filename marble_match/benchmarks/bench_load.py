@@ -0,0 +1,215 @@
+"""Replays a mix of commands from many simulated members at once, on one event loop, without Discord
+
+Run from the marble_match directory:
+
+    python -m benchmarks.bench_load --members 2000 --concurrency 200 --duration 30 \\
+        --mix bet=5,winner=1,leaderboard=2,match_history=2
+
+Every worker picks a command from the mix, runs it as a random member and sleeps for its think time, for as long
+as the run lasts. Open matches are kept at --matches: a settled match is challenged and accepted again by the
+same pair, which counts as match and accept commands. Event loop lag is how late a timer that should wake every
+--lag-interval ms actually wakes, so it shows how long commands block the loop.
+
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.bench_commands import percentile
+from benchmarks.harness import World, find_match, invoke
+
+# Commands that can be in the mix
+COMMANDS = ('bet', 'winner', 'leaderboard', 'match_history', 'bet_history')
+
+
+def parse_mix(mix: str) -> dict:
+    """Returns dict of command to weight from 'command=weight,...'"""
+    weights = {}
+    for part in mix.split(','):
+        command, _, weight = part.partition('=')
+        command = command.strip()
+        if command not in COMMANDS:
+            raise ValueError(f'{command} is not one of {", ".join(COMMANDS)}')
+        weights[command] = float(weight or 1)
+    return weights
+
+
+class Arena:
+    """Open matches between disjoint pairs of members, and the members betting on them"""
+
+    def __init__(self, world: World, matches: int):
+        self.world = world
+        self.pairs = []
+        self.bettors = {}
+        self.open = {}
+        self.members = [member for guild in world.guilds for member in guild.members]
+
+        per_guild = math.ceil(matches / len(world.guilds))
+        for guild in world.guilds:
+            players = guild.members[:per_guild * 2]
+            self.pairs += list(zip(players[::2], players[1::2]))
+            self.bettors[guild.id] = guild.members[per_guild * 2:]
+        self.pairs = self.pairs[:matches]
+
+    async def open_match(self, pair: tuple, record=None):
+        """Challenges and accepts a match between pair, it can be bet on and settled once it's open"""
+        challenger, recipient = pair
+        match_cog = self.world.cogs['MatchCog']
+        for name, command, member, args in (('match', match_cog.match, challenger, (recipient, 10)),
+                                            ('accept', match_cog.accept, recipient, ())):
+            start = time.perf_counter()
+            await invoke(command, match_cog, self.world.context(member), *args)
+            if record is not None:
+                record(name, time.perf_counter() - start)
+
+        match_id = await find_match(challenger)
+        if match_id:
+            self.open[match_id] = pair
+
+
+class Load:
+    """Latencies and errors of every command run by the workers"""
+
+    def __init__(self, world: World, arena: Arena, weights: dict, think: float):
+        self.world = world
+        self.arena = arena
+        self.commands = list(weights)
+        self.weights = list(weights.values())
+        self.think = think
+        self.latencies = {}
+        self.errors = {}
+        self.lag = []
+
+    def record(self, name: str, seconds: float):
+        self.latencies.setdefault(name, []).append(seconds)
+
+    async def run(self, name: str):
+        world, arena = self.world, self.arena
+        match_cog, bet_cog = world.cogs['MatchCog'], world.cogs['BetCog']
+        history_cog, stats_cog = world.cogs['HistoryCog'], world.cogs['StatsCog']
+
+        if name in ('bet', 'winner') and not arena.open:
+            return
+        if name == 'winner':
+            # Taken out of open so no other worker settles or bets on it meanwhile
+            match_id = random.choice(list(arena.open))
+            challenger, recipient = arena.open.pop(match_id)
+            command, cog, ctx, args = (match_cog.match_win, match_cog, world.context(challenger),
+                                       (random.choice((challenger, recipient)),))
+        elif name == 'bet':
+            match_id, (challenger, recipient) = random.choice(list(arena.open.items()))
+            bettor = random.choice(arena.bettors[challenger.guild.id])
+            command, cog, ctx, args = (bet_cog.bet, bet_cog, world.context(bettor),
+                                       (random.choice((challenger, recipient)), match_id, random.randint(1, 5)))
+        elif name == 'leaderboard':
+            command, cog, ctx, args = (stats_cog.leaderboard, stats_cog, world.context(random.choice(arena.members)),
+                                       ('wins', None))
+        else:
+            command, cog, ctx, args = (getattr(history_cog, name), history_cog,
+                                       world.context(random.choice(arena.members)), (None, None))
+
+        start = time.perf_counter()
+        try:
+            await invoke(command, cog, ctx, *args)
+        except Exception:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        self.record(name, time.perf_counter() - start)
+
+        if name == 'winner':
+            await arena.open_match((challenger, recipient), self.record)
+
+    async def worker(self, deadline: float):
+        while time.perf_counter() < deadline:
+            await self.run(random.choices(self.commands, self.weights)[0])
+            # Yield even without think time, so every worker gets to run
+            await asyncio.sleep(random.expovariate(1 / self.think) if self.think else 0)
+
+    async def monitor(self, interval: float):
+        """Records how late a timer wakes, every interval seconds"""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.lag.append(time.perf_counter() - start - interval)
+
+    def report(self, seconds: float, statements: int, commits: int) -> str:
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        lines = [f'{"command":<15}{"runs":>7}{"errors":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}']
+        for name, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latency * 1000 for latency in latencies)
+            lines.append(f'{name:<15}{len(latencies):>7}{self.errors.get(name, 0):>8}'
+                         f'{percentile(latencies, 50):>10.2f}{percentile(latencies, 95):>10.2f}'
+                         f'{percentile(latencies, 99):>10.2f}{latencies[-1]:>10.2f}')
+
+        lines.append('')
+        lines.append(f'throughput: {total / seconds:.0f} commands/s, {statements / seconds:.0f} queries/s, '
+                     f'{commits / seconds:.0f} commits/s')
+        if self.lag:
+            lag = sorted(lag * 1000 for lag in self.lag)
+            lines.append(f'event loop lag: p50 {percentile(lag, 50):.2f} ms, p99 {percentile(lag, 99):.2f} ms, '
+                         f'max {lag[-1]:.2f} ms')
+        return '\n'.join(lines)
+
+
+async def run_load(world: World, args: argparse.Namespace) -> str:
+    arena = Arena(world, args.matches)
+    for pair in arena.pairs:
+        await arena.open_match(pair)
+
+    load = Load(world, arena, parse_mix(args.mix), args.think / 1000)
+    monitor = asyncio.ensure_future(load.monitor(args.lag_interval / 1000))
+    statements, commits = world.counter.snapshot()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(load.worker(deadline) for _ in range(args.concurrency)))
+    seconds = time.perf_counter() - start
+    after = world.counter.snapshot()
+    monitor.cancel()
+
+    return load.report(seconds, after[0] - statements, after[1] - commits)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=4)
+    parser.add_argument('--members', type=int, default=1000, help='members of each guild')
+    parser.add_argument('--history', type=int, default=20, help='finished matches per member')
+    parser.add_argument('--bets', type=int, default=3, help='bets on each finished match')
+    parser.add_argument('--matches', type=int, default=100, help='matches kept open to bet on and settle')
+    parser.add_argument('--concurrency', type=int, default=200, help='members running commands at once')
+    parser.add_argument('--duration', type=float, default=20, help='seconds to run commands for')
+    parser.add_argument('--think', type=float, default=50, help='mean ms a member waits between commands')
+    parser.add_argument('--mix', default='bet=5,winner=1,leaderboard=2,match_history=2',
+                        help=f'weights of commands, from {", ".join(COMMANDS)}')
+    parser.add_argument('--lag-interval', type=float, default=10, help='ms between event loop lag samples')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.matches * 2 >= args.members * args.guilds:
+        parser.error('--matches needs fewer than half of all members, the rest bet')
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.getLogger('marble_match').setLevel(logging.CRITICAL)
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        world = World(os.path.join(directory, 'bench.db'), args.guilds, args.members, args.history, args.bets)
+        print(f'seeded {args.guilds} guilds of {args.members} members in {world.seconds:.1f}s, '
+              f'{args.concurrency} members running {args.mix} for {args.duration:g}s\n')
+        try:
+            report = asyncio.run(run_load(world, args))
+        finally:
+            world.close()
+
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
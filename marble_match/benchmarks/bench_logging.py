@@ -0,0 +1,145 @@
+"""Measures logging overhead per command, with debug output queued, filtered out, or written synchronously
+
+Run from the marble_match directory:
+
+    python -m benchmarks.bench_logging --commands 2000
+
+"""
+import argparse
+import atexit
+import configparser
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import database.migrations as migrations
+from database.database_setup import DbHandler
+import utils.account as account
+import utils.bets as bets
+import utils.log_config as log_config
+import utils.matches as matches
+from benchmarks.bench_indexes import seed
+from benchmarks.bench_memory import stub_context
+
+logger = logging.getLogger('marble_match')
+
+
+def reset_logging():
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith('marble_match.'):
+            logging.getLogger(name).setLevel(logging.NOTSET)
+
+
+def disabled(directory: str):
+    logger.setLevel(logging.CRITICAL + 1)
+
+
+def queued(level: str, directory: str):
+    config = configparser.ConfigParser()
+    config['LOGGING'] = {'level': level, 'console_level': 'CRITICAL', 'file': os.path.join(directory, 'queued.log')}
+    return log_config.configure(config)
+
+
+def synchronous(directory: str):
+    """Debug output written by the caller, as main.py logged before the queue"""
+    handler = logging.FileHandler(os.path.join(directory, 'sync.log'))
+    handler.setFormatter(logging.Formatter(log_config.FORMAT))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+
+MODES = [
+    ('disabled', disabled),
+    ('info, queued', lambda directory: queued('INFO', directory)),
+    ('debug, queued', lambda directory: queued('DEBUG', directory)),
+    ('debug, synchronous', synchronous),
+]
+
+
+def command(ctx, match_id: int):
+    """Reads a match, both its Accounts and the challenger's bets, like $current followed by $bets"""
+    account.cache.clear()
+    match = matches.get_match(ctx, match_id)
+    bets.get_bet_all(ctx, match.challenger)
+    return match.recipient
+
+
+def run_commands(ctx, match_ids: list, amount: int) -> float:
+    """Returns mean seconds per command"""
+    start = time.perf_counter()
+    for match_id in match_ids[:amount]:
+        command(ctx, match_id)
+    return (time.perf_counter() - start) / amount
+
+
+def format_cost(ctx, amount: int) -> tuple:
+    """Returns (eager, lazy) seconds per filtered out debug call given an Account"""
+    player = account.get_account_from_db(ctx, DbHandler.db_cnc, 100)
+    logger.setLevel(logging.INFO)
+
+    start = time.perf_counter()
+    for _ in range(amount):
+        logger.debug(f'account: {player}')
+    eager = (time.perf_counter() - start) / amount
+
+    start = time.perf_counter()
+    for _ in range(amount):
+        logger.debug('account: %s', player)
+    lazy = (time.perf_counter() - start) / amount
+    return eager, lazy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--matches', type=int, default=20000, help='matches_history rows, a tenth are active')
+    parser.add_argument('--bets', type=int, default=3, help='bets per match')
+    parser.add_argument('--commands', type=int, default=2000, help='commands run per mode')
+    args = parser.parse_args()
+
+    random.seed(0)
+    match_ids = [random.randint(1, args.matches // 10) for _ in range(args.commands)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Opened like DbHandler opens it, so any thread can use it
+        connection = sqlite3.connect(os.path.join(directory, 'bench.db'), check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        migrations.migrate(connection, target=1)
+        seed(connection, args.users, args.matches, args.bets)
+        migrations.migrate(connection)
+        DbHandler.db_cnc = connection
+        ctx = stub_context(1)
+
+        # Warm the statement cache so the first mode isn't charged for it
+        disabled(directory)
+        run_commands(ctx, match_ids, min(100, args.commands))
+
+        results = {}
+        for name, setup in MODES:
+            reset_logging()
+            listener = setup(directory)
+            results[name] = run_commands(ctx, match_ids, args.commands)
+            if listener is not None:
+                listener.stop()
+                atexit.unregister(listener.stop)
+        reset_logging()
+
+        eager, lazy = format_cost(ctx, args.commands * 10)
+        connection.close()
+
+    baseline = results['disabled']
+    print(f'{"logging":<22}{"ms/command":>12}{"overhead":>10}')
+    for name, seconds in results.items():
+        print(f'{name:<22}{seconds * 1000:>12.3f}{seconds / baseline - 1:>10.0%}')
+    print(f'\nfiltered out debug call with an Account: eager f-string {eager * 1e6:.2f}us, '
+          f'lazy %-style {lazy * 1e6:.2f}us')
+
+
+if __name__ == '__main__':
+    main()
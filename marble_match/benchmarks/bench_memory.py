@@ -0,0 +1,102 @@
+"""Measures memory held by loaded match and bet histories and leaderboards, with and without slotted models
+
+Run from the marble_match directory:
+
+    python -m benchmarks.bench_memory --users 2000 --matches 200000 --bets 3
+
+"""
+import argparse
+import dataclasses
+import os
+import random
+import sqlite3
+import tempfile
+import tracemalloc
+import types
+
+import database.migrations as migrations
+from database.database_setup import DbHandler
+import utils.account as account
+import utils.bets as bets
+import utils.matches as matches
+from benchmarks.bench_indexes import seed
+
+
+def unslotted(cls):
+    """Returns slotted dataclass cls rebuilt with a per-instance __dict__, as models were before"""
+    names = {field.name for field in dataclasses.fields(cls)}
+    namespace = {key: value for key, value in cls.__dict__.items() if key not in names and key != '__slots__'}
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+class StubBot:
+    def add_listener(self, func, name):
+        pass
+
+
+def stub_context(server_id: int):
+    """Context with just what loaders read, members aren't resolved"""
+    guild = types.SimpleNamespace(id=server_id, name='bench', members=[])
+    return types.SimpleNamespace(guild=guild, bot=StubBot(), channel=None)
+
+
+def measure(load) -> tuple:
+    """Returns (bytes held by the result of load, amount of rows it loaded), starting from an empty Account cache"""
+    account.cache.clear()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = load()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return held, len(result)
+
+
+def run_loads(ctx, player: account.Account, leaderboard: int) -> dict:
+    """Returns dict of load name to (bytes, rows)"""
+    return {
+        'match history': measure(lambda: matches.get_matches_all(ctx, player, history=True)),
+        'bet history': measure(lambda: bets.get_bet_all(ctx, player, history=True)),
+        'leaderboard': measure(lambda: account.get_leaderboard(ctx, DbHandler.db_cnc, ctx.guild.id, 'wins',
+                                                               leaderboard)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--matches', type=int, default=200000, help='matches_history rows, a tenth are active')
+    parser.add_argument('--bets', type=int, default=3, help='bets per match')
+    parser.add_argument('--leaderboard', type=int, default=1000, help='leaderboard rows loaded')
+    args = parser.parse_args()
+
+    random.seed(0)
+    slotted_models = (account.Account, matches.Match, bets.Bet)
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, 'bench.db'),
+                                     detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        migrations.migrate(connection, target=1)
+        seed(connection, args.users, args.matches, args.bets)
+        migrations.migrate(connection)
+        DbHandler.db_cnc = connection
+
+        # Player 100 is on the larger server
+        ctx = stub_context(1)
+        player = account.get_account_from_db(ctx, connection, 100)
+
+        account.Account, matches.Match, bets.Bet = (unslotted(model) for model in slotted_models)
+        before = run_loads(ctx, player, args.leaderboard)
+        account.Account, matches.Match, bets.Bet = slotted_models
+        after = run_loads(ctx, player, args.leaderboard)
+        connection.close()
+
+    print(f'{"load":<16}{"rows":>8}{"dict B/row":>14}{"slots B/row":>14}{"saved":>8}')
+    for name in before:
+        rows = after[name][1]
+        dict_row = before[name][0] / rows
+        slots_row = after[name][0] / rows
+        print(f'{name:<16}{rows:>8}{dict_row:>14.0f}{slots_row:>14.0f}{1 - slots_row / dict_row:>8.0%}')
+
+
+if __name__ == '__main__':
+    main()
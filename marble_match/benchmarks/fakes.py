@@ -0,0 +1,107 @@
+"""Stand-ins for the discord objects cogs use, so commands can run without a connection to Discord"""
+import asyncio
+import itertools
+
+import discord
+
+# Ids of sent messages
+_message_ids = itertools.count(1)
+
+
+class FakeUser:
+    """User a FakeMember is of, what discord.Member reads through _user"""
+    __slots__ = ('id', 'name', 'discriminator', 'bot')
+
+    def __init__(self, id: int, name: str, discriminator: str = '0001'):
+        self.id = id
+        self.name = name
+        self.discriminator = discriminator
+        self.bot = False
+
+    def __str__(self):
+        return f'{self.name}#{self.discriminator}'
+
+    def __hash__(self):
+        return self.id >> 22
+
+
+class FakeMember(discord.Member):
+    """discord.Member that's built from an id and name instead of gateway data"""
+
+    def __init__(self, id: int, name: str, guild: 'FakeGuild', nick: str = None):
+        self._user = FakeUser(id, name)
+        self.guild = guild
+        self.nick = nick
+
+
+class FakeGuild:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+        self.members = []
+        self.me = FakeMember(id * 1000000, 'marble-bot', self)
+
+    def get_member(self, member_id: int):
+        return next((member for member in self.members if member.id == member_id), None)
+
+
+class FakeChannel:
+    def __init__(self, guild: FakeGuild):
+        self.id = guild.id + 1
+        self.guild = guild
+
+
+class FakeMessage:
+    """Sent message, edits and reactions are recorded instead of sent"""
+
+    def __init__(self, content: str):
+        self.id = next(_message_ids)
+        self.content = content
+        self.reactions = []
+
+    async def edit(self, content: str = None, **kwargs):
+        self.content = content
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    async def remove_reaction(self, emoji, member):
+        pass
+
+    async def clear_reactions(self):
+        self.reactions.clear()
+
+
+class FakeBot:
+    """Bot with no events, wait_for times out right away"""
+
+    def __init__(self):
+        self.user = None
+        self.cached_messages = []
+        self.listeners = {}
+
+    def add_listener(self, func, name: str):
+        self.listeners.setdefault(name, []).append(func)
+
+    async def wait_for(self, event: str, timeout: float = None, check=None):
+        raise asyncio.TimeoutError
+
+
+class FakeContext:
+    """commands.Context of author in guild, messages sent to it are kept in sent"""
+
+    def __init__(self, bot: FakeBot, guild: FakeGuild, author: FakeMember):
+        self.bot = bot
+        self.guild = guild
+        self.author = author
+        self.me = guild.me
+        self.channel = FakeChannel(guild)
+        self.sent = []
+
+    async def send(self, content: str = None, **kwargs) -> FakeMessage:
+        message = FakeMessage(content)
+        self.sent.append(message)
+        return message
+
+    async def send_help(self, *args):
+        pass
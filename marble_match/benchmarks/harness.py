@@ -0,0 +1,154 @@
+"""Runs real cog commands against a seeded temporary database, with fake discord objects from benchmarks.fakes"""
+import datetime
+import random
+import sqlite3
+import threading
+import time
+
+import database.database_async as database_async
+import database.database_setup as database_setup
+import database.migrations as migrations
+from database.database_setup import DbHandler
+import utils.account as account
+import utils.economy as economy
+import utils.nicknames as nicknames
+import utils.paginator as paginator
+from benchmarks.fakes import FakeBot, FakeContext, FakeGuild, FakeMember
+from cogs.bet_control import BetCog
+from cogs.history import HistoryCog
+from cogs.match import MatchCog
+from cogs.stats import StatsCog
+
+# Marbles every seeded player starts with
+STARTING_MARBLES = 1000
+
+
+class StatementCounter:
+    """Counts statements and commits on every connection it's attached to, from any thread"""
+
+    def __init__(self):
+        self.statements = 0
+        self.commits = 0
+        self._lock = threading.Lock()
+
+    def attach(self, connection: sqlite3.Connection):
+        connection.set_trace_callback(self.trace)
+
+    def trace(self, statement: str):
+        with self._lock:
+            if statement.startswith('COMMIT'):
+                self.commits += 1
+            elif not statement.startswith(('BEGIN', 'ROLLBACK', 'PRAGMA')):
+                self.statements += 1
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return self.statements, self.commits
+
+
+def member_id(guild_id: int, index: int) -> int:
+    return guild_id * 1000000 + index
+
+
+def seed(connection: sqlite3.Connection, guilds: int, members: int, history: int, bets: int) -> list:
+    """Fills a migrated database with guilds of members and their histories, returns the FakeGuilds
+
+    **Arguments**
+
+    - `<connection>` Connection to the database
+    - `<guilds>` Amount of guilds
+    - `<members>` Members in each guild, all of them players
+    - `<history>` Finished matches per member
+    - `<bets>` Bets on each finished match
+
+    """
+    now = datetime.datetime.utcnow()
+    cur = connection.cursor()
+    fake_guilds = []
+    for guild_id in range(1, guilds + 1):
+        guild = FakeGuild(guild_id, f'guild{guild_id}')
+        guild.members = [FakeMember(member_id(guild_id, i), f'g{guild_id}member{i}', guild) for i in range(1, members + 1)]
+        fake_guilds.append(guild)
+
+        cur.executemany("INSERT INTO users(uuid, nickname, marbles, server_id, wins, loses) VALUES (?, ?, ?, ?, 0, 0)",
+                        [(member.id, str(member), STARTING_MARBLES, guild_id) for member in guild.members])
+        cur.execute("SELECT id FROM users WHERE server_id=?", [guild_id])
+        player_ids = [row[0] for row in cur.fetchall()]
+
+        matches = []
+        for _ in range(members * history // 2):
+            challenger, recipient = random.sample(player_ids, 2)
+            matches.append((5, challenger, recipient, random.choice((challenger, recipient)),
+                            now - datetime.timedelta(minutes=random.randint(1, 525600))))
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM matches_history")
+        first_id = cur.fetchone()[0] + 1
+        cur.executemany("INSERT INTO matches_history(amount, participant1, participant2, winner_id, match_time, game, "
+                        "format) VALUES (?, ?, ?, ?, ?, 'melee', 'Bo3')", matches)
+        cur.executemany("INSERT INTO bets_history(amount, match_id, better_id, participant1, winner_id, bet_time) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [(2, first_id + i, random.choice(player_ids), random.choice(match[1:3]), match[3], match[4])
+                         for i, match in enumerate(matches) for _ in range(bets)])
+
+    # Finished matches and bets keep the ids they had, new ones have to start after them
+    for table in ('matches', 'bets'):
+        cur.execute("DELETE FROM sqlite_sequence WHERE name=?", [table])
+        cur.execute(f"INSERT INTO sqlite_sequence(name, seq) SELECT ?, COALESCE(MAX(id), 0) FROM {table}_history",
+                    [table])
+
+    # Opening balances, so the ledger agrees with users
+    cur.execute("INSERT INTO marble_ledger(player_id, server_id, amount, balance, reason, reference_id, created_at) "
+                "SELECT id, server_id, marbles, marbles, 'opening', NULL, ? FROM users", [now])
+    connection.commit()
+    return fake_guilds
+
+
+class World:
+    """Seeded database with the cogs commands are run on"""
+
+    def __init__(self, path: str, guilds: int, members: int, history: int, bets: int):
+        start = time.perf_counter()
+        connection = database_setup.create_connection(path, database_setup.get_pragmas(database_setup.read_config()))
+        migrations.migrate(connection)
+        self.guilds = seed(connection, guilds, members, history, bets)
+        migrations.migrate(connection)
+        self.seconds = time.perf_counter() - start
+
+        self.counter = StatementCounter()
+        self.counter.attach(connection)
+        database_setup.connection_listeners.append(self.counter.attach)
+        DbHandler.db_cnc = connection
+        reset_caches()
+
+        self.bot = FakeBot()
+        self.cogs = {cog.__class__.__name__: cog for cog in (MatchCog(self.bot), BetCog(self.bot),
+                                                              HistoryCog(self.bot), StatsCog(self.bot))}
+
+    def context(self, member: FakeMember) -> FakeContext:
+        return FakeContext(self.bot, member.guild, member)
+
+    def close(self):
+        database_setup.connection_listeners.remove(self.counter.attach)
+        paginator.dispatcher.paginators.clear()
+
+
+def reset_caches():
+    """Empties caches filled from another database"""
+    account.cache.clear()
+    nicknames.cache.clear()
+    economy.cache.clear()
+
+
+async def invoke(command, cog, ctx: FakeContext, *args):
+    """Runs command of cog like the bot would after parsing args, errors go to the command's error handler"""
+    try:
+        await command.callback(cog, ctx, *args)
+    except Exception as e:
+        if command.on_error is None:
+            raise
+        await command.on_error(cog, ctx, e)
+
+
+async def find_match(member: FakeMember) -> int:
+    """Returns id of the active match member plays in, 0 if there isn't one"""
+    player_id = await database_async.get_player_id(DbHandler.db_cnc, member.id, member.guild.id)
+    return await database_async.find_match_by_player_id(DbHandler.db_cnc, player_id)
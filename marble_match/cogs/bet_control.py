@@ -4,6 +4,7 @@ from typing import Union
 import discord
 from discord.ext import commands
 
+import database.database_async as database_async
 import database.database_operation as database_operation
 from database.database_setup import DbHandler
 import utils.discord_utils as du
@@ -35,7 +36,7 @@ class BetCog(commands.Cog, name='Bets'):
         - `<match_id>` The id of the match you'd like to bet on
         - `<marbles>` Amount of marbles you'd like to bet on the match.
         """
-        logger.debug(f'bet: {bet_target}, {match_id}, {marbles}')
+        logger.debug('bet: %s, %s, %s', bet_target, match_id, marbles)
 
         # Check if marbles is less than 0, return if not
         if marbles < 0:
@@ -43,18 +44,18 @@ class BetCog(commands.Cog, name='Bets'):
             return
 
         # Get bettor/bet_target_id accounts
-        bettor_acc = acc.get_account(ctx, DbHandler.db_cnc, ctx.author)
-        bet_target_acc = acc.get_account(ctx, DbHandler.db_cnc, bet_target)
-        logger.debug(f'bettor: {bettor_acc}, bet_target: {bet_target_acc}')
+        bettor_acc = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, ctx.author)
+        bet_target_acc = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, bet_target)
+        logger.debug('bettor: %s, bet_target: %s', bettor_acc, bet_target_acc)
 
-        # Check if marble count for bettor is greater than marbles
+        # Check if marble count for bettor is greater than marbles, checked again by the debit in case it changed
         if bettor_acc.marbles < marbles:
             await du.code_message(ctx, f'You do not have enough marbles for this bet\n'
                                        f'You have {bettor_acc.marbles} and need {marbles}')
             return
 
         # Get match_info and validate
-        match_info = ma.get_match(ctx, match_id)  # database_operation.get_match_info_by_id(DbHandler.db_cnc, match_id)
+        match_info = await database_async.run(ma.get_match, ctx, match_id)
         if not match_info:
             await du.code_message(ctx, 'Invalid match id')
             return
@@ -69,38 +70,41 @@ class BetCog(commands.Cog, name='Bets'):
             await du.code_message(ctx, 'You can only bet on matches that both players have accepted')
             return
 
-        # Check to make sure person placing bet is not in the match
-        if match_info.challenger == bettor_acc or match_info.recipient == bettor_acc:
+        # Check to make sure person placing bet is not in the match, by id so the participants aren't loaded
+        if bettor_acc.id in (match_info.challenger_id, match_info.recipient_id):
             await du.code_message(ctx, 'You cannot bet on matches you are in')
             return
 
         # Check to make sure bet_target_id is in match
-        if match_info.challenger.id != bet_target_acc.id:
-            if match_info.recipient.id != bet_target_acc.id:
+        if match_info.challenger_id != bet_target_acc.id:
+            if match_info.recipient_id != bet_target_acc.id:
                 await du.code_message(ctx, 'Player is not in this match')
                 return
 
         # Get bet_id if exists,
-        bet_id = database_operation.find_bet(DbHandler.db_cnc, match_id, bettor_acc.id)
+        bet_id = await database_async.find_bet(DbHandler.db_cnc, match_id, bettor_acc.id)
 
         # If bet exists, and marbles is zero delete bet
         if bet_id != 0:
             # Get bet with bet_id if it's not zero
-            bet_info = bets.get_bet(ctx, bet_id)
+            bet_info = await database_async.run(bets.get_bet, ctx, bet_id)
 
             if marbles == 0:
                 # Delete bet, and return marbles to bettor
-                bet_info.delete_bet()
-                bettor_acc.marbles += bet_info.amount
+                def delete_bet():
+                    bet_info.delete_bet()
+                    bettor_acc.add_marbles(bet_info.amount, database_operation.LEDGER_BET_REFUND, bet_info.id)
+                await database_async.run_unit(delete_bet)
                 await du.code_message(ctx, 'Bet deleted')
                 return
 
             # Update bet
-            # Add marbles back to user, then subtract the new amount
-            bettor_acc.marbles += bet_info.amount
-            bettor_acc.marbles -= marbles
-            bet_info.bet_target = bet_target_acc
-            bet_info.amount = marbles
+            def update_bet():
+                # Take the difference to the new amount in one update, only if bettor has enough
+                bettor_acc.spend_marbles(marbles - bet_info.amount, database_operation.LEDGER_BET, bet_info.id)
+                bet_info.bet_target = bet_target_acc
+                bet_info.amount = marbles
+            await database_async.run_unit(update_bet)
             await du.code_message(ctx, 'Bet updated')
             return
 
@@ -109,10 +113,12 @@ class BetCog(commands.Cog, name='Bets'):
             await du.code_message(ctx, 'Cannot be zero')
             return
 
-        # Create bet
-        bets.create_bet(ctx, None, marbles, match_info, bettor_acc, bet_target_acc)
-        # Take marbles
-        bettor_acc.marbles = bettor_acc.marbles - marbles
+        def place_bet():
+            # Create bet
+            new_bet = bets.create_bet(ctx, None, marbles, match_info, bettor_acc, bet_target_acc)
+            # Take marbles, only if bettor still has them, otherwise the bet is rolled back
+            bettor_acc.spend_marbles(marbles, database_operation.LEDGER_BET, new_bet.id if new_bet else None)
+        await database_async.run_unit(place_bet)
         await du.code_message(ctx, 'Bet submitted')
 
     @bet.error
@@ -134,6 +140,8 @@ class BetCog(commands.Cog, name='Bets'):
             await du.code_message(ctx, f"Unexpected value, {error.attribute}", 3)
         elif isinstance(error, exception.InvalidNickname):
             await du.code_message(ctx, error.message, 3)
+        elif isinstance(error, exception.NotEnoughMarbles):
+            await du.code_message(ctx, error.message, 3)
 
 
 def setup(bot):
@@ -4,12 +4,14 @@ from typing import Union
 import discord
 from discord.ext import commands
 
-import database.database_operation as database_operation
+import database.database_async as database_async
 from database.database_setup import DbHandler
 import utils.discord_utils as du
 import utils.account as accounts
 import utils.matches as matches
 import utils.bets as bets
+import utils.exception as exception
+import utils.metrics as metrics
 
 logger = logging.getLogger(f'marble_match.{__name__}')
 
@@ -23,9 +25,9 @@ class DebugCog(commands.Cog, name='Debug'):
     @commands.guild_only()
     async def test(self, ctx: commands.Context):
         # Get match
-        match = matches.get_match(ctx, 1, True)
+        match = await database_async.run(matches.get_match, ctx, 1, True)
         # Process bets
-        bets.process_bets(ctx, match)
+        await database_async.run(bets.process_bets, ctx, match)
         pass
 
     @commands.command(name='create_bet_debug')
@@ -33,20 +35,20 @@ class DebugCog(commands.Cog, name='Debug'):
     async def create_bet_debug(self, ctx: commands.Context, amount: int, bettor: discord.Member,
                                bet_target: discord.Member, is_history: bool = False, winner: discord.Member = None,
                                id_range_start: int = 0, id_range_end: int = 0):
-        bettor_id = du.get_id_by_member(ctx, DbHandler.db_cnc, bettor)
-        bet_target_id = du.get_id_by_member(ctx, DbHandler.db_cnc, bet_target)
+        bettor_id = await database_async.run(du.get_id_by_member, ctx, DbHandler.db_cnc, bettor)
+        bet_target_id = await database_async.run(du.get_id_by_member, ctx, DbHandler.db_cnc, bet_target)
         if winner:
-            winner_id = du.get_id_by_member(ctx, DbHandler.db_cnc, winner)
+            winner_id = await database_async.run(du.get_id_by_member, ctx, DbHandler.db_cnc, winner)
 
         if id_range_start:
             for i in range(id_range_start, id_range_end):
                 if is_history:
-                    database_operation.create_bet_history(DbHandler.db_cnc, i, amount, i, bettor_id, bet_target_id,
-                                                          winner_id)
+                    await database_async.create_bet_history(DbHandler.db_cnc, i, amount, i, bettor_id, bet_target_id,
+                                                            winner_id)
                 else:
-                    database_operation.create_bet(DbHandler.db_cnc, i, amount, i, bettor_id, bet_target_id)
+                    await database_async.create_bet(DbHandler.db_cnc, i, amount, i, bettor_id, bet_target_id)
         else:
-            database_operation.create_bet(DbHandler.db_cnc, None, amount, None, bettor_id, bet_target_id)
+            await database_async.create_bet(DbHandler.db_cnc, None, amount, None, bettor_id, bet_target_id)
 
     @commands.command(name='create_match_debug')
     @commands.guild_only()
@@ -54,13 +56,112 @@ class DebugCog(commands.Cog, name='Debug'):
                                  challenger: discord.Member, recipient: discord.Member, accepted: bool, count: int):
         """
         """
-        logger.debug(f'create_match_debug: {amount}, {active}, {challenger}, {recipient}, {accepted}, {count}')
+        logger.debug('create_match_debug: %s, %s, %s, %s, %s, %s',
+                     amount, active, challenger, recipient, accepted, count)
+        challenger_acc = await database_async.run(accounts.get_account, ctx, DbHandler.db_cnc, challenger)
+        recipient_acc = await database_async.run(accounts.get_account, ctx, DbHandler.db_cnc, recipient)
         x = 0
         while x < count:
-            matches.create_match(ctx, None, amount, accounts.get_account(ctx, DbHandler.db_cnc, challenger),
-                                 accounts.get_account(ctx, DbHandler.db_cnc, recipient), active, accepted)
+            await database_async.run(matches.create_match, ctx, None, amount, challenger_acc, recipient_acc,
+                                     active, accepted)
             x += 1
 
 
+    @commands.command(name='ledger_check', help='Checks every balance against the marble ledger')
+    @commands.guild_only()
+    @commands.has_role('Admin')
+    async def ledger_check(self, ctx: commands.Context, rebuild: bool = False):
+        """Checks that every users marbles match the sum of their ledger entries, and optionally fixes them
+
+        Examples:
+            - `$ledger_check`
+            - `$ledger_check true`
+
+        **Arguments**
+
+        - `<ctx>` The context used to send confirmations.
+        - `<rebuild>` Set mismatched balances to their ledger total.
+
+        """
+        logger.debug('ledger_check: %s', rebuild)
+
+        mismatched = await database_async.verify_ledger(DbHandler.db_cnc, ctx.guild.id)
+        if isinstance(mismatched, int):
+            raise exception.UnableToRead(attribute='marble_ledger')
+
+        if not mismatched:
+            await du.code_message(ctx, 'Every balance matches the ledger')
+            return
+
+        text = f'{len(mismatched)} balances do not match the ledger\n'
+        for player_id, marbles, total in mismatched[:10]:
+            text += f'Player {player_id}: {marbles} marbles, ledger {total}\n'
+
+        if rebuild:
+            changed = await database_async.rebuild_balances(DbHandler.db_cnc, ctx.guild.id)
+            text += f'Rebuilt {changed} balances from the ledger'
+
+        await du.code_message(ctx, text)
+
+    @ledger_check.error
+    async def generic_error(self, ctx, error):
+        if isinstance(error, commands.MissingRequiredArgument):
+            await du.code_message(ctx, f"You're missing required argument: {error.param.name}", 3)
+            await ctx.send_help('ledger_check')
+        elif isinstance(error, commands.CheckFailure):
+            await du.code_message(ctx, f"You're unable to use this command in a dm.", 3)
+        elif isinstance(error, exception.UnableToRead):
+            await du.code_message(ctx, f'Error reading {error.attribute}', 3)
+        elif isinstance(error, exception.UnableToWrite):
+            await du.code_message(ctx, f"Error writing {error.attribute}", 3)
+        elif isinstance(error, exception.UnableToDelete):
+            await du.code_message(ctx, f"Error deleting {error.attribute}", 3)
+        elif isinstance(error, exception.UnexpectedEmpty):
+            await du.code_message(ctx, f"Error unexpected empty {error.attribute}", 3)
+        elif isinstance(error, exception.UnexpectedValue):
+            await du.code_message(ctx, f"Unexpected value, {error.attribute}", 3)
+        elif isinstance(error, exception.InvalidNickname):
+            await du.code_message(ctx, error.message, 3)
+
+    @commands.command(name='perf', help='Shows how long commands take and the database work they do')
+    @commands.guild_only()
+    @commands.has_role('Admin')
+    async def perf(self, ctx: commands.Context, top: int = 10):
+        """Sends latency and database cost of the commands with the most database time since the bot started
+
+        Examples:
+            - `$perf`
+            - `$perf 5`
+
+        **Arguments**
+
+        - `<ctx>` The context used to send the table.
+        - `<top>` Amount of commands to show.
+
+        """
+        logger.debug('perf: %s', top)
+
+        await du.code_message(ctx, metrics.table(max(1, min(top, 25))))
+
+    @perf.error
+    async def generic_error(self, ctx, error):
+        if isinstance(error, commands.MissingRequiredArgument):
+            await du.code_message(ctx, f"You're missing required argument: {error.param.name}", 3)
+            await ctx.send_help('perf')
+        elif isinstance(error, commands.CheckFailure):
+            await du.code_message(ctx, f"You're unable to use this command in a dm.", 3)
+        elif isinstance(error, exception.UnableToRead):
+            await du.code_message(ctx, f'Error reading {error.attribute}', 3)
+        elif isinstance(error, exception.UnableToWrite):
+            await du.code_message(ctx, f"Error writing {error.attribute}", 3)
+        elif isinstance(error, exception.UnableToDelete):
+            await du.code_message(ctx, f"Error deleting {error.attribute}", 3)
+        elif isinstance(error, exception.UnexpectedEmpty):
+            await du.code_message(ctx, f"Error unexpected empty {error.attribute}", 3)
+        elif isinstance(error, exception.UnexpectedValue):
+            await du.code_message(ctx, f"Unexpected value, {error.attribute}", 3)
+        elif isinstance(error, exception.InvalidNickname):
+            await du.code_message(ctx, error.message, 3)
+
 def setup(bot: commands.Bot):
     bot.add_cog(DebugCog(bot))
@@ -3,12 +3,13 @@ from typing import Union
 
 import discord
 from discord.ext import commands
-import numpy as np
 
+import database.database_async as database_async
 import database.database_operation as database_operation
 from database.database_setup import DbHandler
 import utils.discord_utils as du
 import utils.account as acc
+import utils.economy as economy
 import utils.exception as exception
 
 logger = logging.getLogger(f'marble_match.{__name__}')
@@ -39,15 +40,15 @@ class EconCog(commands.Cog, name='Marbles'):
         - `<marbles>` Amount to set users.
 
         """
-        logger.debug(f'set_marbles: {member}, {marbles}')
+        logger.debug('set_marbles: %s, %s', member, marbles)
 
-        account = acc.get_account(ctx, DbHandler.db_cnc, member)
+        account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
 
         if marbles < 0:
             await du.code_message(ctx, 'You cannot set a users marbles to any negative number')
             return
 
-        account.marbles = marbles
+        await database_async.run(setattr, account, 'marbles', marbles)
 
         await du.code_message(ctx, f'Set {account.nickname}\'s marbles to {account.marbles}')
 
@@ -88,15 +89,15 @@ class EconCog(commands.Cog, name='Marbles'):
         - `<marbles>` Amount to add to users bank.
 
         """
-        logger.debug(f'add_marbles: {member}, {marbles}')
+        logger.debug('add_marbles: %s, %s', member, marbles)
 
         if marbles < 1:
             await du.code_message(ctx, 'You cannot add non positive numbers to a users marble bank')
             return
 
-        account = acc.get_account(ctx, DbHandler.db_cnc, member)
+        account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
 
-        account.marbles += marbles
+        await database_async.run(account.add_marbles, marbles, database_operation.LEDGER_ADMIN_ADD)
 
         await du.code_message(ctx, f'Added {marbles} to {account.nickname}\'s bank.'
                                    f'\nTheir new balance is {account.marbles}!')
@@ -138,15 +139,15 @@ class EconCog(commands.Cog, name='Marbles'):
         - `<marbles>` Amount of marbles to subtract.
 
         """
-        logger.debug(f'subtract_marbles: {member}, {marbles}')
+        logger.debug('subtract_marbles: %s, %s', member, marbles)
 
         if marbles < 1:
             await du.code_message(ctx, 'You cannot subtract non positive numbers to a users marble bank')
             return
 
-        account = acc.get_account(ctx, DbHandler.db_cnc, member)
+        account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
 
-        account.marbles -= marbles
+        await database_async.run(account.subtract_marbles, marbles, database_operation.LEDGER_ADMIN_SUB)
 
         await du.code_message(ctx, f'Removed {marbles} from '
                                    f'{account.nickname}\'s bank.'
@@ -187,14 +188,14 @@ class EconCog(commands.Cog, name='Marbles'):
         - `<member>` The member who's marble count you want to see. If omitted defaults to your own marbles.
 
         """
-        logger.debug(f'marbles: {member}')
+        logger.debug('marbles: %s', member)
 
         if member is None:
-            account = acc.get_account(ctx, DbHandler.db_cnc, ctx.author)
+            account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, ctx.author)
         else:
-            account = acc.get_account(ctx, DbHandler.db_cnc, member)
+            account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
 
-        logger.debug(f'account: {account}')
+        logger.debug('account: %s', account)
 
         await du.code_message(ctx, f"{account.nickname} has {account.marbles} marbles")
 
@@ -234,28 +235,27 @@ class EconCog(commands.Cog, name='Marbles'):
         - `<marbles>` Amount to transfer to a user from your bank
 
         """
-        logger.debug(f'transfer: {member}, {marbles}')
+        logger.debug('transfer: %s, %s', member, marbles)
 
         if marbles < 1:
             await du.code_message(ctx, 'You cannot send non positive amounts of marbles')
             return
 
-        author_account = acc.get_account(ctx, DbHandler.db_cnc, ctx.author)
-        target_account = acc.get_account(ctx, DbHandler.db_cnc, member)
-        logger.debug(f'author_account: {author_account}, target_account: {target_account}')
+        author_account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, ctx.author)
+        target_account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
+        logger.debug('author_account: %s, target_account: %s', author_account, target_account)
 
         # Check if author account and member account are not the same
         if author_account == target_account:
             await du.code_message(ctx, 'You cannot send marbles to yourself')
             return
 
-        if author_account.marbles < marbles:
+        # Balance is checked again by the transfer itself, in case it changed since the account was loaded
+        if author_account.marbles < marbles or \
+                not await database_async.run(author_account.transfer_marbles, target_account, marbles):
             await du.code_message(ctx, 'You don\'t have enough marbles for this transaction')
             return
 
-        author_account.marbles -= marbles
-        target_account.marbles += marbles
-
         await du.code_message(ctx, f'Marbles transferred! Your new balances are:'
                                    f'\n{author_account.nickname}: {author_account.marbles} marbles'
                                    f'\n{target_account.nickname}: {target_account.marbles} marbles')
@@ -294,12 +294,12 @@ class EconCog(commands.Cog, name='Marbles'):
 
         """
 
-        players = database_operation.get_player_info_all_by_server(DbHandler.db_cnc, ctx.guild.id)
-        marbles = 0
-        for user in players:
-            marbles += user[2]
+        summary = await database_async.read(economy.get_summary, DbHandler.db_cnc, ctx.guild.id)
+        if summary is None:
+            await du.code_message(ctx, 'There are no players on this server')
+            return
 
-        await du.code_message(ctx, f'There are currently {marbles} marbles in circulation')
+        await du.code_message(ctx, f'There are currently {summary.circulation} marbles in circulation')
 
     @summery.error
     async def generic_error(self, ctx, error):
@@ -333,31 +333,22 @@ class EconCog(commands.Cog, name='Marbles'):
 
         """
 
-        count = 0
-        sum_marbles = 0
-        marbles = []
-        players = database_operation.get_player_info_all_by_server(DbHandler.db_cnc, ctx.guild.id)
-        for user in players:
-            sum_marbles += user[2]
-            marbles.append(np.float64(user[2]))
-            count += 1
-
-        # TODO: Add other calculations for server economy
-
-        # Gini coefficient
-        array = np.array(marbles)
-        array = array.flatten()
-        if np.amin(array) < 0:
-            array -= np.amin(array)
-        array += 0.0000001
-        array = np.sort(array)
-        index = np.arange(1, array.shape[0] + 1)
-        n = array.shape[0]
-        gini = ((np.sum((2 * index - n - 1) * array)) / (n * np.sum(array)))
-
-        await du.code_message(ctx, f'There are currently {sum_marbles} marbles in circulation\n'
-                                   f'The current mean marble count is {int(sum_marbles / count)}\n'
-                                   f'Inequality index is {gini:.4f}\n')
+        summary = await database_async.read(economy.get_summary, DbHandler.db_cnc, ctx.guild.id)
+        if summary is None:
+            await du.code_message(ctx, 'There are no players on this server')
+            return
+
+        percentiles = ', '.join(f'{percentile}th: {value:.0f}' for percentile, value in summary.percentiles.items())
+        lorenz = ', '.join(f'{population:.0%}: {share:.1%}' for population, share in summary.lorenz[1:-1])
+
+        await du.code_message(ctx, f'There are currently {summary.circulation} marbles in circulation\n'
+                                   f'between {summary.players} players\n'
+                                   f'The current mean marble count is {int(summary.mean)}\n'
+                                   f'The current median marble count is {summary.median:.0f}\n'
+                                   f'Percentiles {percentiles}\n'
+                                   f'Inequality index is {summary.gini:.4f}\n'
+                                   f'The top {economy.TOP_SHARE:.0%} of players hold {summary.top_share:.1%}\n'
+                                   f'Marbles held by the poorest {lorenz}\n')
 
     @ex_summery.error
     async def generic_error(self, ctx, error):
@@ -1,4 +1,3 @@
-import asyncio
 import math
 import datetime
 import logging
@@ -8,15 +7,20 @@ import pytz
 import discord
 from discord.ext import commands
 
+import database.database_async as database_async
 from database.database_setup import DbHandler
 import utils.discord_utils as du
 import utils.account as acc
 import utils.matches as ma
 import utils.bets as bets
 import utils.exception as exception
+import utils.paginator as paginator
 
 logger = logging.getLogger(f'marble_match.{__name__}')
 
+# Rows shown per history page
+PAGE_SIZE = 10
+
 
 class HistoryCog(commands.Cog, name='History'):
 
@@ -88,7 +92,7 @@ class HistoryCog(commands.Cog, name='History'):
         - `<vs>` The user to limit the match history to only games with them
 
         """
-        logger.debug(f'match_history: {member}, {vs}')
+        logger.debug('match_history: %s, %s', member, vs)
 
         # Declare player2 as none for failsafe with ma.get_matches_all
         player2 = None
@@ -98,100 +102,26 @@ class HistoryCog(commands.Cog, name='History'):
             member = ctx.author
         # Check if vs exists, get player2 if it does
         if vs:
-            player2 = acc.get_account(ctx, DbHandler.db_cnc, vs)
+            player2 = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, vs)
 
-        # Get player1 and their match history
-        player1 = acc.get_account(ctx, DbHandler.db_cnc, member)
-        match_history = ma.get_matches_all(ctx, player1, player2, True)
+        # Get player1 and the amount of matches in their history
+        player1 = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
+        player2_id = player2.id if player2 is not None else None
+        match_count = await database_async.count_match_history(DbHandler.db_cnc, player1.id, player2_id)
 
         # Check if match_history is not 0
-        if not match_history:
+        if not match_count:
             await du.code_message(ctx, 'No match history')
             return
 
-        # Instantiate text and match_list to be appended later
-        text = ''
-        match_list = match_history
-
-        # Set pages to amount of match_list/10 in an even amount, cur_page to last page, and active to true
-        text = ''
-        pages = math.ceil(len(match_list)/10)
-        cur_page = pages-1
-        # Used to loop waiting for a react
-        active = True
-
-        # Generate page from match_list
-        for i in range(cur_page*10, (cur_page*10) + 10):
-            if i < len(match_list):
-                text += self.generate_match_text(match_list[i])  # text += str(match_list[i])
-
-        # If pages is greater than one, add a page counter, if not set active to False
-        if pages > 1:
-            text += f'Page {cur_page+1} of {pages}\n'
-        else:
-            active = False
-
-        # Create message with return of du.code_message
-        message = await du.code_message(ctx, text)
-
-        # If pages greater than one, add reaction controls
-        if pages > 1:
-            await message.add_reaction('\U00002B05')  # ⬅️
-            await message.add_reaction('\U000027A1')  # ➡️
-
-        # Method to check if react is the correction with the correct user
-        def check(reaction, user):
-            return user == ctx.author and str(reaction.emoji) in ['\U00002B05', '\U000027A1']
-
-        # While loop
-        while active:
-            try:
-                # page set to start of codeblock
-                page = '```\n'
-                # wait till we get a reaction, fill reaction, user with output of 'reaction_add'
-                reaction, user = await self.bot.wait_for('reaction_add', timeout=60, check=check)
-                # If reaction is left and cur_page is greater than 0
-                if str(reaction.emoji) == '\U00002B05' and cur_page > 0:  # ⬅️️
-                    # Set current page to one less than current
-                    cur_page -= 1
-
-                    # For range of pages for current list append match_list to page
-                    for i in range(cur_page*10, cur_page*10 + 10):
-                        page += self.generate_match_text(match_list[i])  # match_list[i]
-
-                    # Add page counter and edit message with page
-                    page += f'Page {cur_page+1} of {pages}\n```'
-                    await message.edit(content=page)
-
-                    # Remove users reaction
-                    await message.remove_reaction(reaction, user)
-
-                # If reaction is right and cur_page is less than pages-1
-                elif str(reaction.emoji) == '\U000027A1' and cur_page < pages-1:  # ➡️
-                    # Set current page to one more than current
-                    cur_page += 1
-
-                    # For range of pages for current list append match_list to page
-                    for i in range(cur_page*10, cur_page*10 + 10):
-                        if i < len(match_list):
-                            page += self.generate_match_text(match_list[i])  # match_list[i]
-
-                    # Add page counter and edit message with page
-                    page += f'Page {cur_page+1} of {pages}\n```'
-                    await message.edit(content=page)
-
-                    # Remove users reaction
-                    await message.remove_reaction(reaction, user)
-                else:
-                    # Remove reaction if it's anything else
-                    await message.remove_reaction(reaction, user)
-            except asyncio.TimeoutError:
-                # When 'reaction_add' throws exception, set active to False to end loop
-                active = False
-                # Get cached message to remove reactions
-                cached_msg = discord.utils.get(self.bot.cached_messages, id=message.id)
-                for reactions in cached_msg.reactions:
-                    await reactions.remove(self.bot.user)
+        # Fetch a page of match_history next to before_id or after_id
+        async def fetch(before_id: int = None, after_id: int = None):
+            return await database_async.read(ma.get_matches_all, ctx, player1, player2, True, PAGE_SIZE,
+                                             before_id, after_id)
+
+        # Send newest page, older pages are fetched when the user reacts
+        await paginator.paginate(ctx, math.ceil(match_count/PAGE_SIZE),
+                                 paginator.keyset_render(fetch, self.generate_match_text))
 
     @match_history.error
     async def generic_error(self, ctx, error):
@@ -230,7 +160,7 @@ class HistoryCog(commands.Cog, name='History'):
         - '<bet_target>' The user you want to limit bets on to.
 
         """
-        logger.debug(f'bet_history: {member}, {bet_target}')
+        logger.debug('bet_history: %s, %s', member, bet_target)
 
         # Declare bet_target_acc as failsafe for bets.get_bet_all
         bet_target_acc = None
@@ -239,93 +169,26 @@ class HistoryCog(commands.Cog, name='History'):
             member = ctx.author
         # If bet_target is not None, get bet_target info for specific search
         if bet_target:
-            bet_target_acc = acc.get_account(ctx, DbHandler.db_cnc, bet_target)
+            bet_target_acc = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, bet_target)
 
-        # Get bettor info and bet_history
-        bettor = acc.get_account(ctx, DbHandler.db_cnc, member)
-        bet_history = bets.get_bet_all(ctx, bettor, bet_target_acc, True)
+        # Get bettor info and the amount of bets in their history
+        bettor = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
+        bet_target_id = bet_target_acc.id if bet_target_acc is not None else None
+        bet_count = await database_async.count_bet_history(DbHandler.db_cnc, bettor.id, bet_target_id)
 
         # Check if bet_history is filled
-        if not bet_history:
+        if not bet_count:
             await du.code_message(ctx, 'No bet history')
             return
 
-        # Create variables to be appended
-        text = ''
-        bet_list = bet_history
-        # Set pages to bet_list/10 even, cur_page to pages-1 and active to True
-        pages = math.ceil(len(bet_list)/10)
-        cur_page = pages-1
-        active = True
-
-        # Generate first page to be displayed with cur_page
-        for i in range(cur_page*10, (cur_page*10) + 10):
-            if i < len(bet_list):
-                text += self.generate_bet_text(bet_list[i])
-
-        # If pages is greater than one, append a page counter
-        if pages > 1:
-            text += f'Page {cur_page+1} of {pages}\n'
-        else:
-            active = False
-
-        # Send message
-        message = await du.code_message(ctx, text)
-
-        # If pages is greater than one add reactions for control
-        if pages > 1:
-            await message.add_reaction('\U00002B05')
-            await message.add_reaction('\U000027A1')
-
-        # Function to check if reaction = ctx.author
-        def check(reaction, user):
-            return user == ctx.author and str(reaction.emoji) in ['\U00002B05', '\U000027A1']
-
-        # loop for reaction controls
-        while active:
-            try:
-                # Set page to start of codeblock
-                page = '```\n'
-                # wait till we get a reaction, fill reaction, user with output of 'reaction_add'
-                reaction, user = await self.bot.wait_for('reaction_add', timeout=60, check=check)
-                # Check if reaction is left, and cur_page greater than zero
-                if str(reaction.emoji) == '\U00002B05' and cur_page > 0:  # ⬅️
-                    # Set cur_page to current value minus one
-                    cur_page -= 1
-
-                    # Generate current page with cur_page
-                    for i in range(cur_page*10, cur_page*10 + 10):
-                        page += self.generate_bet_text(bet_list[i])  # bet_list[i]
-
-                    # Append page counter and edit message with page
-                    page += f'Page {cur_page+1} of {pages}\n```'
-                    await message.edit(content=page)
-                    # Remove user reaction
-                    await message.remove_reaction(reaction, user)
-                # Check if reaction is right, and cur_page less than pages-1
-                elif str(reaction.emoji) == '\U000027A1' and cur_page < pages-1:  # ➡️
-                    # Set cur_page to current value plus one
-                    cur_page += 1
-
-                    # Generate current page with cur_page
-                    for i in range(cur_page*10, cur_page*10 + 10):
-                        if i < len(bet_list):
-                            page += self.generate_bet_text(bet_list[i])  # bet_list[i]
-
-                    # Append page counter and edit message with page
-                    page += f'Page {cur_page+1} of {pages}\n```'
-                    await message.edit(content=page)
-                    # Remove user reaction
-                    await message.remove_reaction(reaction, user)
-                else:
-                    await message.remove_reaction(reaction, user)
-            except asyncio.TimeoutError:
-                # When 'reaction_add' gets a timeout, set active to false to end loop
-                active = False
-                # Get cached message to remove all reactions
-                cached_msg = discord.utils.get(self.bot.cached_messages, id=message.id)
-                for reactions in cached_msg.reactions:
-                    await reactions.remove(self.bot.user)
+        # Fetch a page of bet_history next to before_id or after_id
+        async def fetch(before_id: int = None, after_id: int = None):
+            return await database_async.read(bets.get_bet_all, ctx, bettor, bet_target_acc, True, PAGE_SIZE,
+                                             before_id, after_id)
+
+        # Send newest page, older pages are fetched when the user reacts
+        await paginator.paginate(ctx, math.ceil(bet_count/PAGE_SIZE),
+                                 paginator.keyset_render(fetch, self.generate_bet_text))
 
     @bet_history.error
     async def generic_error(self, ctx, error):
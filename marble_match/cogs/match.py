@@ -7,12 +7,15 @@ from datetime import datetime, timedelta
 import discord
 from discord.ext import commands
 
+import database.database_async as database_async
 import database.database_operation as database_operation
+import database.write_behind as write_behind
 from database.database_setup import DbHandler
 import utils.discord_utils as du
 import utils.account as acc
 import utils.matches as ma
 import utils.bets as bets
+import utils.settlement as settlement
 import utils.exception as exception
 
 logger = logging.getLogger('marble_match.match')
@@ -47,64 +50,67 @@ class MatchCog(commands.Cog, name='Matches'):
 
         # Check if marbles is less than one, gives a message to user and returns to exit
         if marbles < 1:
-            logger.debug(f'{ctx.author} attempted to create a match with < 1 marbles')
+            logger.debug('%s attempted to create a match with < 1 marbles', ctx.author)
             await du.code_message(ctx, 'You\'re a terrible person who made Soph have to program this.'
                                        '\n No negatives or zero', 3)
             return
 
         # Get and check if Account exists, gives a message to user and returns if no Account
-        challenger = acc.get_account(ctx, DbHandler.db_cnc, ctx.author)
+        challenger = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, ctx.author)
         if not challenger:
-            logger.debug(f'Unable to get Account for {ctx.author}')
+            logger.debug('Unable to get Account for %s', ctx.author)
             await du.code_message(ctx, f'Unable to get {ctx.author.display_name}\'s account info', 3)
             return
-        recipient = acc.get_account(ctx, DbHandler.db_cnc, member)
+        recipient = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
         if not recipient:
-            logger.debug(f'Unable to get Account for {member}')
+            logger.debug('Unable to get Account for %s', member)
             await du.code_message(ctx, f'Unable to get {member.display_name}\'s account info', 3)
             return
 
         # Check if challenger and recipient are the same, gives a message to user and returns to exit
         if challenger.id == recipient.id:
-            logger.debug(f'{ctx.author} passed themselves as member in match command')
+            logger.debug('%s passed themselves as member in match command', ctx.author)
             await du.code_message(ctx, 'You cannot challenge yourself to a match', 3)
             return
 
         # Checks if challenger has a match already going
-        if database_operation.find_match_by_player_id(DbHandler.db_cnc, challenger.id):
-            logger.debug(f'{ctx.author} attempted to start a match with one already made')
+        if await database_async.find_match_by_player_id(DbHandler.db_cnc, challenger.id):
+            logger.debug('%s attempted to start a match with one already made', ctx.author)
             await du.code_message(ctx, 'You already have an match going', 3)
             return
         # Checks if recipient has a match already going
-        if database_operation.find_match_by_player_id(DbHandler.db_cnc, recipient.id):
-            logger.debug(f'{ctx.author}attempted to start a match while {recipient} has a match already')
+        if await database_async.find_match_by_player_id(DbHandler.db_cnc, recipient.id):
+            logger.debug('%s attempted to start a match while %s has a match already', ctx.author, recipient)
             await du.code_message(ctx, 'They already have a match going')
             return
 
-        # Checks if challenger/recipient has enough marbles to create a match
+        # Checks if challenger/recipient has enough marbles to create a match, checked again by the debits
         if challenger.marbles < marbles:
-            logger.debug(f'{ctx.author} does not have enough marbles for this match')
+            logger.debug('%s does not have enough marbles for this match', ctx.author)
             await du.code_message(ctx, f'You do not have enough marbles for this match,'
                                        f' you have {challenger.marbles}', 3)
             return
         if recipient.marbles < marbles:
-            logger.debug(f'{member} does not have enough marbles for this match')
+            logger.debug('%s does not have enough marbles for this match', member)
             await du.code_message(ctx, f'They do not have enough marbles for this match,'
                                        f' they have {recipient.marbles}', 3)
             return
 
-        # Creates the match with the players
-        match = ma.create_match(ctx, None, marbles, challenger, recipient, game=game, format=form)
-        logger.debug(f'match: {match}')
+        # Creates the match with the players and subtracts marbles from challenger, committed together
+        def create_match():
+            new_match = ma.create_match(ctx, None, marbles, challenger, recipient, game=game, format=form)
+            if new_match:
+                challenger.spend_marbles(marbles, database_operation.LEDGER_MATCH_STAKE, new_match.id)
+            return new_match
+
+        match = await database_async.run_unit(create_match)
+        logger.debug('match: %s', match)
         # Checks if match_id is valid, to verify match was created
         if not match:
             logger.debug('match is zero, failed to create match')
             await du.code_message(ctx, 'Failed to create match', 3)
             return
 
-        # Subtracts marbles from challenger
-        challenger.marbles -= marbles
-
         await du.code_message(ctx, f'{challenger.nickname} challenged {recipient.nickname} '
                                    f'to a marble match for {marbles} '
                                    f'marbles'
@@ -131,6 +137,8 @@ class MatchCog(commands.Cog, name='Matches'):
             await du.code_message(ctx, f"Unexpected value, {error.attribute}", 3)
         elif isinstance(error, exception.InvalidNickname):
             await du.code_message(ctx, error.message, 3)
+        elif isinstance(error, exception.NotEnoughMarbles):
+            await du.code_message(ctx, error.message, 3)
 
     @commands.command(name='accept', help='Accept a challenge')
     @commands.guild_only()
@@ -145,20 +153,20 @@ class MatchCog(commands.Cog, name='Matches'):
         - `<ctx>` The context used to send confirmations.
 
         """
-        logger.debug(f'accept: {ctx}, {ctx.author}')
+        logger.debug('accept: %s, %s', ctx, ctx.author)
         # Get player from database for user, then get a match_id
-        player = acc.get_account(ctx, DbHandler.db_cnc, ctx.author)
-        match_id = database_operation.find_match_by_player_id(DbHandler.db_cnc, player.id)
-        logger.debug(f'player: {player}, match_id: {match_id}')
+        player = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, ctx.author)
+        match_id = await database_async.find_match_by_player_id(DbHandler.db_cnc, player.id)
+        logger.debug('player: %s, match_id: %s', player, match_id)
 
         # Checks if match id is 0/None, gives user message and returns to exit
         if not match_id:
-            logger.debug(f'match_id is zero')
+            logger.debug('match_id is zero')
             await du.code_message(ctx, 'You don\'t have a match to accept')
             return
 
         # Get match_info to get marble amount
-        match = ma.get_match(ctx, match_id)  # database_operation.get_match_info_by_id(DbHandler.db_cnc, match_id)
+        match = await database_async.run(ma.get_match, ctx, match_id)
 
         # Checks if match_info is valid
         if not match:
@@ -167,22 +175,27 @@ class MatchCog(commands.Cog, name='Matches'):
             return
 
         # Check if user accepting is participant2
-        if player.id != match.recipient.id:
-            logger.debug(f'{ctx.author} tried to accept a match they aren\'t the recipient of')
+        if player.id != match.recipient_id:
+            logger.debug('%s tried to accept a match they aren\'t the recipient of', ctx.author)
             await du.code_message(ctx, 'You\'re not the recipient of a match')
             return
 
-        # Updates match accepted flag in database, checks if write was successful and gives message
+        # Updates match accepted flag and subtracts marbles from user, checks if write was successful
+        def accept_match():
+            match.accepted = True
+            player.spend_marbles(match.amount, database_operation.LEDGER_MATCH_STAKE, match.id)
+
         try:
-            match.accepted = True  # database_operation.update_match_accepted(DbHandler.db_cnc, match_id):
+            await database_async.run_unit(accept_match)
+        except exception.NotEnoughMarbles as e:
+            logger.debug('%s does not have enough marbles to accept', ctx.author)
+            await du.code_message(ctx, e.message, 3)
+            return
         except commands.CommandError as e:
-            logger.debug(f'Unable to update match accepted flag')
+            logger.debug('Unable to update match accepted flag')
             await du.code_message(ctx, 'Was unable to accept match', 3)
             return
 
-        # Subtracts marbles from user
-        player.marbles -= match.amount
-
         await du.code_message(ctx, f'Match {match.id} accepted, now open for betting.'
                                    f'\nType \'$start\' to close the betting and start the match')
 
@@ -219,38 +232,38 @@ class MatchCog(commands.Cog, name='Matches'):
         - `<ctx>` The context used to send confirmations.
 
         """
-        logger.debug(f'match_start: {ctx}, {ctx.author}')
+        logger.debug('match_start: %s, %s', ctx, ctx.author)
         # Get player_id from database for user, then get a match_id
-        player_id = du.get_id_by_member(ctx, DbHandler.db_cnc, ctx.author)
-        match_id = database_operation.find_match_by_player_id(DbHandler.db_cnc, player_id)
-        logger.debug(f'player_id: {player_id}, match_id: {match_id}')
+        player_id = await database_async.run(du.get_id_by_member, ctx, DbHandler.db_cnc, ctx.author)
+        match_id = await database_async.find_match_by_player_id(DbHandler.db_cnc, player_id)
+        logger.debug('player_id: %s, match_id: %s', player_id, match_id)
 
         # Checks if match id is 0/None, gives user message and returns to exit
         if not match_id:
-            logger.debug(f'match_id is zero')
+            logger.debug('match_id is zero')
             await du.code_message(ctx, 'You don\'t have a match to start')
             return
 
         try:
             # Get match from match_id
-            match = ma.get_match(ctx, match_id)
-            logger.debug(f'match: {match}')
+            match = await database_async.run(ma.get_match, ctx, match_id)
+            logger.debug('match: %s', match)
         except commands.CommandError as e:
-            logger.error(f'Unable to get match from match_id')
+            logger.error('Unable to get match from match_id')
             await du.code_message(ctx, 'Was unable to get match please try again later', 3)
             return
 
         # Check if match is accepted
         if not match.accepted:
-            logger.debug(f'match.accepted is false')
+            logger.debug('match.accepted is false')
             await du.code_message(ctx, 'You can only start matches the other player has accepted', 3)
             return
 
         # Updates match accepted flag in database, checks if write was successful and gives message
-        try:  # if not database_operation.update_match_activity(DbHandler.db_cnc, match_id):
-            match.active = True
+        try:
+            await database_async.run(setattr, match, 'active', True)
         except commands.CommandError as e:
-            logger.debug(f'Unable to update match accepted flag')
+            logger.debug('Unable to update match accepted flag')
             await du.code_message(ctx, 'Was unable to accept match', 3)
             return
         await du.code_message(ctx, f'Match {match_id} started, betting is closed and all bets are locked in.')
@@ -290,14 +303,14 @@ class MatchCog(commands.Cog, name='Matches'):
         - `<member>' Member to select as the winner.
 
         """
-        logger.debug(f'match_win: {member}')
+        logger.debug('match_win: %s', member)
         # Checks if member is None, then sets member to ctx.author if true
         if member is None:
             member = ctx.author
         # Gets winner/match_id to process match and do integrity checks
-        winner = acc.get_account(ctx, DbHandler.db_cnc, member)
-        match_id = database_operation.find_match_by_player_id(DbHandler.db_cnc, winner.id)
-        logger.debug(f'winner: {winner}, match_id: {match_id}')
+        winner = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
+        match_id = await database_async.find_match_by_player_id(DbHandler.db_cnc, winner.id)
+        logger.debug('winner: %s, match_id: %s', winner, match_id)
 
         # Checks if they have an active match
         if not match_id:
@@ -306,46 +319,21 @@ class MatchCog(commands.Cog, name='Matches'):
             return
         # Get match info from match_id
         try:
-            match = ma.get_match(ctx, match_id)
-            logger.debug(f'match: {match}')
+            match = await database_async.run(ma.get_match, ctx, match_id)
+            logger.debug('match: %s', match)
         except commands.CommandError as e:
-            logger.error(f'Unable to get match: {e}')
+            logger.error('Unable to get match: %s', e)
             await du.code_message(ctx, 'Unable to process match', 3)
             return
 
-        # Set loser to other participant
-        # Checks if participant1 is winner if true sets loser to participant2, or participant1 otherwise
-        if winner == match.challenger:
-            loser = match.recipient
-        else:
-            loser = match.challenger
-        logger.debug(f'loser: {loser}')
-
+        # Set match winner and time, then settle match and all bets on it in one transaction
         try:
-            # Set match winner
             match.winner = winner
-            # Add marbles to winner
-            winner.marbles += match.amount * 2
-            # Adds win/lose to winner/loser
-            winner.wins += 1
-            loser.loses += 1
-        except commands.CommandError as e:
-            logger.error(f'Unable to update player stats: {e}')
-            await du.code_message(ctx, 'Was unable to update player stats please try again', 3)
-            return
-
-        logger.debug('Processed bets')
-        # Creates a entry of match in match_history table, deletes from matches
-        try:
-            match.is_history = True
             match.match_time = datetime.utcnow()
-            logger.debug('Updated match info')
-            match.create_history()
-            logger.debug('Created match_history for match')
-            if bets.process_bets(ctx, match):
-                logger.debug('Processed bets')
+            await database_async.run(settlement.settle_match, match)
+            logger.debug('Settled match and bets')
         except commands.CommandError as e:
-            logger.error(f'Unable to create matches_history entry')
+            logger.error('Unable to settle match: %s', e)
             await du.code_message(ctx, f'Failed to add match to history or to delete from matches: {match.id}', 3)
             return
 
@@ -384,12 +372,12 @@ class MatchCog(commands.Cog, name='Matches'):
         - `<ctx>` The context used to send confirmations.
 
         """
-        logger.debug(f'current: {ctx}, {ctx.author}')
+        logger.debug('current: %s, %s', ctx, ctx.author)
 
         # Gets player_id from ctx.author and gets match_id for player
-        player_id = du.get_id_by_member(ctx, DbHandler.db_cnc, ctx.author)
-        match_id = database_operation.find_match_by_player_id(DbHandler.db_cnc, player_id)
-        logger.debug(f'player_id: {player_id}, match_id: {match_id}')
+        player_id = await database_async.run(du.get_id_by_member, ctx, DbHandler.db_cnc, ctx.author)
+        match_id = await database_async.find_match_by_player_id(DbHandler.db_cnc, player_id)
+        logger.debug('player_id: %s, match_id: %s', player_id, match_id)
 
         # Checks if match_id is an actual id
         if not match_id:
@@ -397,13 +385,15 @@ class MatchCog(commands.Cog, name='Matches'):
             await du.code_message(ctx, 'No current match')
             return
         # Gets match_info to display back to the user
-        match_info = ma.get_match(ctx, match_id)  # database_operation.get_match_info_by_id(DbHandler.db_cnc, match_id)
-        logger.debug(f'match_info: {match_info}')
+        match_info = await database_async.run(ma.get_match, ctx, match_id)
+        logger.debug('match_info: %s', match_info)
 
         # Get Accounts of both participants
-        player_info1 = acc.get_account_from_db(ctx, DbHandler.db_cnc, match_info.challenger.id)  # database_operation.get_player_info(DbHandler.db_cnc, match_info[3])
-        player_info2 = acc.get_account_from_db(ctx, DbHandler.db_cnc, match_info.recipient.id)  # database_operation.get_player_info(DbHandler.db_cnc, match_info[4])
-        logger.debug(f'player_info1: {player_info1}, player_info2: {player_info2}')
+        player_info1 = await database_async.run(acc.get_account_from_db, ctx, DbHandler.db_cnc,
+                                                match_info.challenger_id)
+        player_info2 = await database_async.run(acc.get_account_from_db, ctx, DbHandler.db_cnc,
+                                                match_info.recipient_id)
+        logger.debug('player_info1: %s, player_info2: %s', player_info1, player_info2)
 
         await du.code_message(ctx, f'Match between {player_info1.nickname} and '
                                    f'{player_info2.nickname} for {match_info.amount} marbles'
@@ -442,53 +432,62 @@ class MatchCog(commands.Cog, name='Matches'):
         - `<ctx>` The context used to send confirmations
 
         """
-        logger.debug(f'close: {ctx}, {ctx.author}')
+        logger.debug('close: %s, %s', ctx, ctx.author)
 
         # Gets player_id and match_id, to close the current match
-        player_id = du.get_id_by_member(ctx, DbHandler.db_cnc, ctx.author)
-        match_id = database_operation.find_match_by_player_id(DbHandler.db_cnc, player_id)
-        logger.debug(f'player_id: {player_id}, match_id: {match_id}')
+        player_id = await database_async.run(du.get_id_by_member, ctx, DbHandler.db_cnc, ctx.author)
+        match_id = await database_async.find_match_by_player_id(DbHandler.db_cnc, player_id)
+        logger.debug('player_id: %s, match_id: %s', player_id, match_id)
 
         # Gets match_info to return marbles back to participants
-        match_info = ma.get_match(ctx, match_id)  # database_operation.get_match_info_by_id(DbHandler.db_cnc, match_id)
-        logger.debug(f'match_info: {match_info}')
+        match_info = await database_async.run(ma.get_match, ctx, match_id)
+        logger.debug('match_info: %s', match_info)
 
         player2_refund = False
 
         # Checks if match is accepted by participant2
         if match_info.accepted:  # Match is accepted
             # Gets participant2's Account to change marbles
-            player2 = acc.get_account_from_db(ctx, DbHandler.db_cnc, match_info.recipient.id)
-            logger.debug(f'player2: {player2}')
+            player2 = await database_async.run(acc.get_account_from_db, ctx, DbHandler.db_cnc,
+                                               match_info.recipient_id)
+            logger.debug('player2: %s', player2)
             # Checks if player2 is 0, then returns if 0
             if not player2:
-                logger.debug(f'Unable to get participant2 Account')
+                logger.debug('Unable to get participant2 Account')
                 await du.code_message(ctx, 'Unable to get participant2\'s account')
                 return
             # Sets flag for player2 to be refunded amount to true
             player2_refund = True
-            logger.debug(f'player2_refund: {player2_refund}')
+            logger.debug('player2_refund: %s', player2_refund)
 
         # Get participant1's Account to refund player for match amount
-        player1 = acc.get_account_from_db(ctx, DbHandler.db_cnc, match_info.challenger.id)
+        player1 = await database_async.run(acc.get_account_from_db, ctx, DbHandler.db_cnc, match_info.challenger_id)
         # Check if player1 is 0, then returns if 0
         if not player1:
             logger.debug('Unable to get participant1 Account')
             await du.code_message(ctx, 'Unable to get participant1\'s account')
             return
 
-        # Deletes the match and all the bets on the match by id, checks if write was successful and returns message
-        if not database_operation.delete_match(DbHandler.db_cnc, match_id):
+        # Deletes the match and all the bets on the match by id, and refunds players in one unit of work
+        def close_match():
+            if not database_operation.delete_match(DbHandler.db_cnc, match_id):
+                raise exception.UnableToDelete(attribute='matches')
+
+            # Refunds players marbles, checks if player2 flag is true to refund player2
+            player1.add_marbles(match_info.amount, database_operation.LEDGER_MATCH_REFUND, match_id)
+            if player2_refund:
+                player2.add_marbles(match_info.amount, database_operation.LEDGER_MATCH_REFUND, match_id)
+
+            database_operation.delete_bet_by_match_id(DbHandler.db_cnc, match_id)
+
+        # Checks if write was successful and returns message
+        try:
+            await database_async.run_unit(close_match)
+        except exception.UnableToDelete:
             logger.debug('Unable to delete match')
             await du.code_message(ctx, 'Unable to delete match', 3)
             return
 
-        # Refunds players marbles, checks if player2 flag is true to refund player2
-        player1.marbles += match_info.amount
-        if player2_refund:
-            player2.marbles += match_info.amount
-
-        database_operation.delete_bet_by_match_id(DbHandler.db_cnc, match_id)
         await du.code_message(ctx, f'Closed match {match_id}.')
 
     @close_current_match.error
@@ -528,14 +527,14 @@ class MatchCog(commands.Cog, name='Matches'):
     @commands.command(name='friendly', help="Use when you're playing a friendly to earn a marble")
     @commands.guild_only()
     async def friendlies(self, ctx: commands.Context, member: Union[discord.Member, str]):
-        logger.debug(f'friendlies: {member}')
+        logger.debug('friendlies: %s', member)
 
         # Get players Accounts
-        player1 = acc.get_account(ctx, DbHandler.db_cnc, ctx.author)
+        player1 = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, ctx.author)
         if not player1:
             logger.error('No player1_id found')
             await du.code_message(ctx, 'Unable to get player info', 3)
-        player2 = acc.get_account(ctx, DbHandler.db_cnc, member)
+        player2 = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
         if not player2:
             logger.error('No player1_id found')
             await du.code_message(ctx, 'Unable to get player info', 3)
@@ -554,9 +553,10 @@ class MatchCog(commands.Cog, name='Matches'):
         now = datetime.utcnow()
         hardcoded_time = datetime(now.year, now.month, now.day, 4, 0, 0, 0)
 
-        # Get players last used time
-        player1_last_used = player1.friendly_last_used
-        player2_last_used = player2.friendly_last_used
+        # Get players last used time, including ones still waiting to be written
+        await write_behind.writer.flush()
+        player1_last_used = await database_async.run(getattr, player1, 'friendly_last_used')
+        player2_last_used = await database_async.run(getattr, player2, 'friendly_last_used')
 
         # Check if both players have access to the command
         if not player1_last_used or player1_last_used < hardcoded_time:
@@ -578,10 +578,15 @@ class MatchCog(commands.Cog, name='Matches'):
             try:
                 reaction, user = await self.bot.wait_for('reaction_add', timeout=60, check=check_member)
                 if str(reaction) == '\U00002705':
-                    player1.marbles += 1
-                    player1.friendly_last_used = datetime.utcnow()
-                    player2.marbles += 1
-                    player2.friendly_last_used = datetime.utcnow()
+                    # The ledger is checked when the marbles are given, so the reward can't be claimed twice
+                    if not await database_async.run(player1.claim_friendly, player2, 1, hardcoded_time):
+                        await du.code_message(ctx, 'This friendly was already rewarded today')
+                        continue
+                    # The reply doesn't depend on last used times, they're written after it
+                    used = datetime.utcnow()
+                    for player in (player1, player2):
+                        await write_behind.writer.submit(database_operation.FRIENDLY_UPSERT, (player.id, used),
+                                                         ('friendly', player.id))
                     await du.code_message(ctx, f"We've added a marble to your accounts for playing friendlies today.\n"
                                                f"{player1.nickname}: {player1.marbles}\n"
                                                f"{player2.nickname}: {player2.marbles}")
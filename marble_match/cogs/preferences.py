@@ -4,7 +4,7 @@ from typing import Union
 import discord
 from discord.ext import commands
 
-import database.database_operation as database_operation
+import database.database_async as database_async
 from database.database_setup import DbHandler
 import utils.account as acc
 import utils.discord_utils as du
@@ -21,7 +21,7 @@ class PrefCog(commands.Cog, name='Preferences'):
     @commands.command(name='nick', help='Change your nickname')
     @commands.guild_only()
     async def nick(self, ctx: commands.Context, nickname: str):
-        logger.debug(f'nick: {nickname}')
+        logger.debug('nick: %s', nickname)
 
         # Check if nickname is empty
         if not nickname.strip():
@@ -32,9 +32,9 @@ class PrefCog(commands.Cog, name='Preferences'):
             await ctx.send('Nickname cannot contain whitespace')
             return
 
-        account = acc.get_account(ctx, DbHandler.db_cnc, ctx.author)
+        account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, ctx.author)
 
-        account.nickname = nickname
+        await database_async.run(setattr, account, 'nickname', nickname)
         await ctx.send(f'New nickname: "{account.nickname}"')
 
     @nick.error
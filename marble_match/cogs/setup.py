@@ -1,11 +1,19 @@
+import logging
+import time
+
 import discord
 from discord.ext import commands
 
-import database.database_operation as database_operation
+import database.database_async as database_async
 from database.database_setup import DbHandler
 import utils.account as acc
 import utils.discord_utils as du
 
+logger = logging.getLogger(f'marble_match.{__name__}')
+
+# Marbles new players start with
+STARTING_MARBLES = 10
+
 
 def has_database_permission():
     async def predicate(ctx: commands.Context):
@@ -26,6 +34,30 @@ class InitCog(commands.Cog, name='Initializations'):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
+    @staticmethod
+    async def register_members(guild: discord.Guild) -> str:
+        """Adds every member of guild that isn't in the database yet in one transaction, returns summary
+
+        **Arguments**
+
+        - `<guild>` Guild to add members of
+
+        """
+        start = time.perf_counter()
+        members = [(member.id, str(member)) for member in guild.members]
+        result = await database_async.create_users_bulk(DbHandler.db_cnc, guild.id, members, STARTING_MARBLES)
+        elapsed = time.perf_counter() - start
+
+        if result is None:
+            return f'Unable to add members of {guild.name} to the database'
+
+        added, skipped = result
+        summary = f'Added {added} of {len(members)} members of {guild.name} to the database in {elapsed:.2f}s'
+        if skipped:
+            summary += f', {skipped} skipped with a nickname already in use'
+        logger.debug(summary)
+        return summary
+
     @commands.Cog.listener()
     async def on_ready(self):
         print(f'{self.bot.user.name} has connected to Discord.')
@@ -34,10 +66,15 @@ class InitCog(commands.Cog, name='Initializations'):
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
-        if not database_operation.get_player_id(DbHandler.db_cnc, member.id, member.guild.id):
-            database_operation.create_user(DbHandler.db_cnc, None, member.id, str(member), 10, member.guild.id)
+        if not await database_async.get_player_id(DbHandler.db_cnc, member.id, member.guild.id):
+            await database_async.create_user(DbHandler.db_cnc, None, member.id, str(member), STARTING_MARBLES,
+                                             member.guild.id)
             print(f'Added {member.name} to database')
 
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        print(await self.register_members(guild))
+
     @commands.command(name='init', help='Adds all server members to the database if they do not exist already')
     @commands.guild_only()
     @has_database_permission()
@@ -53,11 +90,7 @@ class InitCog(commands.Cog, name='Initializations'):
 
         """
 
-        for members in ctx.guild.members:
-            if not du.get_id_by_member(ctx, DbHandler.db_cnc, members):
-                database_operation.create_user(DbHandler.db_cnc, None, members.id, str(members), 10, ctx.guild.id)
-                print(f'Added {members.name} to database')
-        await du.code_message(ctx, 'Any members not added to the database have been added')
+        await du.code_message(ctx, await self.register_members(ctx.guild))
 
 
 def setup(bot):
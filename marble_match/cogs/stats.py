@@ -5,6 +5,7 @@ from typing import Union
 import discord
 from discord.ext import commands
 
+import database.database_async as database_async
 from database.database_setup import DbHandler
 import utils.discord_utils as du
 import utils.account as acc
@@ -40,10 +41,10 @@ class StatsCog(commands.Cog, name='Stats'):
 
         # Check if member is None, use ctx.author if None
         if member is None:
-            account = acc.get_account(ctx, DbHandler.db_cnc, ctx.author)
+            account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, ctx.author)
         else:
-            account = acc.get_account(ctx, DbHandler.db_cnc, member)
-        logger.debug(f'account: {account}')
+            account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, member)
+        logger.debug('account: %s', account)
 
         # Set winrate to 0 if wins is zero, otherwise calculate winrate
         if account.wins == 0:
@@ -104,43 +105,46 @@ class StatsCog(commands.Cog, name='Stats'):
         - `<members>` The member who's position on leaderboard you'd like to receive.
 
         """
-        logger.debug(f'leaderboard: {members}')
+        logger.debug('leaderboard: %s', members)
         member_account = None
 
         # Get member account
         if members:
-            member_account = acc.get_account(ctx, DbHandler.db_cnc, members)
-        logger.debug(f'member_account: {member_account}')
+            member_account = await database_async.run(acc.get_account, ctx, DbHandler.db_cnc, members)
+        logger.debug('member_account: %s', member_account)
 
-        # Get accounts of all users on server
-        player_info = acc.get_account_server_all(ctx, DbHandler.db_cnc, ctx.guild.id)
+        # Check if stat is one the leaderboard can be ordered by
+        if stat not in account_stats:
+            await du.code_message(ctx, f'Invalid stat, use one of: {", ".join(account_stats)}')
+            return
 
         # Creation function to get stats based on string
         stat_get = operator.attrgetter(stat)
 
-        players = []
-        players = sorted(player_info, key=stat_get, reverse=True)
-
         if members is not None:
-            for player in players:
-                if player.id == member_account.id:
-                    if stat == 'winrate':
-                        await du.code_message(ctx, f'{member_account.nickname} is rank #{players.index(player) + 1}, '
-                                                   f'with a win-rate of {stat_get(player):.2f}%')
-                    else:
-                        await du.code_message(ctx, f'{member_account.nickname} is rank #{players.index(player) + 1}, '
-                                                   f'with {stat_get(player)}')
-
-                    return
+            # Get rank of member from ordered index on server
+            rank = await database_async.get_leaderboard_rank(DbHandler.db_cnc, ctx.guild.id, stat, member_account.id)
+            if not rank:
+                return
+
+            if stat == 'winrate':
+                await du.code_message(ctx, f'{member_account.nickname} is rank #{rank}, '
+                                           f'with a win-rate of {stat_get(member_account):.2f}%')
+            else:
+                await du.code_message(ctx, f'{member_account.nickname} is rank #{rank}, '
+                                           f'with {stat_get(member_account)}')
             return
 
+        # Get top 10 accounts of server, already in order
+        players = await database_async.read(acc.get_leaderboard, ctx, DbHandler.db_cnc, ctx.guild.id, stat, 10)
+
         text = f"Leaderboard top 10 {stat}\n\n"
 
-        for player in players[0:10]:
+        for rank, player in enumerate(players, 1):
             if stat == 'winrate':
-                text += f'#{players.index(player) + 1} {player.nickname}: {stat_get(player):.2f}%\n'
+                text += f'#{rank} {player.nickname}: {stat_get(player):.2f}%\n'
             else:
-                text += f'#{players.index(player) + 1} {player.nickname}: {stat_get(player)}\n'
+                text += f'#{rank} {player.nickname}: {stat_get(player)}\n'
 
         await du.code_message(ctx, text)
 
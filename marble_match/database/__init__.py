@@ -1,2 +1,4 @@
 import database.database_setup
+import database.migrations
 import database.database_operation
+import database.database_async
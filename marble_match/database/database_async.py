@@ -0,0 +1,183 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import database.database_operation as database_operation
+import database.database_setup as database_setup
+from database.database_setup import DbHandler
+import utils.exception as exception
+import utils.metrics as metrics
+
+logger = logging.getLogger(f'marble_match.{__name__}')
+
+# Single worker, so the shared sqlite3 connection is only ever used by one thread and queries run in order
+EXECUTOR_THREAD = 'marble_db'
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=EXECUTOR_THREAD)
+
+# Reads that don't need to see writes still queued on executor, each thread with its own read-only connection
+readers = ThreadPoolExecutor(max_workers=database_setup.get_readers(database_setup.read_config()),
+                             thread_name_prefix=database_setup.READER_THREAD)
+
+
+def bind(func, *args, **kwargs):
+    """Returns func called with args in the context of the caller, timed as database work of its command"""
+    return functools.partial(contextvars.copy_context().run, metrics.timed, func, *args, **kwargs)
+
+
+async def run(func, *args, **kwargs):
+    """Runs a blocking function on the database executor and returns its result
+
+    Exceptions raised by func are re-raised in the awaiting coroutine.
+
+    **Arguments**
+
+    - `<func>` Blocking function that reads or writes the database
+    - `<args>` Positional arguments passed to func
+    - `<kwargs>` Keyword arguments passed to func
+
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, bind(func, *args, **kwargs))
+
+
+async def run_unit(func, *args, **kwargs):
+    """Runs a blocking function on the database executor inside a unit of work, so it commits once
+
+    All writes made by func, including through Account/Match/Bet setters, are committed together when it
+    returns, or rolled back if it raises. If a write inside it failed and rolled the unit back, UnableToWrite is
+    raised so the command's error handler reports it.
+
+    **Arguments**
+
+    - `<func>` Blocking function that writes to the database
+    - `<args>` Positional arguments passed to func
+    - `<kwargs>` Keyword arguments passed to func
+
+    """
+    def unit():
+        try:
+            with database_operation.unit_of_work(DbHandler.db_cnc):
+                return func(*args, **kwargs)
+        except database_operation.UnitRolledBack:
+            raise exception.UnableToWrite(class_='unit_of_work', attribute=getattr(func, '__name__', 'unit'))
+
+    return await run(unit)
+
+
+async def read(func, *args, **kwargs):
+    """Runs a blocking function that only reads on a reader thread and returns its result
+
+    Reads there don't wait for writes queued on the executor, they see every write committed before they start.
+    DbHandler.db_cnc passed in args is swapped for the read-only connection of the thread, as is DbHandler.db_cnc
+    read by func.
+
+    **Arguments**
+
+    - `<func>` Blocking function that reads the database
+    - `<args>` Positional arguments passed to func
+    - `<kwargs>` Keyword arguments passed to func
+
+    """
+    writer = DbHandler.writer()
+
+    def task():
+        connection = DbHandler.db_cnc
+        return func(*[connection if arg is writer else arg for arg in args], **kwargs)
+
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(readers, bind(task))
+
+
+def awaitable(func):
+    """Returns a coroutine function equivalent of a blocking database_operation function"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def readable(func):
+    """Returns a coroutine function equivalent of a blocking database_operation function, run with read"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await read(func, *args, **kwargs)
+
+    return wrapper
+
+
+# Awaitable equivalents of database_operation, same arguments and return values. Plain reads run on readers,
+# find_* stay on the executor since they're checked before writing
+create_user = awaitable(database_operation.create_user)
+create_users_bulk = awaitable(database_operation.create_users_bulk)
+create_match = awaitable(database_operation.create_match)
+create_bet = awaitable(database_operation.create_bet)
+create_match_history = awaitable(database_operation.create_match_history)
+create_bet_history = awaitable(database_operation.create_bet_history)
+create_friendly = awaitable(database_operation.create_friendly)
+
+update_friendly = awaitable(database_operation.update_friendly)
+update_match_activity = awaitable(database_operation.update_match_activity)
+update_match_accepted = awaitable(database_operation.update_match_accepted)
+update_marble_count = awaitable(database_operation.update_marble_count)
+update_player_nickname = awaitable(database_operation.update_player_nickname)
+update_player_wins = awaitable(database_operation.update_player_wins)
+update_player_loses = awaitable(database_operation.update_player_loses)
+update_bet = awaitable(database_operation.update_bet)
+
+get_friendly_last_used = readable(database_operation.get_friendly_last_used)
+get_match_info_by_id = readable(database_operation.get_match_info_by_id)
+get_match_info_all = readable(database_operation.get_match_info_all)
+get_match_history_info = readable(database_operation.get_match_history_info)
+get_match_history_info_all = readable(database_operation.get_match_history_info_all)
+get_match_history_joined = readable(database_operation.get_match_history_joined)
+get_match_info_joined = readable(database_operation.get_match_info_joined)
+get_player_id = readable(database_operation.get_player_id)
+get_player_id_by_username = readable(database_operation.get_player_id_by_username)
+get_server_nicknames = readable(database_operation.get_server_nicknames)
+get_player_info = readable(database_operation.get_player_info)
+get_player_info_many = readable(database_operation.get_player_info_many)
+get_player_wins = readable(database_operation.get_player_wins)
+get_player_loses = readable(database_operation.get_player_loses)
+get_player_info_all_by_server = readable(database_operation.get_player_info_all_by_server)
+get_marble_count = readable(database_operation.get_marble_count)
+get_leaderboard = readable(database_operation.get_leaderboard)
+get_leaderboard_rank = readable(database_operation.get_leaderboard_rank)
+get_bet_info = readable(database_operation.get_bet_info)
+get_bet_info_all = readable(database_operation.get_bet_info_all)
+get_bet_info_match_all = readable(database_operation.get_bet_info_match_all)
+get_bet_history_info = readable(database_operation.get_bet_history_info)
+get_bet_history_info_all = readable(database_operation.get_bet_history_info_all)
+get_bet_history_joined = readable(database_operation.get_bet_history_joined)
+get_bet_info_joined = readable(database_operation.get_bet_info_joined)
+count_match_history = readable(database_operation.count_match_history)
+count_bet_history = readable(database_operation.count_bet_history)
+
+find_match_by_player_id = awaitable(database_operation.find_match_by_player_id)
+find_bet = awaitable(database_operation.find_bet)
+
+delete_match = awaitable(database_operation.delete_match)
+delete_bet = awaitable(database_operation.delete_bet)
+delete_bet_by_match_id = awaitable(database_operation.delete_bet_by_match_id)
+
+change_marbles = awaitable(database_operation.change_marbles)
+add_marbles = awaitable(database_operation.add_marbles)
+add_player_win = awaitable(database_operation.add_player_win)
+add_player_loses = awaitable(database_operation.add_player_loses)
+increment_player_stat = awaitable(database_operation.increment_player_stat)
+subtract_marbles = awaitable(database_operation.subtract_marbles)
+transfer_marbles = awaitable(database_operation.transfer_marbles)
+is_bet_win = awaitable(database_operation.is_bet_win)
+settle_bets = awaitable(database_operation.settle_bets)
+settle_match = awaitable(database_operation.settle_match)
+
+verify_ledger = readable(database_operation.verify_ledger)
+rebuild_balances = awaitable(database_operation.rebuild_balances)
+get_ledger_entries = readable(database_operation.get_ledger_entries)
+get_ledger_flow = readable(database_operation.get_ledger_flow)
+get_ledger_version = readable(database_operation.get_ledger_version)
+get_server_balances = readable(database_operation.get_server_balances)
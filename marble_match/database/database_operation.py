@@ -1,13 +1,48 @@
 import sqlite3
 import datetime
+import itertools
 import logging
+import threading
 
-from typing import Union
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple, Union
 from sqlite3 import Error
 
+import database.statements as statements
+
 logger = logging.getLogger('marble_match.' + __name__)
 
 
+# Reasons recorded with marble_ledger entries
+LEDGER_OPENING = 'opening'
+LEDGER_REGISTER = 'register'
+LEDGER_MATCH_STAKE = 'match_stake'
+LEDGER_MATCH_REFUND = 'match_refund'
+LEDGER_MATCH_PAYOUT = 'match_payout'
+LEDGER_BET = 'bet'
+LEDGER_BET_REFUND = 'bet_refund'
+LEDGER_BET_PAYOUT = 'bet_payout'
+LEDGER_FRIENDLY = 'friendly'
+LEDGER_ADMIN_SET = 'admin_set'
+LEDGER_ADMIN_ADD = 'admin_add'
+LEDGER_ADMIN_SUB = 'admin_sub'
+LEDGER_TRANSFER = 'transfer'
+
+# Appends a balance change to the ledger, the ledger_balance trigger writes the new balance to users.marbles.
+# Parameters are the ones returned by ledger_params, balance doesn't go below zero and amount is the applied change
+LEDGER_INSERT = ("INSERT INTO marble_ledger(player_id, server_id, amount, balance, reason, reference_id, created_at) "
+                 "SELECT id, server_id, MAX(0, marbles + ?) - marbles, MAX(0, marbles + ?), ?, ?, ? "
+                 "FROM users WHERE id = ?")
+
+
+def ledger_params(player_id: int, amount: int, reason: str, reference_id: int = None,
+                  created_at: datetime.datetime = None) -> tuple:
+    """Returns parameters of LEDGER_INSERT for adding amount to player_id's balance"""
+    if created_at is None:
+        created_at = datetime.datetime.utcnow()
+    return amount, amount, reason, reference_id, created_at, player_id
+
+
 def replace_char_list(_old: str, _replacement: list,  _replace: str = '?') -> str:
 
     for i in _replacement:
@@ -16,14 +51,112 @@ def replace_char_list(_old: str, _replacement: list,  _replace: str = '?') -> st
     return _old
 
 
+def log_query(query: str, query_param: list):
+    """Logs query with query_param filled in, it's only rendered when debug logging is enabled"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(replace_char_list(query, query_param))
+
+
+# Depth of the unit of work open on the current thread, commits are deferred while it's above zero. rollback_only is
+# set when a write inside it failed, so it rolls back instead of committing
+_unit = threading.local()
+
+# Callbacks run with the ids of users rows changed outside of Account setters, and when a unit of work rolls back
+user_change_listeners = []
+rollback_listeners = []
+# Callbacks run with the server_id of users added or renamed, None if the server isn't known
+nickname_listeners = []
+
+
+class UnitRolledBack(Exception):
+    """Raised by the outermost unit of work after rolling back, because a write inside it failed"""
+
+
+def notify_users_changed(*player_ids: int):
+    for listener in user_change_listeners:
+        listener(*player_ids)
+
+
+def notify_rollback():
+    for listener in rollback_listeners:
+        listener()
+
+
+def notify_nicknames_changed(server_id: Optional[int]):
+    for listener in nickname_listeners:
+        listener(server_id)
+
+
+def in_unit_of_work() -> bool:
+    return getattr(_unit, 'depth', 0) > 0
+
+
+@contextmanager
+def unit_of_work(connection: sqlite3.Connection):
+    """Context that batches every write made inside it into a single commit
+
+    Writes are rolled back if an exception leaves the context, or if rollback was called inside it. In the second
+    case the outermost unit raises UnitRolledBack, so a failed write isn't mistaken for success. Nested units join
+    the outermost one.
+
+    **Arguments**
+
+    - `<connection>` sqlite3 connection the writes are made on
+
+    """
+    depth = getattr(_unit, 'depth', 0)
+    if not depth:
+        _unit.rollback_only = False
+    _unit.depth = depth + 1
+    try:
+        yield connection
+    except BaseException:
+        _unit.depth = depth
+        if not depth:
+            logger.debug('unit_of_work rollback')
+            connection.rollback()
+            notify_rollback()
+        raise
+    _unit.depth = depth
+    if depth:
+        return
+    if _unit.rollback_only:
+        logger.error('unit_of_work rolled back, a write inside it failed')
+        connection.rollback()
+        notify_rollback()
+        raise UnitRolledBack()
+    else:
+        logger.debug('unit_of_work commit')
+        connection.commit()
+
+
+def commit(connection: sqlite3.Connection):
+    """Commits connection, unless a unit of work is open"""
+    if in_unit_of_work():
+        logger.debug('commit deferred to unit_of_work')
+        return
+    connection.commit()
+
+
+def rollback(connection: sqlite3.Connection):
+    """Rolls back connection, inside a unit of work it marks the unit to roll back every write when it ends"""
+    if in_unit_of_work():
+        logger.debug('rollback deferred to unit_of_work')
+        _unit.rollback_only = True
+        return
+    connection.rollback()
+    notify_rollback()
+
+
 def create_con(path: str):
-    logger.debug(f'create_connection: {path}')
+    logger.debug('create_connection: %s', path)
     try:
-        con = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        logger.debug(f'connection created: {con}')
+        con = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                              check_same_thread=False, cached_statements=statements.cache_size())
+        logger.debug('connection created: %s', con)
         return con
     except Error as e:
-        logger.error(f'Failed to create connection: {e}')
+        logger.error('Failed to create connection: %s', e)
         raise e
 
 
@@ -31,32 +164,87 @@ def create_user(connection: sqlite3.Connection, player_id: Union[int, None],
                 uuid: int, nickname: str, marbles: int, server_id: int,
                 wins: int = 0, loses: int = 0) -> int:
 
-    logger.debug(f'create_user: {player_id}, {uuid}, {nickname}, {marbles}, {server_id}, {wins}, {loses}')
+    logger.debug('create_user: %s, %s, %s, %s, %s, %s, %s', player_id, uuid, nickname, marbles, server_id, wins, loses)
 
     query = "INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?)"
-    query_param = [player_id, uuid, nickname, marbles, server_id, wins, loses]
+    query_param = [player_id, uuid, nickname, 0, server_id, wins, loses]
 
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        player_id = cur.lastrowid
+        # Starting marbles are the first ledger entry of the player
+        cur.execute(LEDGER_INSERT, ledger_params(player_id, marbles, LEDGER_REGISTER))
+        commit(connection)
+        notify_nicknames_changed(server_id)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', player_id)
 
-        return cur.lastrowid
+        return player_id
     except Error as e:
-        logger.error(f'There was an error inserting a user into users: {e}')
+        logger.error('There was an error inserting a user into users: %s', e)
+        rollback(connection)
         return 0
 
 
+def create_users_bulk(connection: sqlite3.Connection, server_id: int, members: Iterable[Tuple[int, str]],
+                      marbles: int) -> Optional[Tuple[int, int]]:
+    """Registers every member of server_id that isn't a player yet, returns (added, skipped)
+
+    Existing uuids are read with one query, the missing members are inserted with a single executemany and given
+    their starting marbles with one ledger insert, all in one transaction. Members whose nickname is already taken
+    are skipped like create_user would fail on them. Returns None if the write failed.
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<server_id>` Server members belong to
+    - `<members>` (uuid, nickname) of every member of server
+    - `<marbles>` Starting marbles of new players
+
+    """
+    logger.debug('create_users_bulk: %s, %s', server_id, marbles)
+
+    try:
+        cur = connection.cursor()
+        cur.execute("SELECT uuid FROM users WHERE server_id=?", [server_id])
+        existing = {row[0] for row in cur.fetchall()}
+
+        missing = [(uuid, nickname, server_id) for uuid, nickname in members if uuid not in existing]
+        logger.debug('existing: %s, missing: %s', len(existing), len(missing))
+        if not missing:
+            return 0, 0
+
+        # New players are the rows with ids after the current highest one
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+        last_id = cur.fetchone()[0]
+
+        cur.executemany("INSERT OR IGNORE INTO users(uuid, nickname, marbles, server_id, wins, loses) "
+                        "VALUES (?, ?, 0, ?, 0, 0)", missing)
+        # Starting marbles are the first ledger entry of every new player
+        cur.execute("INSERT INTO marble_ledger(player_id, server_id, amount, balance, reason, reference_id, "
+                    "created_at) SELECT id, server_id, ?, ?, ?, NULL, ? FROM users WHERE server_id=? AND id>?",
+                    [marbles, marbles, LEDGER_REGISTER, datetime.datetime.utcnow(), server_id, last_id])
+        added = cur.rowcount
+        commit(connection)
+        notify_nicknames_changed(server_id)
+
+        logger.debug('added: %s', added)
+        return added, len(missing) - added
+    except Error as e:
+        logger.error('There was an error inserting users of server(%s): %s', server_id, e)
+        rollback(connection)
+        return None
+
+
 # TODO Update references to new paramaters
 def create_match(connection: sqlite3.Connection, match_id: Union[int, None], amount: int,
                  participant1: int, participant2: int, active: int = 0, accepted: int = 0,
                  game: str = 'melee', format: str = 'Bo3') -> int:
 
-    logger.debug(f'create_match: {match_id}, {amount}, {participant1}, {participant2}, {active}, {accepted},'
-                 f'{game}, {format}')
+    logger.debug('create_match: %s, %s, %s, %s, %s, %s, %s, %s',
+                 match_id, amount, participant1, participant2, active, accepted, game, format)
 
     query = "INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
     query_param = [match_id, amount, active, participant1, participant2, accepted, game, format]
@@ -64,21 +252,21 @@ def create_match(connection: sqlite3.Connection, match_id: Union[int, None], amo
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return cur.lastrowid
     except Error as e:
-        logger.error(f'There was an error inserting a match into matches: {e}')
+        logger.error('There was an error inserting a match into matches: %s', e)
         return 0
 
 
 def create_bet(connection: sqlite3.Connection, bet_id: Union[int, None], amount: int, match_id: int, better_id: int,
                participant1: int) -> int:
 
-    logger.debug(f'create_bet: {bet_id}, {amount}, {match_id}, {better_id}, {participant1}')
+    logger.debug('create_bet: %s, %s, %s, %s, %s', bet_id, amount, match_id, better_id, participant1)
 
     query = "INSERT INTO bets VALUES (?, ?, ?, ?, ?)"
     query_param = [bet_id, amount, match_id, better_id, participant1]
@@ -86,18 +274,14 @@ def create_bet(connection: sqlite3.Connection, bet_id: Union[int, None], amount:
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
-
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        commit(connection)
 
-        subtract_marbles(connection, better_id, amount)
-
-        logger.debug(f'subtract_marbles called')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return cur.lastrowid
     except Error as e:
-        logger.error(f'There was an error inserting a bet into bets: {e}')
+        logger.error('There was an error inserting a bet into bets: %s', e)
         return 0
 
 
@@ -107,8 +291,8 @@ def create_match_history(connection: sqlite3.Connection, match_id: Union[int, No
                          time: datetime.datetime = datetime.datetime.utcnow(),
                          game: str = 'melee', format: str = 'Bo3') -> int:
 
-    logger.debug(f'create_match_history: {match_id}, {amount}, {participant1}, {participant2}, {winner_id}, {time},'
-                 f'{game}, {format}')
+    logger.debug('create_match_history: %s, %s, %s, %s, %s, %s, %s, %s',
+                 match_id, amount, participant1, participant2, winner_id, time, game, format)
 
     query = "INSERT INTO matches_history VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
     query_param = [match_id, amount, participant1, participant2, winner_id, time, game, format]
@@ -116,14 +300,14 @@ def create_match_history(connection: sqlite3.Connection, match_id: Union[int, No
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return cur.lastrowid
     except Error as e:
-        logger.error(f'There was an error inserting a match into match_history: {e}')
+        logger.error('There was an error inserting a match into match_history: %s', e)
         return 0
 
 
@@ -131,8 +315,8 @@ def create_bet_history(connection: sqlite3.Connection, bet_id: Union[int, None],
                        better_id: int, participant1: int, winner_id: int,
                        time: datetime.datetime = datetime.datetime.utcnow()) -> int:
 
-    logger.debug(f'create_bet_history: '
-                 f'{bet_id}, {amount}, {match_id}, {better_id}, {participant1}, {winner_id}, {time}')
+    logger.debug('create_bet_history: %s, %s, %s, %s, %s, %s, %s',
+                 bet_id, amount, match_id, better_id, participant1, winner_id, time)
 
     query = "INSERT INTO bets_history VALUES (?, ?, ?, ?, ?, ?, ?)"
     query_param = [bet_id, amount, match_id, better_id, participant1, winner_id, time]
@@ -140,21 +324,21 @@ def create_bet_history(connection: sqlite3.Connection, bet_id: Union[int, None],
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return cur.lastrowid
     except Error as e:
-        logger.error(f'There was an error inserting a bet into bet_history: {e}')
+        logger.error('There was an error inserting a bet into bet_history: %s', e)
         return 0
 
 
 def create_friendly(connection: sqlite3.Connection, player_id: int,
                     time: datetime.datetime = datetime.datetime.utcnow()):
 
-    logger.debug(f'create_user: {player_id}, {time}')
+    logger.debug('create_user: %s, %s', player_id, time)
 
     query = "INSERT INTO friendly VALUES (?, ?)"
     query_param = [player_id, time]
@@ -162,20 +346,20 @@ def create_friendly(connection: sqlite3.Connection, player_id: int,
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return cur.lastrowid
     except Error as e:
-        logger.error(f'There was an error inserting a friendly into friendly: {e}')
+        logger.error('There was an error inserting a friendly into friendly: %s', e)
         return 0
 
 
 def update_friendly(connection: sqlite3.Connection, player_id: int,
                     time: datetime.datetime = datetime.datetime.utcnow()) -> bool:
-    logger.debug(f'update_friendly: {player_id}, {time}')
+    logger.debug('update_friendly: %s, %s', player_id, time)
 
     query = "UPDATE friendly SET last_used = ? WHERE id = ?"
     query_param = [time, player_id]
@@ -183,20 +367,120 @@ def update_friendly(connection: sqlite3.Connection, player_id: int,
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+
+        return True
+    except Error as e:
+        logger.error('There was an error updating last_used in friendly: %s', e)
+        return False
+
+
+# Sets last_used of a player, adding their friendly row if they don't have one. Parameters are (player_id, time)
+FRIENDLY_UPSERT = ("INSERT INTO friendly(id, last_used) VALUES (?, ?) "
+                   "ON CONFLICT(id) DO UPDATE SET last_used = excluded.last_used")
+
+
+def set_friendly_last_used(connection: sqlite3.Connection, player_id: int, time: datetime.datetime) -> bool:
+    """Sets last_used of player_id, adding their friendly row if they don't have one
+
+    **Arguments**
+
+    - `<connection>` sqlite3 connection to write to database.
+    - `<player_id>` Id of player who used a friendly
+    - `<time>` Time the friendly was used
+
+    """
+    logger.debug('set_friendly_last_used: %s, %s', player_id, time)
+
+    query_param = [player_id, time]
+
+    try:
+        cur = connection.cursor()
+        cur.execute(FRIENDLY_UPSERT, query_param)
+        commit(connection)
+
+        log_query(FRIENDLY_UPSERT, query_param)
 
         return True
     except Error as e:
-        logger.error(f'There was an error updating last_used in friendly: {e}')
+        logger.error('There was an error setting last_used in friendly: %s', e)
+        rollback(connection)
+        return False
+
+
+def claim_friendly(connection: sqlite3.Connection, player_id1: int, player_id2: int, marbles: int,
+                   since: datetime.datetime) -> Optional[Tuple[int, ...]]:
+    """Gives both players marbles for a friendly, unless either was given friendly marbles since, returns balances
+
+    The ledger is checked by the statement that gives the marbles, so a reward can't be claimed twice however
+    friendly last_used times lag behind. Returns an empty tuple without writing anything if either player was
+    already rewarded since, None if the write failed.
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<player_id1>` Id of a player of the friendly
+    - `<player_id2>` Id of the other player
+    - `<marbles>` Amount each player is given
+    - `<since>` Start of the period a player can be rewarded once in
+
+    """
+    logger.debug('claim_friendly: %s, %s, %s, %s', player_id1, player_id2, marbles, since)
+
+    query = ("INSERT INTO marble_ledger(player_id, server_id, amount, balance, reason, reference_id, created_at) "
+             "SELECT id, server_id, ?, marbles + ?, ?, NULL, ? FROM users WHERE id IN (?, ?) "
+             "AND NOT EXISTS (SELECT 1 FROM marble_ledger "
+             "WHERE player_id IN (?, ?) AND reason = ? AND created_at >= ?) "
+             "RETURNING player_id, balance")
+    query_param = [marbles, marbles, LEDGER_FRIENDLY, datetime.datetime.utcnow(), player_id1, player_id2,
+                   player_id1, player_id2, LEDGER_FRIENDLY, since]
+
+    try:
+        cur = connection.cursor()
+        cur.execute(query, query_param)
+        results = dict(cur.fetchall())
+        commit(connection)
+
+        log_query(query, query_param)
+        logger.debug('results: %s', results)
+
+        if not results:
+            return ()
+        return results[player_id1], results[player_id2]
+    except (Error, KeyError) as e:
+        logger.error('There was an error claiming friendly marbles: %s', e)
+        rollback(connection)
+        return None
+
+
+def write_batch(connection: sqlite3.Connection, writes: list) -> bool:
+    """Executes writes in order in one transaction, returns False and writes nothing if one fails
+
+    **Arguments**
+
+    - `<connection>` sqlite3 connection to write to database.
+    - `<writes>` List of (query, query_param), consecutive writes with the same query are executed together
+
+    """
+    logger.debug('write_batch: %s', len(writes))
+
+    try:
+        with unit_of_work(connection):
+            cur = connection.cursor()
+            for query, group in itertools.groupby(writes, key=lambda write: write[0]):
+                cur.executemany(query, [query_param for _, query_param in group])
+        return True
+    except Error as e:
+        logger.error('There was an error writing a batch of %s writes: %s', len(writes), e)
         return False
 
 
 def update_match_activity(connection: sqlite3.Connection, match_id: int, active: int = 1) -> bool:
 
-    logger.debug(f'update_match_activity: {match_id}, {active}')
+    logger.debug('update_match_activity: %s, %s', match_id, active)
 
     query = "UPDATE matches SET active = ? WHERE id = ?"
     query_param = [active, match_id]
@@ -204,20 +488,20 @@ def update_match_activity(connection: sqlite3.Connection, match_id: int, active:
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return True
     except Error as e:
-        logger.error(f'There was an error updating activity in matches: {e}')
+        logger.error('There was an error updating activity in matches: %s', e)
         return False
 
 
 def update_match_accepted(connection: sqlite3.Connection, match_id: int, accepted: int = 1) -> bool:
 
-    logger.debug(f'update_match_accepted: {match_id}, {accepted}')
+    logger.debug('update_match_accepted: %s, %s', match_id, accepted)
 
     query = "UPDATE matches SET accepted = ? WHERE id = ?"
     query_param = [accepted, match_id]
@@ -225,40 +509,43 @@ def update_match_accepted(connection: sqlite3.Connection, match_id: int, accepte
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return True
     except Error as e:
-        logger.error(f'There was an error updating accepted in matches: {e}')
+        logger.error('There was an error updating accepted in matches: %s', e)
         return False
 
 
-def update_marble_count(connection: sqlite3.Connection, player_id: int, marbles: int) -> bool:
+def update_marble_count(connection: sqlite3.Connection, player_id: int, marbles: int,
+                        reason: str = LEDGER_ADMIN_SET) -> bool:
 
-    logger.debug(f'update_marble_count: {player_id}, {marbles}')
+    logger.debug('update_marble_count: %s, %s, %s', player_id, marbles, reason)
 
-    query = "UPDATE users SET marbles = ? WHERE id = ?"
-    query_param = [marbles, player_id]
+    # Ledger entry of the difference to marbles, balance is written by the ledger_balance trigger
+    query = ("INSERT INTO marble_ledger(player_id, server_id, amount, balance, reason, reference_id, created_at) "
+             "SELECT id, server_id, ? - marbles, ?, ?, NULL, ? FROM users WHERE id = ?")
+    query_param = [marbles, marbles, reason, datetime.datetime.utcnow(), player_id]
 
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return True
     except Error as e:
-        logger.error(f'There was an error updating marbles in user: {e}')
+        logger.error('There was an error updating marbles in user: %s', e)
         return False
 
 
 def update_player_nickname(connection: sqlite3.Connection, player_id: int, nickname: str) -> bool:
-    logger.debug(f'update_player_nickname: {player_id}, {nickname}')
+    logger.debug('update_player_nickname: %s, %s', player_id, nickname)
 
     query = "UPDATE users SET nickname = ? WHERE id = ?"
     query_param = [nickname, player_id]
@@ -266,20 +553,21 @@ def update_player_nickname(connection: sqlite3.Connection, player_id: int, nickn
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
+        notify_nicknames_changed(None)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return True
     except Error as e:
-        logger.error(f'There was an error updating wins in user: {e}')
+        logger.error('There was an error updating wins in user: %s', e)
         return False
 
 
 def update_player_wins(connection: sqlite3.Connection, player_id: int, wins: int) -> bool:
 
-    logger.debug(f'update_player_wins: {player_id}, {wins}')
+    logger.debug('update_player_wins: %s, %s', player_id, wins)
 
     query = "UPDATE users SET wins = ? WHERE id = ?"
     query_param = [wins, player_id]
@@ -287,20 +575,20 @@ def update_player_wins(connection: sqlite3.Connection, player_id: int, wins: int
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return True
     except Error as e:
-        logger.error(f'There was an error updating wins in user: {e}')
+        logger.error('There was an error updating wins in user: %s', e)
         return False
 
 
 def update_player_loses(connection: sqlite3.Connection, player_id: int, loses: int) -> bool:
 
-    logger.debug(f'update_player_loses: {player_id}, {loses}')
+    logger.debug('update_player_loses: %s, %s', player_id, loses)
 
     query = "UPDATE users SET loses = ? WHERE id = ?"
     query_param = [loses, player_id]
@@ -308,20 +596,20 @@ def update_player_loses(connection: sqlite3.Connection, player_id: int, loses: i
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return True
     except Error as e:
-        logger.error(f'There was an error updating loses in user: {e}')
+        logger.error('There was an error updating loses in user: %s', e)
         return False
 
 
 def update_bet(connection: sqlite3.Connection, bet_id: int, player_id: int, amount: int) -> bool:
 
-    logger.debug(f'update_bet: {bet_id}, {player_id}, {amount}')
+    logger.debug('update_bet: %s, %s, %s', bet_id, player_id, amount)
 
     query = "UPDATE bets SET amount=?, participant1=? WHERE id=?"
     query_param = [amount, player_id, bet_id]
@@ -329,458 +617,827 @@ def update_bet(connection: sqlite3.Connection, bet_id: int, player_id: int, amou
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
 
         return True
     except Error as e:
-        logger.error(f'There was an error updating bet in bets: {e}')
+        logger.error('There was an error updating bet in bets: %s', e)
         return False
 
 
 def get_friendly_last_used(connection: sqlite3.Connection, player_id: int) -> Union[datetime.datetime, int]:
 
-    logger.debug(f'get_friendly_last_used: {player_id}')
+    logger.debug('get_friendly_last_used: %s', player_id)
 
-    query = "SELECT * FROM friendly WHERE id=?"
+    statement = statements.FRIENDLY_LAST_USED
     query_param = [player_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
-            return results[1]
+            return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting a friendly from friendly: {e}')
+        logger.error('There was an error selecting a friendly from friendly: %s', e)
         return 0
 
 
 def get_match_info_by_id(connection: sqlite3.Connection, match_id: int) -> Union[tuple, int]:
 
-    logger.debug(f'get_match_info_by_id: {match_id}')
+    logger.debug('get_match_info_by_id: %s', match_id)
 
-    query = "SELECT * FROM matches WHERE id=?"
+    statement = statements.MATCH_INFO
     query_param = [match_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting a match from matches: {e}')
+        logger.error('There was an error selecting a match from matches: %s', e)
         return 0
 
 
 # TODO Update function ot use palyer2_id for simplified functions
 def get_match_info_all(connection: sqlite3.Connection, player_id: int):
 
-    logger.debug(f'get_match_info_all: {player_id}')
+    logger.debug('get_match_info_all: %s', player_id)
 
-    query = "SELECT * FROM matches WHERE participant1=? OR participant2=?"
+    statement = statements.MATCH_INFO_ALL
     query_param = [player_id, player_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchall()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting all matches from matches: {e}')
+        logger.error('There was an error selecting all matches from matches: %s', e)
         return 0
 
 
 def get_match_history_info(connection: sqlite3.Connection, match_id: int) -> Union[tuple, int]:
-    logger.debug(f'get_match_history_info: {match_id}')
+    logger.debug('get_match_history_info: %s', match_id)
 
-    query = "SELECT * FROM matches_history WHERE id=?"
+    statement = statements.MATCH_HISTORY_INFO
     query_param = [match_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting matches from match_history: {e}')
+        logger.error('There was an error selecting matches from match_history: %s', e)
         return 0
 
 
 # TODO Update function ot use palyer2_id for simplified functions
 def get_match_history_info_all(connection: sqlite3.Connection, player_id: int, player2_id: int = None):
 
-    logger.debug(f'get_match_history_info_all: {player_id}')
+    logger.debug('get_match_history_info_all: %s', player_id)
 
-    query = "SELECT * FROM matches_history WHERE participant1=? OR participant2=?"
+    statement = statements.MATCH_HISTORY_INFO_ALL
     query_param = [player_id, player_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchall()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting all matches from match_history: {e}')
+        logger.error('There was an error selecting all matches from match_history: %s', e)
+        return 0
+
+
+# Columns of users selected by joined queries, in the order Account takes them
+USER_COLUMNS = statements.USER_COLUMNS
+
+
+def user_columns(alias: str) -> str:
+    return statements.columns(USER_COLUMNS, alias)
+
+
+def page_condition(column: str, before_id: int = None, after_id: int = None) -> Tuple[str, list, str]:
+    """Returns keyset condition, its parameters and sort order for a page before or after an id
+
+    Pages before_id, or the newest page if neither is given, are read newest first so LIMIT keeps the rows closest
+    to the cursor. Pages after_id are read oldest first.
+
+    """
+    if after_id is not None:
+        return f" AND {column}>?", [after_id], 'ASC'
+    if before_id is not None:
+        return f" AND {column}<?", [before_id], 'DESC'
+    return '', [], 'DESC'
+
+
+def get_match_history_joined(connection: sqlite3.Connection, player_id: int, player2_id: int = None,
+                             limit: int = None, before_id: int = None, after_id: int = None):
+    """Returns matches_history rows with player_id, joined with the users rows of challenger, recipient and winner
+
+    Rows are MatchHistoryJoinedRow with UserRows of challenger, recipient and winner, ordered oldest first. If
+    player2_id is given only matches with both players are returned. If limit is given only one page of at most
+    limit rows is returned, the newest one, or the one directly before_id or after_id.
+
+    """
+    logger.debug('get_match_history_joined: %s, %s, %s, %s, %s', player_id, player2_id, limit, before_id, after_id)
+
+    query = (f"SELECT m.id, m.amount, m.match_time, m.game, m.format, "
+             f"{user_columns('c')}, {user_columns('r')}, {user_columns('w')} "
+             f"FROM matches_history m "
+             f"JOIN users c ON c.id = m.participant1 "
+             f"JOIN users r ON r.id = m.participant2 "
+             f"JOIN users w ON w.id = m.winner_id ")
+
+    if limit is None:
+        query += "WHERE (m.participant1=? OR m.participant2=?)"
+        query_param = [player_id, player_id]
+
+        if player2_id is not None:
+            query += " AND (m.participant1=? OR m.participant2=?)"
+            query_param += [player2_id, player2_id]
+    else:
+        # Page ids are picked from each participant index separately, so only limit rows per side are read
+        if player2_id == player_id:
+            player2_id = None
+        condition, condition_param, order = page_condition('id', before_id, after_id)
+        sides = []
+        query_param = []
+        for column, other in (('participant1', 'participant2'), ('participant2', 'participant1')):
+            side = f"SELECT id FROM matches_history WHERE {column}=?"
+            query_param.append(player_id)
+            if player2_id is not None:
+                side += f" AND {other}=?"
+                query_param.append(player2_id)
+            sides.append(f"SELECT id FROM ({side}{condition} ORDER BY id {order} LIMIT ?)")
+            query_param += condition_param + [limit]
+        query += f"WHERE m.id IN ({' UNION '.join(sides)} ORDER BY id {order} LIMIT ?)"
+        query_param.append(limit)
+    query += " ORDER BY m.id"
+
+    try:
+        cur = statements.execute(connection, query, query_param, statements.match_history_joined_row)
+        results = cur.fetchall()
+
+        log_query(query, query_param)
+        logger.debug('results: %s', len(results))
+
+        return results
+    except Error as e:
+        logger.error('There was an error selecting joined matches from match_history: %s', e)
+        return 0
+
+
+def get_match_info_joined(connection: sqlite3.Connection, player_id: int, player2_id: int = None):
+    """Returns matches rows with player_id, joined with the users rows of challenger and recipient
+
+    Rows are MatchJoinedRow with UserRows of challenger and recipient.
+    If player2_id is given only matches with both players are returned.
+
+    """
+    logger.debug('get_match_info_joined: %s, %s', player_id, player2_id)
+
+    query = (f"SELECT m.id, m.amount, m.active, m.accepted, m.game, m.format, "
+             f"{user_columns('c')}, {user_columns('r')} "
+             f"FROM matches m "
+             f"JOIN users c ON c.id = m.participant1 "
+             f"JOIN users r ON r.id = m.participant2 "
+             f"WHERE (m.participant1=? OR m.participant2=?)")
+    query_param = [player_id, player_id]
+
+    if player2_id is not None:
+        query += " AND (m.participant1=? OR m.participant2=?)"
+        query_param += [player2_id, player2_id]
+    query += " ORDER BY m.id"
+
+    try:
+        cur = statements.execute(connection, query, query_param, statements.match_joined_row)
+        results = cur.fetchall()
+
+        log_query(query, query_param)
+        logger.debug('results: %s', len(results))
+
+        return results
+    except Error as e:
+        logger.error('There was an error selecting joined matches from matches: %s', e)
         return 0
 
 
 def get_player_id(connection: sqlite3.Connection, uuid: int, server_id: int) -> int:
 
-    logger.debug(f'get_player_id: {uuid}, {server_id}')
+    logger.debug('get_player_id: %s, %s', uuid, server_id)
 
-    query = "SELECT * FROM users WHERE uuid=? AND server_id=?"
+    statement = statements.PLAYER_ID
     query_param = [uuid, server_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
-            return results[0]
+            return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting player_id in users: {e}')
+        logger.error('There was an error selecting player_id in users: %s', e)
         return 0
 
 
 def get_player_id_by_username(connection: sqlite3, nickname: str):
 
-    logger.debug(f'get_player_id_by_username: {nickname}')
+    logger.debug('get_player_id_by_username: %s', nickname)
 
-    query = "SELECT * FROM users WHERE nickname=?"
+    statement = statements.PLAYER_ID_BY_NICKNAME
     query_param = [nickname]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
-            return results[0]
+            return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting player_id in users: {e}')
+        logger.error('There was an error selecting player_id in users: %s', e)
         return 0
 
 
 def get_player_info(connection: sqlite3.Connection, player_id: int):
 
-    logger.debug(f'get_player_info: {player_id}')
+    logger.debug('get_player_info: %s', player_id)
 
-    query = "SELECT * FROM users WHERE id=?"
+    statement = statements.PLAYER_INFO
     query_param = [player_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting player_info in users: {e}')
+        logger.error('There was an error selecting player_info in users: %s', e)
+        return 0
+
+
+def get_player_info_many(connection: sqlite3.Connection, player_ids: list):
+    """Returns UserRows of every id in player_ids that exists, in one query
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<player_ids>` Ids of players to get
+
+    """
+    logger.debug('get_player_info_many: %s', player_ids)
+
+    query = (f"SELECT {statements.columns(USER_COLUMNS)} FROM users "
+             f"WHERE id IN ({', '.join('?' * len(player_ids))})")
+    query_param = list(player_ids)
+
+    try:
+        cur = statements.execute(connection, query, query_param, statements.user_row)
+        results = cur.fetchall()
+
+        log_query(query, query_param)
+        logger.debug('results: %s', len(results))
+
+        return results
+    except Error as e:
+        logger.error('There was an error selecting player_info in users: %s', e)
         return 0
 
 
 def get_player_wins(connection: sqlite3.Connection, player_id: int) -> int:
 
-    logger.debug(f'get_player_wins: {player_id}')
-    return get_player_info(connection, player_id)[4]
+    logger.debug('get_player_wins: %s', player_id)
+
+    try:
+        results = statements.PLAYER_WINS.execute(connection, [player_id]).fetchone()
+        logger.debug('results: %s', results)
+        return results if results is not None else 0
+    except Error as e:
+        logger.error('There was an error selecting wins from users: %s', e)
+        return 0
 
 
 def get_player_loses(connection: sqlite3.Connection, player_id: int) -> int:
 
-    logger.debug(f'get_player_loses: {player_id}')
-    return get_player_info(connection, player_id)[5]
+    logger.debug('get_player_loses: %s', player_id)
+
+    try:
+        results = statements.PLAYER_LOSES.execute(connection, [player_id]).fetchone()
+        logger.debug('results: %s', results)
+        return results if results is not None else 0
+    except Error as e:
+        logger.error('There was an error selecting loses from users: %s', e)
+        return 0
 
 
 def get_player_info_all_by_server(connection: sqlite3.Connection, server_id: int):
 
-    logger.debug(f'get_player_info_all_by_server: {server_id}')
+    logger.debug('get_player_info_all_by_server: %s', server_id)
 
-    query = "SELECT * FROM users WHERE server_id=?"
+    statement = statements.PLAYER_INFO_BY_SERVER
     query_param = [server_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchall()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting all player_info in users: {e}')
+        logger.error('There was an error selecting all player_info in users: %s', e)
+        return 0
+
+
+def get_server_nicknames(connection: sqlite3.Connection, server_id: int):
+    """Returns (id, nickname) of every user on server_id, read from idx_users_server_nickname only
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<server_id>` Server to get nicknames of
+
+    """
+    logger.debug('get_server_nicknames: %s', server_id)
+
+    statement = statements.SERVER_NICKNAMES
+    query_param = [server_id]
+
+    try:
+        cur = statement.execute(connection, query_param)
+        results = cur.fetchall()
+
+        log_query(statement.sql, query_param)
+        logger.debug('results: %s', len(results))
+
+        return results
+    except Error as e:
+        logger.error('There was an error selecting nicknames from users: %s', e)
+        return 0
+
+
+def get_leaderboard(connection: sqlite3.Connection, server_id: int, stat: str, limit: int = 10):
+    """Returns UserRows of the top limit users of server_id by stat, ties ordered by id
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<server_id>` Server to get leaderboard of
+    - `<stat>` Key of statements.LEADERBOARD_STATS to order by
+    - `<limit>` Amount of rows to return
+
+    """
+    logger.debug('get_leaderboard: %s, %s, %s', server_id, stat, limit)
+
+    statement = statements.LEADERBOARD[stat]
+    query_param = [server_id, limit]
+
+    try:
+        cur = statement.execute(connection, query_param)
+        results = cur.fetchall()
+
+        log_query(statement.sql, query_param)
+        logger.debug('results: %s', len(results))
+
+        return results
+    except Error as e:
+        logger.error('There was an error selecting leaderboard from users: %s', e)
+        return 0
+
+
+def get_leaderboard_rank(connection: sqlite3.Connection, server_id: int, stat: str, player_id: int) -> int:
+    """Returns rank of player_id on server_id leaderboard of stat, 0 if player isn't on it
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<server_id>` Server of leaderboard
+    - `<stat>` Key of statements.LEADERBOARD_STATS to rank by
+    - `<player_id>` Id of player to get rank of
+
+    """
+    logger.debug('get_leaderboard_rank: %s, %s, %s', server_id, stat, player_id)
+
+    statement = statements.LEADERBOARD_RANK[stat]
+    query_param = [player_id, server_id, server_id, server_id]
+
+    try:
+        cur = statement.execute(connection, query_param)
+        results = cur.fetchone()
+
+        log_query(statement.sql, query_param)
+        logger.debug('results: %s', results)
+
+        if results is None:
+            return 0
+        return results
+    except Error as e:
+        logger.error('There was an error selecting leaderboard rank from users: %s', e)
         return 0
 
 
 def get_marble_count(connection: sqlite3.Connection, player_id: int) -> int:
 
-    logger.debug(f'get_marble_count: {player_id}')
+    logger.debug('get_marble_count: %s', player_id)
 
-    query = "SELECT * FROM users WHERE id=?"
+    statement = statements.MARBLE_COUNT
     query_param = [player_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
-            return results[3]
+            return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting marbles from users: {e}')
+        logger.error('There was an error selecting marbles from users: %s', e)
         return 0
 
 
 def get_bet_info(connection: sqlite3.Connection, bet_id: int):
 
-    logger.debug(f'get_bet_info: {bet_id}')
+    logger.debug('get_bet_info: %s', bet_id)
 
-    query = "SELECT * FROM bets WHERE id=?"
+    statement = statements.BET_INFO
     query_param = [bet_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting bet_info from bets: {e}')
+        logger.error('There was an error selecting bet_info from bets: %s', e)
         return 0
 
 
 def get_bet_info_all(connection: sqlite3.Connection, player_id: int):
 
-    logger.debug(f'get_bet_info_all: {player_id}')
+    logger.debug('get_bet_info_all: %s', player_id)
 
-    query = "SELECT * FROM bets WHERE better_id=?"
+    statement = statements.BET_INFO_ALL
     query_param = [player_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchall()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting all bet_info from bets: {e}')
+        logger.error('There was an error selecting all bet_info from bets: %s', e)
         return 0
 
 
 def get_bet_info_match_all(connection: sqlite3.Connection, match_id: int):
 
-    logger.debug(f'get_bet_info_all: {match_id}')
+    logger.debug('get_bet_info_all: %s', match_id)
 
-    query = "SELECT * FROM bets WHERE match_id=?"
+    statement = statements.BET_INFO_MATCH_ALL
     query_param = [match_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchall()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting all bet_info from bets: {e}')
+        logger.error('There was an error selecting all bet_info from bets: %s', e)
         return 0
 
 
 def get_bet_history_info(connection: sqlite3.Connection, bet_id: int):
 
-    logger.debug(f'get_bet_history_info: {bet_id}')
+    logger.debug('get_bet_history_info: %s', bet_id)
 
-    query = "SELECT * FROM bets_history WHERE id=?"
+    statement = statements.BET_HISTORY_INFO
     query_param = [bet_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting bet_history_info from bets_history: {e}')
+        logger.error('There was an error selecting bet_history_info from bets_history: %s', e)
         return 0
 
 
 def get_bet_history_info_all(connection: sqlite3.Connection, better_id: int):
 
-    logger.debug(f'get_bet_history_info_all: {better_id}')
+    logger.debug('get_bet_history_info_all: %s', better_id)
 
-    query = "SELECT * FROM bets_history WHERE better_id=?"
+    statement = statements.BET_HISTORY_INFO_ALL
     query_param = [better_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchall()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
             return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting all bet_history_info from bet_history: {e}')
+        logger.error('There was an error selecting all bet_history_info from bet_history: %s', e)
         return 0
 
 
-def find_match_by_player_id(connection: sqlite3.Connection, player_id: int):
+def get_bet_history_joined(connection: sqlite3.Connection, better_id: int, target_id: int = None,
+                           limit: int = None, before_id: int = None, after_id: int = None):
+    """Returns bets_history rows of better_id joined with their matches_history row and all users rows involved
+
+    Rows are BetHistoryJoinedRow with UserRows of bettor, bet_target, bet winner, challenger, recipient and match
+    winner, ordered oldest first. If target_id is
+    given only bets on that player are returned. If limit is given only one page of at most limit rows is returned,
+    the newest one, or the one directly before_id or after_id.
+
+    """
+    logger.debug('get_bet_history_joined: %s, %s, %s, %s, %s', better_id, target_id, limit, before_id, after_id)
+
+    query = (f"SELECT b.id, b.amount, b.bet_time, m.id, m.amount, m.match_time, m.game, m.format, "
+             f"{user_columns('bu')}, {user_columns('tu')}, {user_columns('wu')}, "
+             f"{user_columns('cu')}, {user_columns('ru')}, {user_columns('mwu')} "
+             f"FROM bets_history b "
+             f"JOIN matches_history m ON m.id = b.match_id "
+             f"JOIN users bu ON bu.id = b.better_id "
+             f"JOIN users tu ON tu.id = b.participant1 "
+             f"JOIN users wu ON wu.id = b.winner_id "
+             f"JOIN users cu ON cu.id = m.participant1 "
+             f"JOIN users ru ON ru.id = m.participant2 "
+             f"JOIN users mwu ON mwu.id = m.winner_id "
+             f"WHERE b.better_id=?")
+    query_param = [better_id]
+
+    if target_id is not None:
+        query += " AND b.participant1=?"
+        query_param.append(target_id)
+
+    if limit is not None:
+        # Select page ids from the better_id index, then join only those rows
+        condition, condition_param, order = page_condition('id', before_id, after_id)
+        page = "SELECT id FROM bets_history WHERE better_id=?"
+        page_param = [better_id]
+        if target_id is not None:
+            page += " AND participant1=?"
+            page_param.append(target_id)
+        query += f" AND b.id IN ({page}{condition} ORDER BY id {order} LIMIT ?)"
+        query_param += page_param + condition_param + [limit]
+    query += " ORDER BY b.id"
 
-    logger.debug(f'find_match_by_player_id: {player_id}')
+    try:
+        cur = statements.execute(connection, query, query_param, statements.bet_history_joined_row)
+        results = cur.fetchall()
 
-    query = "SELECT * FROM matches WHERE participant1=? OR participant2=?"
+        log_query(query, query_param)
+        logger.debug('results: %s', len(results))
+
+        return results
+    except Error as e:
+        logger.error('There was an error selecting joined bets from bets_history: %s', e)
+        return 0
+
+
+def count_match_history(connection: sqlite3.Connection, player_id: int, player2_id: int = None) -> int:
+    """Returns amount of matches_history rows with player_id, and player2_id if given"""
+    logger.debug('count_match_history: %s, %s', player_id, player2_id)
+
+    query = "SELECT COUNT(*) FROM matches_history WHERE (participant1=? OR participant2=?)"
     query_param = [player_id, player_id]
 
+    if player2_id is not None:
+        query += " AND (participant1=? OR participant2=?)"
+        query_param += [player2_id, player2_id]
+
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(query, query_param)
+        logger.debug('results: %s', results)
+
+        return results[0]
+    except Error as e:
+        logger.error('There was an error counting matches_history: %s', e)
+        return 0
+
+
+def count_bet_history(connection: sqlite3.Connection, better_id: int, target_id: int = None) -> int:
+    """Returns amount of bets_history rows of better_id, on target_id if given"""
+    logger.debug('count_bet_history: %s, %s', better_id, target_id)
+
+    query = "SELECT COUNT(*) FROM bets_history WHERE better_id=?"
+    query_param = [better_id]
+
+    if target_id is not None:
+        query += " AND participant1=?"
+        query_param.append(target_id)
+
+    try:
+        cur = connection.cursor()
+        cur.execute(query, query_param)
+        results = cur.fetchone()
+
+        log_query(query, query_param)
+        logger.debug('results: %s', results)
+
+        return results[0]
+    except Error as e:
+        logger.error('There was an error counting bets_history: %s', e)
+        return 0
+
+
+def get_bet_info_joined(connection: sqlite3.Connection, better_id: int, target_id: int = None):
+    """Returns bets rows of better_id joined with their matches row and all users rows involved
+
+    Rows are BetJoinedRow with UserRows of bettor, bet_target, challenger and recipient. If target_id is given only
+    bets on that player are returned.
+
+    """
+    logger.debug('get_bet_info_joined: %s, %s', better_id, target_id)
+
+    query = (f"SELECT b.id, b.amount, m.id, m.amount, m.active, m.accepted, m.game, m.format, "
+             f"{user_columns('bu')}, {user_columns('tu')}, {user_columns('cu')}, {user_columns('ru')} "
+             f"FROM bets b "
+             f"JOIN matches m ON m.id = b.match_id "
+             f"JOIN users bu ON bu.id = b.better_id "
+             f"JOIN users tu ON tu.id = b.participant1 "
+             f"JOIN users cu ON cu.id = m.participant1 "
+             f"JOIN users ru ON ru.id = m.participant2 "
+             f"WHERE b.better_id=?")
+    query_param = [better_id]
+
+    if target_id is not None:
+        query += " AND b.participant1=?"
+        query_param.append(target_id)
+    query += " ORDER BY b.id"
+
+    try:
+        cur = statements.execute(connection, query, query_param, statements.bet_joined_row)
+        results = cur.fetchall()
+
+        log_query(query, query_param)
+        logger.debug('results: %s', len(results))
+
+        return results
+    except Error as e:
+        logger.error('There was an error selecting joined bets from bets: %s', e)
+        return 0
+
+
+def find_match_by_player_id(connection: sqlite3.Connection, player_id: int):
+
+    logger.debug('find_match_by_player_id: %s', player_id)
+
+    statement = statements.MATCH_ID_BY_PLAYER
+    query_param = [player_id, player_id]
+
+    try:
+        cur = statement.execute(connection, query_param)
+        results = cur.fetchone()
+
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
-            return results[0]
+            return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting match_id from matches: {e}')
+        logger.error('There was an error selecting match_id from matches: %s', e)
         return 0
 
 
 def find_bet(connection: sqlite3.Connection, match_id: int, better_id: int):
 
-    logger.debug(f'find_bet: {match_id}, {better_id}')
+    logger.debug('find_bet: %s, %s', match_id, better_id)
 
-    query = "SELECT * FROM bets WHERE match_id=? AND better_id=?"
+    statement = statements.BET_ID
     query_param = [match_id, better_id]
 
     try:
-        cur = connection.cursor()
-        cur.execute(query, query_param)
+        cur = statement.execute(connection, query_param)
         results = cur.fetchone()
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'results: {results}')
+        log_query(statement.sql, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('results: %s', results)
 
         if results is not None:
-            return results[0]
+            return results
         else:
             return 0
     except Error as e:
-        logger.error(f'There was an error selecting bet from bets: {e}')
+        logger.error('There was an error selecting bet from bets: %s', e)
         return 0
 
 
 def delete_match(connection: sqlite3.Connection, match_id: int) -> bool:
 
-    logger.debug(f'delete_match: {match_id}')
+    logger.debug('delete_match: %s', match_id)
 
     query = "DELETE FROM matches WHERE id=?"
     query_parm = [match_id]
@@ -788,21 +1445,21 @@ def delete_match(connection: sqlite3.Connection, match_id: int) -> bool:
     try:
         cur = connection.cursor()
         cur.execute(query, query_parm)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_parm))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'match deleted')
+        log_query(query, query_parm)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('match deleted')
 
         return True
     except Error as e:
-        logger.error(f'There was an error deleting match from matches: {e}')
+        logger.error('There was an error deleting match from matches: %s', e)
         return False
 
 
 def delete_bet(connection: sqlite3.Connection, bet_id: int) -> bool:
 
-    logger.debug(f'delete_bet: {bet_id}')
+    logger.debug('delete_bet: %s', bet_id)
 
     query = "DELETE FROM bets WHERE id=?"
     query_param = [bet_id]
@@ -810,79 +1467,492 @@ def delete_bet(connection: sqlite3.Connection, bet_id: int) -> bool:
     try:
         cur = connection.cursor()
         cur.execute(query, query_param)
-        connection.commit()
+        commit(connection)
 
-        logger.debug(replace_char_list(query, query_param))
-        logger.debug(f'lastrowid: {cur.lastrowid}')
-        logger.debug(f'bet deleted')
+        log_query(query, query_param)
+        logger.debug('lastrowid: %s', cur.lastrowid)
+        logger.debug('bet deleted')
 
         return True
     except Error as e:
-        logger.error(f'There was an error deleting bet from bets: {e}')
+        logger.error('There was an error deleting bet from bets: %s', e)
         return False
 
 
 def delete_bet_by_match_id(connection: sqlite3.Connection, match_id: int):
-
-    logger.debug(f'delete_bet_by_match_id: {match_id}')
+    """Deletes every bet on match_id, refunding each bettor as a bet refund in the ledger"""
+    logger.debug('delete_bet_by_match_id: %s', match_id)
     bets = get_bet_info_match_all(connection, match_id)
+    if isinstance(bets, int):
+        rollback(connection)
+        return
     for bet in bets:
-        add_marbles(connection, bet[3], bet[1])
-        delete_bet(connection, bet[0])
+        add_marbles(connection, bet.better_id, bet.amount, LEDGER_BET_REFUND, bet.id)
+        delete_bet(connection, bet.id)
+
+
+def change_marbles(connection: sqlite3.Connection, player_id: int, marbles: int, reason: str,
+                   reference_id: int = None) -> Optional[int]:
+    """Adds marbles to player_id's balance in one statement, never going below zero, returns new balance
+
+    Returns None if the player doesn't exist or the write failed. Loaded Accounts aren't invalidated, callers set
+    them from the returned balance.
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<player_id>` Id of player to change balance of
+    - `<marbles>` Amount to add, negative to subtract
+    - `<reason>` One of the LEDGER_ reasons
+    - `<reference_id>` Id of the match, bet or player the change belongs to
+
+    """
+    logger.debug('change_marbles: %s, %s, %s, %s', player_id, marbles, reason, reference_id)
+
+    query = f"{LEDGER_INSERT} RETURNING balance"
+    query_param = ledger_params(player_id, marbles, reason, reference_id)
+
+    try:
+        cur = connection.cursor()
+        cur.execute(query, query_param)
+        # Rows of RETURNING need to be read before the statement is finished and committed
+        results = cur.fetchall()
+        commit(connection)
 
+        log_query(query, query_param)
+        logger.debug('results: %s', results)
+
+        if not results:
+            return None
+        return results[0][0]
+    except Error as e:
+        logger.error('There was an error changing marbles of player(%s): %s', player_id, e)
+        rollback(connection)
+        return None
+
+
+def spend_marbles(connection: sqlite3.Connection, player_id: int, marbles: int, reason: str,
+                  reference_id: int = None) -> Optional[int]:
+    """Takes marbles from player_id's balance only if they have that many, returns new balance
+
+    The balance is checked by the statement that takes the marbles, so concurrent spends can't overdraw. Returns
+    None without writing anything if player_id has less than marbles, or if the write failed. Loaded Accounts aren't
+    invalidated, callers set them from the returned balance.
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<player_id>` Id of player to take marbles from
+    - `<marbles>` Amount to take, negative gives marbles back
+    - `<reason>` One of the LEDGER_ reasons
+    - `<reference_id>` Id of the match or bet the marbles are staked on
+
+    """
+    logger.debug('spend_marbles: %s, %s, %s, %s', player_id, marbles, reason, reference_id)
+
+    query = f"{LEDGER_INSERT} AND marbles >= ? RETURNING balance"
+    query_param = ledger_params(player_id, -marbles, reason, reference_id) + (marbles,)
+
+    try:
+        cur = connection.cursor()
+        cur.execute(query, query_param)
+        results = cur.fetchall()
+        commit(connection)
+
+        log_query(query, query_param)
+        logger.debug('results: %s', results)
+
+        if not results:
+            return None
+        return results[0][0]
+    except Error as e:
+        logger.error('There was an error spending marbles of player(%s): %s', player_id, e)
+        rollback(connection)
+        return None
+
+
+def add_marbles(connection: sqlite3.Connection, player_id: int, marbles: int,
+                reason: str = LEDGER_ADMIN_ADD, reference_id: int = None) -> bool:
+
+    logger.debug('add_marbles: %s, %s', player_id, marbles)
+    notify_users_changed(player_id)
+    return change_marbles(connection, player_id, marbles, reason, reference_id) is not None
+
+
+def increment_player_stat(connection: sqlite3.Connection, player_id: int, column: str, amount: int) -> bool:
+    """Adds amount to wins or loses of player_id in one statement
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<player_id>` Id of player to update
+    - `<column>` wins or loses
+    - `<amount>` Amount to add
+
+    """
+    logger.debug('increment_player_stat: %s, %s, %s', player_id, column, amount)
+
+    if column not in ('wins', 'loses'):
+        logger.error('Invalid column: %s', column)
+        return False
+
+    query = f"UPDATE users SET {column} = {column} + ? WHERE id = ?"
+    query_param = [amount, player_id]
+
+    try:
+        cur = connection.cursor()
+        cur.execute(query, query_param)
+        commit(connection)
 
-def add_marbles(connection: sqlite3.Connection, player_id: int, marbles: int) -> bool:
+        log_query(query, query_param)
+        logger.debug('rowcount: %s', cur.rowcount)
 
-    logger.debug(f'add_marbles: {player_id}, {marbles}')
-    old_marbles = get_marble_count(connection, player_id)
-    return update_marble_count(connection, player_id, old_marbles + marbles)
+        notify_users_changed(player_id)
+        return cur.rowcount == 1
+    except Error as e:
+        logger.error('There was an error updating %s of player(%s): %s', column, player_id, e)
+        rollback(connection)
+        return False
 
 
 def add_player_win(connection: sqlite3.Connection, player_id: int, wins: int) -> bool:
 
-    logger.debug(f'add_player_win: {player_id}, {wins}')
-    player_wins = get_player_wins(connection, player_id)
-    return update_player_wins(connection, player_id, player_wins+wins)
+    logger.debug('add_player_win: %s, %s', player_id, wins)
+    return increment_player_stat(connection, player_id, 'wins', wins)
 
 
 def add_player_loses(connection: sqlite3.Connection, player_id: int, loses: int) -> bool:
 
-    logger.debug(f'add_player_loses: {player_id}, {loses}')
-    player_loses = get_player_loses(connection, player_id)
-    return update_player_loses(connection, player_id, player_loses+loses)
+    logger.debug('add_player_loses: %s, %s', player_id, loses)
+    return increment_player_stat(connection, player_id, 'loses', loses)
+
+
+def subtract_marbles(connection: sqlite3.Connection, player_id: int, marbles: int,
+                     reason: str = LEDGER_ADMIN_SUB, reference_id: int = None) -> bool:
+
+    logger.debug('subtract_marbles: %s, %s', player_id, marbles)
+    notify_users_changed(player_id)
+    return change_marbles(connection, player_id, -marbles, reason, reference_id) is not None
+
 
+def transfer_marbles(connection: sqlite3.Connection, player_id1: int, player_id2: int,
+                     marbles: int) -> Optional[Tuple[int, int]]:
+    """Moves marbles from player_id1 to player_id2 in one transaction, returns both new balances
 
-def subtract_marbles(connection: sqlite3.Connection, player_id: int, marbles: int) -> bool:
+    Returns None without writing anything if player_id1 has less than marbles, or if either write fails. Loaded
+    Accounts aren't invalidated, callers set them from the returned balances.
 
-    logger.debug(f'subtract_marbles: {player_id}, {marbles}')
-    old_marbles = get_marble_count(connection, player_id)
+    **Arguments**
 
-    if old_marbles - marbles < 0:
-        return update_marble_count(connection, player_id, 0)
+    - `<connection>` Connection to database
+    - `<player_id1>` Id of player sending marbles
+    - `<player_id2>` Id of player receiving marbles
+    - `<marbles>` Amount to transfer
 
-    return update_marble_count(connection, player_id, old_marbles - marbles)
+    """
+    logger.debug('transfer_marbles: %s, %s, %s', player_id1, player_id2, marbles)
+
+    try:
+        cur = connection.cursor()
+        # Balance is checked by the same statement that takes the marbles, so concurrent spends can't overdraw
+        now = datetime.datetime.utcnow()
+        cur.execute(f"{LEDGER_INSERT} AND marbles >= ? RETURNING balance",
+                    ledger_params(player_id1, -marbles, LEDGER_TRANSFER, player_id2, now) + (marbles,))
+        sender = cur.fetchall()
+        if not sender:
+            logger.debug('player(%s) does not have %s marbles', player_id1, marbles)
+            # Nothing was written, just close the transaction the update opened
+            commit(connection)
+            return None
+
+        cur.execute(f"{LEDGER_INSERT} RETURNING balance",
+                    ledger_params(player_id2, marbles, LEDGER_TRANSFER, player_id1, now))
+        recipient = cur.fetchall()
+        if not recipient:
+            logger.error('player(%s) does not exist', player_id2)
+            rollback(connection)
+            return None
+
+        commit(connection)
+
+        logger.debug('balances: %s, %s', sender[0][0], recipient[0][0])
+        return sender[0][0], recipient[0][0]
+    except Error as e:
+        logger.error('There was an error transferring marbles: %s', e)
+        rollback(connection)
+        return None
 
 
-def transfer_marbles(connection: sqlite3.Connection, player_id1: int, player_id2: int, marbles: int) -> bool:
+def settle_bets(connection: sqlite3.Connection, match_id: int, ledger_entries: list, bet_history: list) -> bool:
+
+    logger.debug('settle_bets: %s, %s, %s', match_id, ledger_entries, bet_history)
+
+    try:
+        cur = connection.cursor()
+        _apply_bet_settlement(cur, match_id, ledger_entries, bet_history)
+        commit(connection)
 
-    logger.debug(f'transfer_marbles: {player_id1}, {player_id2}, {marbles}')
-    player_marbles1 = get_marble_count(connection, player_id1)
+        logger.debug('bets settled')
+        notify_users_changed(*[entry[-1] for entry in ledger_entries])
 
-    if player_marbles1 < marbles:
+        return True
+    except Error as e:
+        logger.error('There was an error settling bets: %s', e)
+        rollback(connection)
         return False
 
-    if subtract_marbles(connection, player_id1, marbles) and add_marbles(connection, player_id2, marbles):
+
+def settle_match(connection: sqlite3.Connection, match_history: list, winner_id: int, loser_id: int,
+                 ledger_entries: list, bet_history: list) -> bool:
+    """Moves a match and its bets into history, and applies all stat and marble changes in one transaction
+
+    **Arguments**
+
+    - `<connection>` sqlite3 connection to write to database.
+    - `<match_history>` Row for matches_history (id, amount, participant1, participant2, winner_id, time, game, format)
+    - `<winner_id>` Player id to add a win to
+    - `<loser_id>` Player id to add a lose to
+    - `<ledger_entries>` List of ledger_params of every payout
+    - `<bet_history>` List of rows for bets_history
+
+    """
+    logger.debug('settle_match: %s, %s, %s, %s, %s', match_history, winner_id, loser_id, ledger_entries, bet_history)
+
+    try:
+        cur = connection.cursor()
+        cur.execute("INSERT INTO matches_history VALUES (?, ?, ?, ?, ?, ?, ?, ?)", match_history)
+        cur.execute("UPDATE users SET wins = wins + 1 WHERE id = ?", [winner_id])
+        cur.execute("UPDATE users SET loses = loses + 1 WHERE id = ?", [loser_id])
+        _apply_bet_settlement(cur, match_history[0], ledger_entries, bet_history)
+        cur.execute("DELETE FROM matches WHERE id=?", [match_history[0]])
+        commit(connection)
+
+        logger.debug('match settled')
+        notify_users_changed(winner_id, loser_id, *[entry[-1] for entry in ledger_entries])
+
         return True
-    return False
+    except Error as e:
+        logger.error('There was an error settling match: %s', e)
+        rollback(connection)
+        return False
+
+
+def _apply_bet_settlement(cur: sqlite3.Cursor, match_id: int, ledger_entries: list, bet_history: list):
+
+    # Rows are inserted in order, so each entry sees the balance left by the one before it
+    cur.executemany(LEDGER_INSERT, ledger_entries)
+    cur.executemany("INSERT INTO bets_history VALUES (?, ?, ?, ?, ?, ?, ?)", bet_history)
+    cur.execute("DELETE FROM bets WHERE match_id=?", [match_id])
+
+
+def verify_ledger(connection: sqlite3.Connection, server_id: int = None):
+    """Returns rows of (player_id, marbles, ledger_total) for users whose balance doesn't match their ledger
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<server_id>` Server to check, every server if None
+
+    """
+    logger.debug('verify_ledger: %s', server_id)
+
+    query = ("SELECT u.id, u.marbles, COALESCE(SUM(l.amount), 0) AS total FROM users u "
+             "LEFT JOIN marble_ledger l ON l.player_id = u.id")
+    query_param = []
+
+    if server_id is not None:
+        query += " WHERE u.server_id=?"
+        query_param.append(server_id)
+    query += " GROUP BY u.id HAVING u.marbles != total"
+
+    try:
+        cur = connection.cursor()
+        cur.execute(query, query_param)
+        results = cur.fetchall()
+
+        log_query(query, query_param)
+        logger.debug('results: %s', results)
+
+        return results
+    except Error as e:
+        logger.error('There was an error verifying marble_ledger: %s', e)
+        return 0
+
+
+def rebuild_balances(connection: sqlite3.Connection, server_id: int = None) -> int:
+    """Sets users.marbles to the sum of each player's ledger entries, returns amount of balances changed
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<server_id>` Server to rebuild, every server if None
+
+    """
+    logger.debug('rebuild_balances: %s', server_id)
+
+    query = ("UPDATE users SET marbles = "
+             "COALESCE((SELECT SUM(amount) FROM marble_ledger WHERE player_id = users.id), 0) "
+             "WHERE marbles != COALESCE((SELECT SUM(amount) FROM marble_ledger WHERE player_id = users.id), 0)")
+    query_param = []
+
+    if server_id is not None:
+        query += " AND server_id=?"
+        query_param.append(server_id)
+
+    try:
+        cur = connection.cursor()
+        cur.execute(query, query_param)
+        commit(connection)
+
+        log_query(query, query_param)
+        logger.debug('rowcount: %s', cur.rowcount)
+
+        # Any loaded Account might have a different balance now
+        notify_rollback()
+        return cur.rowcount
+    except Error as e:
+        logger.error('There was an error rebuilding balances from marble_ledger: %s', e)
+        rollback(connection)
+        return 0
+
+
+def get_ledger_version(connection: sqlite3.Connection, server_id: int) -> int:
+    """Returns id of the newest marble_ledger entry of server_id, it changes whenever a balance on server_id does"""
+    logger.debug('get_ledger_version: %s', server_id)
+
+    query = "SELECT MAX(id) FROM marble_ledger WHERE server_id=?"
+    query_param = [server_id]
+
+    try:
+        cur = connection.cursor()
+        cur.execute(query, query_param)
+        results = cur.fetchone()
+
+        log_query(query, query_param)
+        logger.debug('results: %s', results)
+
+        return results[0] or 0
+    except Error as e:
+        logger.error('There was an error selecting version from marble_ledger: %s', e)
+        return 0
+
+
+def get_server_balances(connection: sqlite3.Connection, server_id: int):
+    """Returns marbles of every user on server_id as rows of (marbles,), lowest first, straight from an index
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<server_id>` Server to get balances of
+
+    """
+    logger.debug('get_server_balances: %s', server_id)
+
+    statement = statements.SERVER_BALANCES
+    query_param = [server_id]
+
+    try:
+        cur = statement.execute(connection, query_param)
+        results = cur.fetchall()
+
+        log_query(statement.sql, query_param)
+        logger.debug('results: %s', len(results))
+
+        return results
+    except Error as e:
+        logger.error('There was an error selecting balances from users: %s', e)
+        return 0
+
+
+def get_ledger_entries(connection: sqlite3.Connection, player_id: int, start: datetime.datetime = None,
+                       end: datetime.datetime = None):
+    """Returns LedgerRows of player_id from start up to end, oldest first
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<player_id>` Id of player to get entries of
+    - `<start>` Earliest created_at included, from the first entry if None
+    - `<end>` created_at to stop before, up to now if None
+
+    """
+    logger.debug('get_ledger_entries: %s, %s, %s', player_id, start, end)
+
+    query = f"SELECT {statements.columns(statements.LEDGER_COLUMNS)} FROM marble_ledger WHERE player_id=?"
+    query_param = [player_id]
+
+    if start is not None:
+        query += " AND created_at >= ?"
+        query_param.append(start)
+    if end is not None:
+        query += " AND created_at < ?"
+        query_param.append(end)
+    query += " ORDER BY id"
+
+    try:
+        cur = statements.execute(connection, query, query_param, statements.ledger_row)
+        results = cur.fetchall()
+
+        log_query(query, query_param)
+        logger.debug('results: %s', len(results))
+
+        return results
+    except Error as e:
+        logger.error('There was an error selecting entries from marble_ledger: %s', e)
+        return 0
+
+
+def get_ledger_flow(connection: sqlite3.Connection, server_id: int, start: datetime.datetime = None,
+                    end: datetime.datetime = None, player_id: int = None):
+    """Returns rows of (reason, marbles in, marbles out, entries) of server_id from start up to end
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<server_id>` Server to get flow of
+    - `<start>` Earliest created_at included, from the first entry if None
+    - `<end>` created_at to stop before, up to now if None
+    - `<player_id>` Only count entries of this player if given
+
+    """
+    logger.debug('get_ledger_flow: %s, %s, %s, %s', server_id, start, end, player_id)
+
+    query = ("SELECT reason, SUM(MAX(amount, 0)), SUM(MIN(amount, 0)), COUNT(*) FROM marble_ledger "
+             "WHERE server_id=?")
+    query_param = [server_id]
+
+    if player_id is not None:
+        query += " AND player_id=?"
+        query_param.append(player_id)
+    if start is not None:
+        query += " AND created_at >= ?"
+        query_param.append(start)
+    if end is not None:
+        query += " AND created_at < ?"
+        query_param.append(end)
+    query += " GROUP BY reason ORDER BY reason"
+
+    try:
+        cur = connection.cursor()
+        cur.execute(query, query_param)
+        results = cur.fetchall()
+
+        log_query(query, query_param)
+        logger.debug('results: %s', results)
+
+        return results
+    except Error as e:
+        logger.error('There was an error selecting flow from marble_ledger: %s', e)
+        return 0
 
 
 def is_bet_win(connection: sqlite3.Connection, bet_id: int, winner_id: int) -> bool:
 
-    logger.debug(f'is_bet_win: {bet_id}, {winner_id}')
+    logger.debug('is_bet_win: %s, %s', bet_id, winner_id)
     bet_info = get_bet_info(connection, bet_id)
 
-    logger.debug(f'bet_info: {bet_info}')
-    if bet_info[4] == winner_id:
+    logger.debug('bet_info: %s', bet_info)
+    if bet_info.participant1 == winner_id:
         return True
     else:
         return False
@@ -1,111 +1,153 @@
 import sqlite3
 import logging
 import configparser
+import threading
 
 from sqlite3 import Error
 
+import database.statements as statements
+
 logger = logging.getLogger(f'marble_match.{__name__}')
 
+# Used for settings missing from the DATABASE section of marble_bot.ini
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': '-16000',
+    'mmap_size': '268435456',
+    'busy_timeout': '5000',
+}
+READERS = 4
+
+# Callbacks run with every connection opened, before it's used
+connection_listeners = []
+# Class of every connection opened, a subclass of sqlite3.Connection
+connection_factory = sqlite3.Connection
+
+# Prefix of the threads reading through read-only connections, see database_async.read
+READER_THREAD = 'marble_read'
+
+
+def read_config() -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config.read('marble_bot.ini')
+    return config
+
+
+def get_pragmas(config: configparser.ConfigParser) -> dict:
+    """Returns dict of pragma to value, from the DATABASE section of config or PRAGMAS"""
+    section = config['DATABASE'] if config.has_section('DATABASE') else {}
+    return {pragma: section.get(pragma, value) for pragma, value in PRAGMAS.items()}
+
+
+def get_readers(config: configparser.ConfigParser) -> int:
+    """Returns amount of read-only connections to read with, from the DATABASE section of config or READERS"""
+    if not config.has_section('DATABASE'):
+        return READERS
+    return config['DATABASE'].getint('readers', READERS)
+
+
+def create_connection(db_file, pragmas: dict = None, read_only: bool = False):
+    """Returns connection to db_file with pragmas set on it
+
+    **Arguments**
 
-def create_connection(db_file):
-    logger.debug(f'create_connection: {db_file}')
+    - `<db_file>` Path of database
+    - `<pragmas>` Dict of pragma to value, journal_mode is only set by connections that write
+    - `<read_only>` Refuses writes on the connection if True
+
+    """
+    logger.debug('create_connection: %s, %s, %s', db_file, pragmas, read_only)
     try:
-        con = sqlite3.connect(db_file, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        logger.debug(f'connection created: {con}')
+        # Connection is created here but used from the database executor thread
+        con = sqlite3.connect(db_file, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                              check_same_thread=False, cached_statements=statements.cache_size(),
+                              factory=connection_factory)
+        for pragma, value in (pragmas or {}).items():
+            if read_only and pragma == 'journal_mode':
+                continue
+            con.execute(f'PRAGMA {pragma}={value}')
+        if read_only:
+            con.execute('PRAGMA query_only=ON')
+        for listener in connection_listeners:
+            listener(con)
+        logger.debug('connection created: %s', con)
         return con
     except Error as e:
-        logger.error(f'Failed to create connection: {e}')
+        logger.error('Failed to create connection: %s', e)
         raise e
 
 
-def create_connection_wraper_hack():
-    config = configparser.ConfigParser()
-    config.read('marble_bot.ini')
-    return create_connection(config['DEFAULT']['database'])
+def database_path(connection: sqlite3.Connection) -> str:
+    """Returns file of the main database of connection"""
+    return connection.execute('PRAGMA database_list').fetchone()[2]
+
+
+class DbHandlerType(type):
+    """Gives DbHandler.db_cnc, the connection of the current thread"""
+
+    @property
+    def db_cnc(cls) -> sqlite3.Connection:
+        if cls.reading():
+            return cls.reader()
+        return cls.writer()
+
+    @db_cnc.setter
+    def db_cnc(cls, connection: sqlite3.Connection):
+        with cls._lock:
+            cls._writer = connection
+            cls._path = database_path(connection)
 
 
 # Boilerplate class to not have python yeet my global static variable
-class DbHandler:
-    db_cnc: sqlite3.Connection = create_connection_wraper_hack()
+class DbHandler(metaclass=DbHandlerType):
+    """Connections to the database, opened when first used
+
+    db_cnc is the only connection that writes, used from the database executor. On reader threads db_cnc is instead
+    a read-only connection of that thread, so reads there run alongside writes. Pragmas come from marble_bot.ini.
+
+    """
+    _writer: sqlite3.Connection = None
+    _path: str = None
+    _pragmas: dict = None
+    _lock = threading.Lock()
+    _local = threading.local()
 
     def __init__(self):
         pass
 
-
-def create_tables(connection):
-    logger.debug(f'create_tables: {connection}')
-    try:
-        cur = connection.cursor()
-        logger.debug(f'Created cursor: {cur}')
-        cur.execute("CREATE TABLE IF NOT EXISTS "
-                    "users("
-                    "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
-                    "uuid INTEGER NOT NULL, "
-                    "nickname TEXT NOT NULL UNIQUE, "
-                    "marbles INTEGER NOT NULL, "
-                    "server_id INTEGER NOT NULL, "
-                    "wins INTEGER NOT NULL, "
-                    "loses INTEGER NOT NULL)")
-
-        cur.execute("CREATE TABLE IF NOT EXISTS "
-                    "matches("
-                    "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
-                    "amount INTEGER NOT NULL, "
-                    "active INTEGER NOT NULL, "
-                    "participant1 INTEGER NOT NULL, "
-                    "participant2 INTEGER NOT NULL, "
-                    "accepted INTEGER NOT NULL, "
-                    "game TEXT DEFAULT 'melee' NOT NULL, "
-                    "format TEXT DEFAULT 'Bo3' NOT NULL, "
-                    "FOREIGN KEY(participant1) REFERENCES users(id), "
-                    "FOREIGN KEY(participant2) REFERENCES users(id))")
-
-        cur.execute("CREATE TABLE IF NOT EXISTS "
-                    "matches_history("
-                    "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
-                    "amount INTEGER NOT NULL, "
-                    "participant1 INTEGER NOT NULL, "
-                    "participant2 INTEGER NOT NULL, "
-                    "winner_id INTEGER NOT NULL, "
-                    "match_time timestamp, "
-                    "game TEXT DEFAULT 'melee' NOT NULL, "
-                    "format TEXT DEFAULT 'Bo3' NOT NULL, "
-                    "FOREIGN KEY(participant1) REFERENCES users(id), "
-                    "FOREIGN KEY(participant2) REFERENCES users(id), "
-                    "FOREIGN KEY(winner_id) REFERENCES users(id))")
-
-        cur.execute("CREATE TABLE IF NOT EXISTS "
-                    "bets("
-                    "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
-                    "amount INTEGER NOT NULL, "
-                    "match_id INTEGER NOT NULL, "
-                    "better_id INTEGER NOT NULL, "
-                    "participant1 INTEGER NOT NULL, "
-                    "FOREIGN KEY(match_id) REFERENCES matches(id), "
-                    "FOREIGN KEY(better_id) REFERENCES users(id), "
-                    "FOREIGN KEY(participant1) REFERENCES users(id))")
-
-        cur.execute("CREATE TABLE IF NOT EXISTS "
-                    "bets_history("
-                    "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
-                    "amount INTEGER NOT NULL, "
-                    "match_id INTEGER NOT NULL, "
-                    "better_id INTEGER NOT NULL, "
-                    "participant1 INTEGER NOT NULL, "
-                    "winner_id INTEGER NOT NULL, "
-                    "bet_time timestamp, "
-                    "FOREIGN KEY(match_id) REFERENCES matches_history(id), "
-                    "FOREIGN KEY(better_id) REFERENCES users(id), "
-                    "FOREIGN KEY(participant1) REFERENCES users(id), "
-                    "FOREIGN KEY(winner_id) REFERENCES users(id))")
-
-        cur.execute("CREATE TABLE IF NOT EXISTS "
-                    "friendly("
-                    "id INTEGER PRIMARY KEY NOT NULL, "
-                    "last_used timestamp, "
-                    "FOREIGN KEY(id) REFERENCES users(id))")
-
-        connection.commit()
-    except Error as e:
-        logger.error(f'Failed to create tables: {e}')
-        raise e
+    @classmethod
+    def pragmas(cls) -> dict:
+        if cls._pragmas is None:
+            cls._pragmas = get_pragmas(read_config())
+        return cls._pragmas
+
+    @classmethod
+    def writer(cls) -> sqlite3.Connection:
+        with cls._lock:
+            if cls._writer is None:
+                cls._path = read_config()['DEFAULT']['database']
+                cls._writer = create_connection(cls._path, cls.pragmas())
+            return cls._writer
+
+    @classmethod
+    def reader(cls) -> sqlite3.Connection:
+        """Returns read-only connection of the current thread, opened on the database the writer uses"""
+        writer = cls.writer()
+        path = cls._path
+        # An in-memory database can't be opened again
+        if not path:
+            return writer
+
+        local = cls._local
+        if getattr(local, 'path', None) != path:
+            if getattr(local, 'connection', None) is not None:
+                local.connection.close()
+            local.connection = create_connection(path, cls.pragmas(), read_only=True)
+            local.path = path
+        return local.connection
+
+    @staticmethod
+    def reading() -> bool:
+        """Returns True on reader threads"""
+        return threading.current_thread().name.startswith(READER_THREAD)
@@ -0,0 +1,228 @@
+import logging
+import sqlite3
+
+from sqlite3 import Error
+
+logger = logging.getLogger(f'marble_match.{__name__}')
+
+
+def _create_tables(cur: sqlite3.Cursor):
+    """Initial schema, uses IF NOT EXISTS so databases created before migrations existed are adopted"""
+    cur.execute("CREATE TABLE IF NOT EXISTS "
+                "users("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                "uuid INTEGER NOT NULL, "
+                "nickname TEXT NOT NULL UNIQUE, "
+                "marbles INTEGER NOT NULL, "
+                "server_id INTEGER NOT NULL, "
+                "wins INTEGER NOT NULL, "
+                "loses INTEGER NOT NULL)")
+
+    cur.execute("CREATE TABLE IF NOT EXISTS "
+                "matches("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                "amount INTEGER NOT NULL, "
+                "active INTEGER NOT NULL, "
+                "participant1 INTEGER NOT NULL, "
+                "participant2 INTEGER NOT NULL, "
+                "accepted INTEGER NOT NULL, "
+                "game TEXT DEFAULT 'melee' NOT NULL, "
+                "format TEXT DEFAULT 'Bo3' NOT NULL, "
+                "FOREIGN KEY(participant1) REFERENCES users(id), "
+                "FOREIGN KEY(participant2) REFERENCES users(id))")
+
+    cur.execute("CREATE TABLE IF NOT EXISTS "
+                "matches_history("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                "amount INTEGER NOT NULL, "
+                "participant1 INTEGER NOT NULL, "
+                "participant2 INTEGER NOT NULL, "
+                "winner_id INTEGER NOT NULL, "
+                "match_time timestamp, "
+                "game TEXT DEFAULT 'melee' NOT NULL, "
+                "format TEXT DEFAULT 'Bo3' NOT NULL, "
+                "FOREIGN KEY(participant1) REFERENCES users(id), "
+                "FOREIGN KEY(participant2) REFERENCES users(id), "
+                "FOREIGN KEY(winner_id) REFERENCES users(id))")
+
+    cur.execute("CREATE TABLE IF NOT EXISTS "
+                "bets("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                "amount INTEGER NOT NULL, "
+                "match_id INTEGER NOT NULL, "
+                "better_id INTEGER NOT NULL, "
+                "participant1 INTEGER NOT NULL, "
+                "FOREIGN KEY(match_id) REFERENCES matches(id), "
+                "FOREIGN KEY(better_id) REFERENCES users(id), "
+                "FOREIGN KEY(participant1) REFERENCES users(id))")
+
+    cur.execute("CREATE TABLE IF NOT EXISTS "
+                "bets_history("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                "amount INTEGER NOT NULL, "
+                "match_id INTEGER NOT NULL, "
+                "better_id INTEGER NOT NULL, "
+                "participant1 INTEGER NOT NULL, "
+                "winner_id INTEGER NOT NULL, "
+                "bet_time timestamp, "
+                "FOREIGN KEY(match_id) REFERENCES matches_history(id), "
+                "FOREIGN KEY(better_id) REFERENCES users(id), "
+                "FOREIGN KEY(participant1) REFERENCES users(id), "
+                "FOREIGN KEY(winner_id) REFERENCES users(id))")
+
+    cur.execute("CREATE TABLE IF NOT EXISTS "
+                "friendly("
+                "id INTEGER PRIMARY KEY NOT NULL, "
+                "last_used timestamp, "
+                "FOREIGN KEY(id) REFERENCES users(id))")
+
+
+def _lookup_indexes(cur: sqlite3.Cursor):
+    """Indexes for the columns every getter filters on, ids are the rowid so they're in every index already"""
+    # get_player_id, get_account
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_uuid_server ON users(uuid, server_id)")
+    # get_player_info_all_by_server
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_server ON users(server_id)")
+    # find_match_by_player_id, get_match_info_all, participant1 OR participant2 uses both
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_matches_participant1 ON matches(participant1)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_matches_participant2 ON matches(participant2)")
+    # get_match_history_info_all, get_match_history_joined
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_matches_history_participant1 ON matches_history(participant1)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_matches_history_participant2 ON matches_history(participant2)")
+    # get_bet_info_match_all, find_bet
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bets_match_better ON bets(match_id, better_id)")
+    # get_bet_info_all, get_bet_info_joined
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bets_better ON bets(better_id, participant1)")
+    # get_bet_history_info_all, get_bet_history_joined with or without bet_target
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bets_history_better ON bets_history(better_id, participant1)")
+
+
+def _history_paging_indexes(cur: sqlite3.Cursor):
+    """Index with only better_id, so bet history pages are read in id order without sorting all of a player's bets"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bets_history_better_id ON bets_history(better_id)")
+
+
+def _leaderboard_indexes(cur: sqlite3.Cursor):
+    """Indexes ordered by every leaderboard stat, winrate uses the same expression as statements.LEADERBOARD_STATS"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_server_wins ON users(server_id, wins)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_server_loses ON users(server_id, loses)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_server_marbles ON users(server_id, marbles)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_server_winrate ON users(server_id, "
+                "(CASE WHEN wins > 0 THEN 100 * (CAST(wins AS REAL) / (wins + loses)) ELSE 0 END))")
+
+
+def _marble_ledger(cur: sqlite3.Cursor):
+    """Append-only record of every balance change, users.marbles is kept as the balance after the latest entry"""
+    cur.execute("CREATE TABLE IF NOT EXISTS "
+                "marble_ledger("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                "player_id INTEGER NOT NULL, "
+                "server_id INTEGER NOT NULL, "
+                "amount INTEGER NOT NULL, "
+                "balance INTEGER NOT NULL, "
+                "reason TEXT NOT NULL, "
+                "reference_id INTEGER, "
+                "created_at timestamp NOT NULL, "
+                "FOREIGN KEY(player_id) REFERENCES users(id))")
+    # Per player and per server time ranges
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_marble_ledger_player_time ON marble_ledger(player_id, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_marble_ledger_server_time ON marble_ledger(server_id, created_at)")
+
+    # Balances are only written through the ledger
+    cur.execute("CREATE TRIGGER IF NOT EXISTS ledger_balance AFTER INSERT ON marble_ledger "
+                "BEGIN UPDATE users SET marbles = NEW.balance WHERE id = NEW.player_id; END")
+
+    # Existing balances become the opening entry of every player
+    cur.execute("INSERT INTO marble_ledger(player_id, server_id, amount, balance, reason, reference_id, created_at) "
+                "SELECT id, server_id, marbles, marbles, 'opening', NULL, CURRENT_TIMESTAMP FROM users")
+
+
+def _ledger_version_index(cur: sqlite3.Cursor):
+    """Index with only server_id, so the newest ledger id of a server is a single seek"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_marble_ledger_server ON marble_ledger(server_id)")
+
+
+def _nickname_index(cur: sqlite3.Cursor):
+    """Index of nicknames by server, so a server's nicknames are read without touching the table"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_server_nickname ON users(server_id, nickname)")
+
+
+def _leaderboard_rank_indexes(cur: sqlite3.Cursor):
+    """Drops idx_users_server, every (server_id, ...) index serves its lookups, and adds wins and loses to the winrate
+    index so rank counts are read from the index alone"""
+    cur.execute("DROP INDEX IF EXISTS idx_users_server")
+    cur.execute("DROP INDEX IF EXISTS idx_users_server_winrate")
+    # id is listed so ties stay in id order, it's the rowid the other indexes end with
+    cur.execute("CREATE INDEX idx_users_server_winrate ON users(server_id, "
+                "(CASE WHEN wins > 0 THEN 100 * (CAST(wins AS REAL) / (wins + loses)) ELSE 0 END), id, wins, loses)")
+
+
+# Ordered list of (version, description, function), only ever append to this list
+MIGRATIONS = [
+    (1, 'create tables', _create_tables),
+    (2, 'lookup indexes', _lookup_indexes),
+    (3, 'history paging indexes', _history_paging_indexes),
+    (4, 'leaderboard indexes', _leaderboard_indexes),
+    (5, 'marble ledger', _marble_ledger),
+    (6, 'ledger version index', _ledger_version_index),
+    (7, 'nickname index', _nickname_index),
+    (8, 'leaderboard rank indexes', _leaderboard_rank_indexes),
+]
+
+
+def get_version(connection: sqlite3.Connection) -> int:
+    """Returns current schema version of database, 0 if no migration has been applied
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+
+    """
+    cur = connection.cursor()
+    cur.execute("CREATE TABLE IF NOT EXISTS "
+                "schema_version("
+                "version INTEGER PRIMARY KEY NOT NULL, "
+                "description TEXT NOT NULL, "
+                "applied_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP)")
+    cur.execute("SELECT MAX(version) FROM schema_version")
+    version = cur.fetchone()[0]
+    return version if version is not None else 0
+
+
+def migrate(connection: sqlite3.Connection, target: int = None) -> int:
+    """Applies every migration newer than the database's schema version in order, returns new version
+
+    Each migration runs in its own transaction together with its schema_version row, so a failed step leaves
+    the database at the previous version.
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<target>` Version to migrate up to, latest if None
+
+    """
+    logger.debug('migrate: %s, %s', connection, target)
+
+    version = get_version(connection)
+    logger.debug('schema version: %s', version)
+
+    for step, description, function in MIGRATIONS:
+        if step <= version or (target is not None and step > target):
+            continue
+
+        logger.debug('Applying migration %s: %s', step, description)
+        try:
+            cur = connection.cursor()
+            # DDL doesn't open a transaction implicitly, so open one to keep the step atomic
+            cur.execute("BEGIN")
+            function(cur)
+            cur.execute("INSERT INTO schema_version(version, description) VALUES (?, ?)", [step, description])
+            connection.commit()
+        except Error as e:
+            logger.error('Failed to apply migration %s: %s', step, e)
+            connection.rollback()
+            raise e
+
+        version = step
+
+    return version
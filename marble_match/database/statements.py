@@ -0,0 +1,185 @@
+import sqlite3
+from collections import namedtuple
+from typing import Callable, Dict, Optional
+
+# Columns of every table, in table order. Statements select them by name so rows don't change if tables do
+USER_COLUMNS = ['id', 'uuid', 'nickname', 'marbles', 'server_id', 'wins', 'loses']
+MATCH_COLUMNS = ['id', 'amount', 'active', 'participant1', 'participant2', 'accepted', 'game', 'format']
+MATCH_HISTORY_COLUMNS = ['id', 'amount', 'participant1', 'participant2', 'winner_id', 'match_time', 'game', 'format']
+BET_COLUMNS = ['id', 'amount', 'match_id', 'better_id', 'participant1']
+BET_HISTORY_COLUMNS = ['id', 'amount', 'match_id', 'better_id', 'participant1', 'winner_id', 'bet_time']
+LEDGER_COLUMNS = ['id', 'player_id', 'server_id', 'amount', 'balance', 'reason', 'reference_id', 'created_at']
+
+UserRow = namedtuple('UserRow', USER_COLUMNS)
+MatchRow = namedtuple('MatchRow', MATCH_COLUMNS)
+MatchHistoryRow = namedtuple('MatchHistoryRow', MATCH_HISTORY_COLUMNS)
+BetRow = namedtuple('BetRow', BET_COLUMNS)
+BetHistoryRow = namedtuple('BetHistoryRow', BET_HISTORY_COLUMNS)
+LedgerRow = namedtuple('LedgerRow', LEDGER_COLUMNS)
+
+# Rows of joined queries, the users of a row are UserRows
+MatchJoinedRow = namedtuple('MatchJoinedRow', ['id', 'amount', 'active', 'accepted', 'game', 'format',
+                                               'challenger', 'recipient'])
+MatchHistoryJoinedRow = namedtuple('MatchHistoryJoinedRow', ['id', 'amount', 'match_time', 'game', 'format',
+                                                             'challenger', 'recipient', 'winner'])
+BetJoinedRow = namedtuple('BetJoinedRow', ['id', 'amount', 'match_id', 'match_amount', 'active', 'accepted', 'game',
+                                           'format', 'bettor', 'bet_target', 'challenger', 'recipient'])
+BetHistoryJoinedRow = namedtuple('BetHistoryJoinedRow', ['id', 'amount', 'bet_time', 'match_id', 'match_amount',
+                                                         'match_time', 'game', 'format', 'bettor', 'bet_target',
+                                                         'winner', 'challenger', 'recipient', 'match_winner'])
+
+RowFactory = Callable[[sqlite3.Cursor, tuple], tuple]
+
+# Builds a namedtuple from a row without the argument handling of its __new__
+_new = tuple.__new__
+
+
+def row_factory(row_type) -> RowFactory:
+    """Returns cursor row factory building row_type from every row"""
+    def factory(cursor: sqlite3.Cursor, row: tuple):
+        return _new(row_type, row)
+    return factory
+
+
+def scalar_factory(cursor: sqlite3.Cursor, row: tuple):
+    """Row factory for statements selecting a single column, returns the value itself"""
+    return row[0]
+
+
+def joined_factory(row_type, users: int) -> RowFactory:
+    """Returns cursor row factory for a joined query, the last users fields of row_type are users blocks
+
+    Each of the last users fields is filled with a UserRow made from the next USER_COLUMNS columns of the row.
+
+    """
+    width = len(USER_COLUMNS)
+    head = len(row_type._fields) - users
+    bounds = [(head + width * i, head + width * (i + 1)) for i in range(users)]
+
+    def factory(cursor: sqlite3.Cursor, row: tuple):
+        return _new(row_type, row[:head] + tuple([_new(UserRow, row[start:end]) for start, end in bounds]))
+    return factory
+
+
+def columns(names: list, alias: str = None) -> str:
+    """Returns names as a select list, prefixed with alias if given"""
+    if alias is None:
+        return ', '.join(names)
+    return ', '.join(f'{alias}.{name}' for name in names)
+
+
+def execute(connection: sqlite3.Connection, query: str, query_param: list,
+            factory: Optional[RowFactory] = None) -> sqlite3.Cursor:
+    """Returns cursor of query executed on connection, fetching rows through factory
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<query>` SQL to execute, the same text each time so connection reuses its prepared statement
+    - `<query_param>` Parameters of query
+    - `<factory>` Row factory, plain tuples if None
+
+    """
+    cur = connection.cursor()
+    if factory is not None:
+        cur.row_factory = factory
+    cur.execute(query, query_param)
+    return cur
+
+
+class Statement:
+    """Named SQL with explicit columns and the factory its rows are read with"""
+    __slots__ = ('name', 'sql', 'factory')
+
+    def __init__(self, name: str, sql: str, factory: Optional[RowFactory] = None):
+        self.name = name
+        self.sql = sql
+        self.factory = factory
+
+    def execute(self, connection: sqlite3.Connection, query_param: list) -> sqlite3.Cursor:
+        return execute(connection, self.sql, query_param, self.factory)
+
+
+# Every fixed statement by name
+registry: Dict[str, Statement] = {}
+
+
+def statement(name: str, sql: str, factory: Optional[RowFactory] = None) -> Statement:
+    registry[name] = Statement(name, sql, factory)
+    return registry[name]
+
+
+def cache_size() -> int:
+    """Returns amount of prepared statements connections keep, room for the registry and the ones built per call"""
+    return max(128, len(registry) * 2)
+
+
+user_row = row_factory(UserRow)
+match_row = row_factory(MatchRow)
+match_history_row = row_factory(MatchHistoryRow)
+bet_row = row_factory(BetRow)
+bet_history_row = row_factory(BetHistoryRow)
+ledger_row = row_factory(LedgerRow)
+
+match_joined_row = joined_factory(MatchJoinedRow, 2)
+match_history_joined_row = joined_factory(MatchHistoryJoinedRow, 3)
+bet_joined_row = joined_factory(BetJoinedRow, 4)
+bet_history_joined_row = joined_factory(BetHistoryJoinedRow, 6)
+
+FRIENDLY_LAST_USED = statement('friendly_last_used', "SELECT last_used FROM friendly WHERE id=?", scalar_factory)
+
+MATCH_INFO = statement('match_info', f"SELECT {columns(MATCH_COLUMNS)} FROM matches WHERE id=?", match_row)
+MATCH_INFO_ALL = statement('match_info_all', f"SELECT {columns(MATCH_COLUMNS)} FROM matches "
+                                             f"WHERE participant1=? OR participant2=?", match_row)
+MATCH_ID_BY_PLAYER = statement('match_id_by_player', "SELECT id FROM matches WHERE participant1=? OR participant2=? "
+                                                     "LIMIT 1", scalar_factory)
+MATCH_HISTORY_INFO = statement('match_history_info', f"SELECT {columns(MATCH_HISTORY_COLUMNS)} FROM matches_history "
+                                                     f"WHERE id=?", match_history_row)
+MATCH_HISTORY_INFO_ALL = statement('match_history_info_all', f"SELECT {columns(MATCH_HISTORY_COLUMNS)} "
+                                                             f"FROM matches_history "
+                                                             f"WHERE participant1=? OR participant2=?",
+                                   match_history_row)
+
+PLAYER_ID = statement('player_id', "SELECT id FROM users WHERE uuid=? AND server_id=?", scalar_factory)
+PLAYER_ID_BY_NICKNAME = statement('player_id_by_nickname', "SELECT id FROM users WHERE nickname=?", scalar_factory)
+PLAYER_INFO = statement('player_info', f"SELECT {columns(USER_COLUMNS)} FROM users WHERE id=?", user_row)
+PLAYER_INFO_BY_SERVER = statement('player_info_by_server', f"SELECT {columns(USER_COLUMNS)} FROM users "
+                                                           f"WHERE server_id=?", user_row)
+PLAYER_WINS = statement('player_wins', "SELECT wins FROM users WHERE id=?", scalar_factory)
+PLAYER_LOSES = statement('player_loses', "SELECT loses FROM users WHERE id=?", scalar_factory)
+MARBLE_COUNT = statement('marble_count', "SELECT marbles FROM users WHERE id=?", scalar_factory)
+SERVER_NICKNAMES = statement('server_nicknames', "SELECT id, nickname FROM users WHERE server_id=?")
+SERVER_BALANCES = statement('server_balances', "SELECT marbles FROM users WHERE server_id=? ORDER BY marbles")
+
+# Expression leaderboard stats are ordered by, winrate matches Account.winrate and idx_users_server_winrate
+LEADERBOARD_STATS = {
+    'wins': 'wins',
+    'loses': 'loses',
+    'marbles': 'marbles',
+    'winrate': 'CASE WHEN wins > 0 THEN 100 * (CAST(wins AS REAL) / (wins + loses)) ELSE 0 END',
+}
+# Top rows of a server by each stat, walks the (server_id, stat) index from the top so only limit rows are read
+LEADERBOARD = {stat: statement(f'leaderboard_{stat}', f"SELECT {columns(USER_COLUMNS)} FROM users WHERE server_id=? "
+                                                      f"ORDER BY {expression} DESC, id LIMIT ?", user_row)
+               for stat, expression in LEADERBOARD_STATS.items()}
+# Players with a higher stat, or the same stat and a lower id, are ranked above a player. Both counts are ranges of
+# the (server_id, stat) index, which holds every column they read, so no table row is visited
+LEADERBOARD_RANK = {stat: statement(f'leaderboard_rank_{stat}',
+                                    f"WITH player AS (SELECT {expression} AS stat, id FROM users "
+                                    f"WHERE id=? AND server_id=?) "
+                                    f"SELECT (SELECT COUNT(*) FROM users "
+                                    f"WHERE server_id=? AND {expression} > player.stat) + "
+                                    f"(SELECT COUNT(*) FROM users "
+                                    f"WHERE server_id=? AND {expression} = player.stat AND id < player.id) + 1 "
+                                    f"FROM player", scalar_factory)
+                    for stat, expression in LEADERBOARD_STATS.items()}
+
+BET_INFO = statement('bet_info', f"SELECT {columns(BET_COLUMNS)} FROM bets WHERE id=?", bet_row)
+BET_INFO_ALL = statement('bet_info_all', f"SELECT {columns(BET_COLUMNS)} FROM bets WHERE better_id=?", bet_row)
+BET_INFO_MATCH_ALL = statement('bet_info_match_all', f"SELECT {columns(BET_COLUMNS)} FROM bets WHERE match_id=?",
+                               bet_row)
+BET_ID = statement('bet_id', "SELECT id FROM bets WHERE match_id=? AND better_id=?", scalar_factory)
+BET_HISTORY_INFO = statement('bet_history_info', f"SELECT {columns(BET_HISTORY_COLUMNS)} FROM bets_history "
+                                                 f"WHERE id=?", bet_history_row)
+BET_HISTORY_INFO_ALL = statement('bet_history_info_all', f"SELECT {columns(BET_HISTORY_COLUMNS)} FROM bets_history "
+                                                         f"WHERE better_id=?", bet_history_row)
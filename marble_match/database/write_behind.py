@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from collections import deque, namedtuple
+from typing import Hashable, Optional
+
+import database.database_async as database_async
+import database.database_operation as database_operation
+from database.database_setup import DbHandler
+
+logger = logging.getLogger(f'marble_match.{__name__}')
+
+# Most writes waiting to be applied, submit waits for room once there are this many
+MAX_PENDING = 1000
+# Most writes applied in one transaction
+BATCH_SIZE = 200
+# Seconds before a batch that failed is tried again, doubled after every failure
+RETRY_DELAY = 1
+# Times a failed batch is tried again, after that its writes are tried one at a time and the ones that fail dropped
+MAX_RETRIES = 5
+# Most dropped writes kept in WriteBehind.dead_letters
+MAX_DEAD_LETTERS = 1000
+# Seconds stop waits for waiting writes to be applied
+STOP_TIMEOUT = 10
+
+# A queued write, writes with the same key replace each other while they wait
+Write = namedtuple('Write', ['query', 'query_param', 'key'])
+
+
+def coalesce(batch: list) -> list:
+    """Returns (query, query_param) of batch in order, keeping only the last write of each key where it was made"""
+    last = {write.key: i for i, write in enumerate(batch) if write.key is not None}
+    return [(write.query, write.query_param) for i, write in enumerate(batch)
+            if write.key is None or last[write.key] == i]
+
+
+class WriteBehind:
+    """Writes that commands don't wait on, applied in the order submitted by a background task
+
+    Each batch of waiting writes is applied in one transaction on the database executor, so a later write is never
+    stored without the ones submitted before it. A batch that fails is tried again MAX_RETRIES times, then each of
+    its writes on its own. A write that still fails is logged and kept in dead_letters, so one bad write doesn't hold
+    up every write behind it. Only writes nothing else depends on belong here, anything a command checks or that
+    moves marbles is written in the command's unit of work.
+
+    """
+
+    def __init__(self, maxsize: int = MAX_PENDING, batch_size: int = BATCH_SIZE):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.dead_letters = deque(maxlen=MAX_DEAD_LETTERS)
+        self._task: Optional[asyncio.Task] = None
+        # Writes of the batch being applied
+        self._applying: list = []
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Starts the background writer on the running event loop"""
+        if self.running:
+            return
+        self.queue = asyncio.Queue(self.maxsize)
+        self._task = asyncio.ensure_future(self._drain())
+        logger.debug('write_behind started')
+
+    async def stop(self, timeout: float = STOP_TIMEOUT):
+        """Applies every waiting write, then stops the background writer
+
+        Writes that aren't applied within timeout seconds are dead-lettered.
+
+        **Arguments**
+
+        - `<timeout>` Seconds to wait for waiting writes
+
+        """
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.error('write_behind stopping with %s writes not applied',
+                         len(self._applying) + self.queue.qsize())
+            for write in self._applying:
+                self._dead_letter(write)
+            while not self.queue.empty():
+                write = self.queue.get_nowait()
+                self._dead_letter((write.query, write.query_param))
+                self.queue.task_done()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        logger.debug('write_behind stopped')
+
+    async def submit(self, query: str, query_param, key: Hashable = None):
+        """Queues a write, waiting for room while MAX_PENDING writes are queued already
+
+        Applied directly, without trying again, if the background writer isn't running.
+
+        **Arguments**
+
+        - `<query>` SQL of the write
+        - `<query_param>` Parameters of query
+        - `<key>` Identifies what the write sets, an earlier waiting write with the same key is dropped
+
+        """
+        if not self.running:
+            await self._apply([(query, query_param)], retries=0)
+            return
+        await self.queue.put(Write(query, query_param, key))
+
+    async def flush(self):
+        """Waits until every write submitted so far is applied, for reads that have to see them"""
+        if self.running:
+            await self.queue.join()
+
+    async def _drain(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            self._applying = coalesce(batch)
+            await self._apply(self._applying)
+            self._applying = []
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _apply(self, writes: list, retries: int = MAX_RETRIES):
+        """Applies writes in one transaction, trying again retries times with a growing delay
+
+        If it still fails, every write is applied on its own and the ones that fail are dead-lettered.
+
+        """
+        delay = RETRY_DELAY
+        for attempt in range(retries + 1):
+            if await self._write(writes):
+                return
+            if attempt < retries:
+                logger.error('Unable to apply %s writes, trying again in %ss', len(writes), delay)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+        # A batch that keeps failing is usually one bad write, apply the others without it
+        for write in writes:
+            if len(writes) == 1 or not await self._write([write]):
+                self._dead_letter(write)
+
+    @staticmethod
+    async def _write(writes: list) -> bool:
+        try:
+            return await database_async.run(database_operation.write_batch, DbHandler.db_cnc, writes)
+        except Exception as e:
+            logger.error('Unable to apply writes: %s', e)
+            return False
+
+    def _dead_letter(self, write: tuple):
+        query, query_param = write
+        logger.error('Dropped write: %s %s', query, query_param)
+        self.dead_letters.append(write)
+
+
+writer = WriteBehind()
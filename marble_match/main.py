@@ -1,37 +1,57 @@
 import configparser
-import logging.config
+import logging
 import os
-import sys
 
 import discord
 import database.database_setup as db
+import database.migrations as migrations
+import database.write_behind as write_behind
+import utils.log_config as log_config
+import utils.metrics as metrics
 
 from discord.ext import commands
 
 
+config = configparser.ConfigParser()
+config.read('marble_bot.ini')
+
 logger = logging.getLogger('marble_match')
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler('log.log')
-stream_handler = logging.StreamHandler(sys.stdout)
-stream_handler.setLevel(logging.ERROR)
-logger.addHandler(stream_handler)
-formatter = logging.Formatter('%(asctime)s : %(module)s : %(levelname)s : %(message)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+log_config.configure(config)
+metrics.configure(config)
 
 logger.error('Ran')
 
-config = configparser.ConfigParser()
-config.read('marble_bot.ini')
-
 extensions_list = config['DEFAULT']['cogs'].split(',')
 
 token = config['DEFAULT']['discord_token']
 
-db.create_tables(db.DbHandler.db_cnc)
+migrations.migrate(db.DbHandler.db_cnc)
+
+
+class MarbleBot(commands.Bot):
+    """Bot that runs the write-behind writer while it's connected, applying waiting writes before it closes
+
+    Every command is metered, the metrics file is written while the bot is connected.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        metrics.install(self)
+
+    async def start(self, *args, **kwargs):
+        write_behind.writer.start()
+        metrics.start()
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        await write_behind.writer.stop()
+        metrics.stop()
+        await super().close()
+
 
 intents = discord.Intents.all()
-bot = commands.Bot(command_prefix='$', intents=intents, description='Manages Marble Matches')
+bot = MarbleBot(command_prefix='$', intents=intents, description='Manages Marble Matches')
 
 for extension in extensions_list:
     try:
@@ -1,6 +1,8 @@
 import sqlite3
 import logging
-from typing import Union
+import threading
+from collections import OrderedDict
+from typing import Union, Optional
 from dataclasses import dataclass
 from datetime import datetime
 
@@ -11,10 +13,14 @@ import database.database_operation as database_operation
 import database.database_setup as database_setup
 import utils.discord_utils as du
 import utils.exception as exception
+import utils.nicknames as nicknames
+import utils.relations as relations
+from utils.slots import slotted
 
 logger = logging.getLogger('marble_match.acc')
 
 
+@slotted
 @dataclass(order=True)
 class Account:
     id: int
@@ -34,44 +40,43 @@ class Account:
 
     @property
     def friendly_last_used(self) -> Union[datetime, int]:
-        logger.debug(f'friendly_last_used_getter')
+        logger.debug('friendly_last_used_getter')
 
         # Try and get value from database
         try:
             time = database_operation.get_friendly_last_used(database_setup.DbHandler.db_cnc, self.id)
             if not time:
-                logger.debug(f'No last_used value')
+                logger.debug('No last_used value')
                 database_operation.create_friendly(database_setup.DbHandler.db_cnc, self.id)
                 return 0
             else:
                 return time
         except Exception as e:
-            logger.error(f'Unable to read friendly_last_used: {e}')
+            logger.error('Unable to read friendly_last_used: %s', e)
             raise exception.UnableToRead(class_='Account', attribute='friendly_last_used')
 
     @friendly_last_used.setter
     def friendly_last_used(self, time: datetime):
-        logger.debug(f'friendly_last_used_setter: {time}')
-        # Try and write to database
-        try:
-            database_operation.update_friendly(database_setup.DbHandler.db_cnc, self.id, time)
-            logger.debug(f'Wrote friendly_last_used: {time}')
-        except Exception as e:
-            logger.error(f'Unable to write friendly_last_used: {e}')
-            raise exception.UnableToWrite(class_='Account', attribute='friendly_last_used')
+        logger.debug('friendly_last_used_setter: %s', time)
+        # Write to database, check if write was successful
+        if database_operation.set_friendly_last_used(database_setup.DbHandler.db_cnc, self.id, time):
+            logger.debug('Wrote friendly_last_used: %s', time)
+        else:
+            logger.error('Unable to write friendly_last_used')
+            raise exception.UnableToWrite(class_='Account', attribute='friendly_last_used', value=time)
 
     @property
     def nickname(self) -> str:
         # Check if nickname equals member, if it does return member.display_name
         if self._nickname == str(self.member):
-            logger.debug(f'nickname is same as member')
+            logger.debug('nickname is same as member')
             return self.member.display_name
         else:
             return self._nickname
 
     @nickname.setter
     def nickname(self, nickname: str):
-        logger.debug(f'nickname_setter: {nickname}')
+        logger.debug('nickname_setter: %s', nickname)
 
         # Update nickname in database, check if write was successful then update Account info
         if database_operation.update_player_nickname(database_setup.DbHandler.db_cnc, self.id, nickname):
@@ -79,6 +84,7 @@ class Account:
             logger.debug('Updated nickname')
         else:
             logger.error('Unable to update nickname')
+            cache.invalidate(self.id)
             raise exception.UnableToWrite(class_='Account', attribute='nickname', value=nickname)
 
     @property
@@ -87,7 +93,7 @@ class Account:
 
     @marbles.setter
     def marbles(self, amount: int):
-        logger.debug(f'marbles_setter: {amount}')
+        logger.debug('marbles_setter: %s', amount)
         # Check if amount is negative, set to zero if it's negative
         if amount < 0:
             logger.debug('amount was less than zero')
@@ -99,15 +105,130 @@ class Account:
             logger.debug('Updated marbles')
         else:
             logger.error('Unable to update marbles')
+            cache.invalidate(self.id)
+            raise exception.UnableToWrite(class_='Account', attribute='marbles', value=amount)
+
+    def add_marbles(self, amount: int, reason: str, reference_id: int = None) -> int:
+        """Adds amount to marbles in the database without reading it first, returns new balance
+
+        **Arguments**
+
+        - `<amount>` Amount to add, negative to subtract, balance doesn't go below zero
+        - `<reason>` One of the database_operation.LEDGER_ reasons, recorded in the ledger
+        - `<reference_id>` Id of the match or bet the change belongs to
+
+        """
+        logger.debug('add_marbles: %s, %s, %s', amount, reason, reference_id)
+
+        # Update marble count in database, check if write was successful then update Account info
+        balance = database_operation.change_marbles(database_setup.DbHandler.db_cnc, self.id, amount, reason,
+                                                    reference_id)
+        if balance is None:
+            logger.error('Unable to update marbles')
+            cache.invalidate(self.id)
+            raise exception.UnableToWrite(class_='Account', attribute='marbles', value=amount)
+
+        self._marbles = balance
+        logger.debug('Updated marbles')
+        return balance
+
+    def subtract_marbles(self, amount: int, reason: str, reference_id: int = None) -> int:
+        """Subtracts amount from marbles in the database without reading it first, returns new balance
+
+        **Arguments**
+
+        - `<amount>` Amount to subtract, balance doesn't go below zero
+        - `<reason>` One of the database_operation.LEDGER_ reasons, recorded in the ledger
+        - `<reference_id>` Id of the match or bet the change belongs to
+
+        """
+        return self.add_marbles(-amount, reason, reference_id)
+
+    def spend_marbles(self, amount: int, reason: str, reference_id: int = None) -> int:
+        """Takes amount from marbles only if Account has that many, in the same statement, returns new balance
+
+        Raises NotEnoughMarbles if Account has less than amount, which rolls back the unit of work it's called in.
+
+        **Arguments**
+
+        - `<amount>` Amount to take, negative gives marbles back
+        - `<reason>` One of the database_operation.LEDGER_ reasons, recorded in the ledger
+        - `<reference_id>` Id of the match or bet the marbles are staked on
+
+        """
+        logger.debug('spend_marbles: %s, %s, %s', amount, reason, reference_id)
+
+        balance = database_operation.spend_marbles(database_setup.DbHandler.db_cnc, self.id, amount, reason,
+                                                   reference_id)
+        if balance is None:
+            # Balance might have changed since Account was loaded, read it again next time
+            cache.invalidate(self.id)
+            marbles = database_operation.get_marble_count(database_setup.DbHandler.db_cnc, self.id)
+            if marbles < amount:
+                raise exception.NotEnoughMarbles(self.nickname, marbles, amount)
+            logger.error('Unable to spend marbles')
             raise exception.UnableToWrite(class_='Account', attribute='marbles', value=amount)
 
+        self._marbles = balance
+        logger.debug('Spent marbles')
+        return balance
+
+    def claim_friendly(self, partner: 'Account', amount: int, since: datetime) -> bool:
+        """Gives Account and partner amount marbles for a friendly, returns False if either was rewarded since
+
+        **Arguments**
+
+        - `<partner>` Account of the other player
+        - `<amount>` Marbles each player is given
+        - `<since>` Start of the period a player can be rewarded once in
+
+        """
+        logger.debug('claim_friendly: %s, %s, %s', partner, amount, since)
+
+        balances = database_operation.claim_friendly(database_setup.DbHandler.db_cnc, self.id, partner.id, amount,
+                                                     since)
+        if balances is None:
+            cache.invalidate(self.id, partner.id)
+            logger.error('Unable to claim friendly')
+            raise exception.UnableToWrite(class_='Account', attribute='marbles', value=amount)
+        if not balances:
+            return False
+
+        self._marbles, partner._marbles = balances
+        logger.debug('Claimed friendly')
+        return True
+
+    def transfer_marbles(self, target: 'Account', amount: int) -> bool:
+        """Moves amount marbles to target in one transaction, returns False if Account has less than amount
+
+        **Arguments**
+
+        - `<target>` Account receiving marbles
+        - `<amount>` Amount to transfer
+
+        """
+        logger.debug('transfer_marbles: %s, %s', target, amount)
+
+        balances = database_operation.transfer_marbles(database_setup.DbHandler.db_cnc, self.id, target.id, amount)
+        if balances is None:
+            # Balance might have changed since Account was loaded, read it again next time
+            cache.invalidate(self.id, target.id)
+            if database_operation.get_marble_count(database_setup.DbHandler.db_cnc, self.id) < amount:
+                return False
+            logger.error('Unable to transfer marbles')
+            raise exception.UnableToWrite(class_='Account', attribute='marbles', value=amount)
+
+        self._marbles, target._marbles = balances
+        logger.debug('Transferred marbles')
+        return True
+
     @property
     def wins(self) -> int:
         return self._wins
 
     @wins.setter
     def wins(self, amount: int):
-        logger.debug(f'wins_setter: {amount}')
+        logger.debug('wins_setter: %s', amount)
         # Check if amount is negative, set to zero if it's negative
         if amount < 0:
             logger.debug('amount was less than zero')
@@ -118,7 +239,8 @@ class Account:
             self._wins = amount
             logger.debug('Updated wins')
         else:
-            logger.error('Unable to update marbles')
+            logger.error('Unable to update wins')
+            cache.invalidate(self.id)
             raise exception.UnableToWrite(class_='Account', attribute='wins', value=amount)
 
     @property
@@ -127,7 +249,7 @@ class Account:
 
     @loses.setter
     def loses(self, amount: int):
-        logger.debug(f'loses_setter: {amount}')
+        logger.debug('loses_setter: %s', amount)
         # Check if amount is negative, set to zero if it's negative
         if amount < 0:
             logger.debug('amount was less than zero')
@@ -139,9 +261,84 @@ class Account:
             logger.debug('Updated loses')
         else:
             logger.error('Unable to update loses')
+            cache.invalidate(self.id)
             raise exception.UnableToWrite(class_='Account', attribute='loses', value=amount)
 
 
+class AccountCache:
+    """Identity map of loaded Accounts, keyed by player id and (uuid, server_id)
+
+    Holds at most maxsize Accounts, evicting the least recently used. Account setters write through to the
+    database and update the cached Account in place, writes made outside of them invalidate it.
+
+    """
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._accounts = OrderedDict()
+        self._keys = {}
+        self._ids = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def get(self, player_id: int) -> Optional[Account]:
+        with self._lock:
+            account = self._accounts.get(player_id)
+            if account is not None:
+                self._accounts.move_to_end(player_id)
+            return account
+
+    def get_by_uuid(self, uuid: int, server_id: int) -> Optional[Account]:
+        with self._lock:
+            player_id = self._ids.get((uuid, server_id))
+            if player_id is None:
+                return None
+            return self.get(player_id)
+
+    def uuid(self, player_id: int) -> Optional[int]:
+        with self._lock:
+            key = self._keys.get(player_id)
+            return key[0] if key else None
+
+    def add(self, account: Account, uuid: int) -> Account:
+        """Adds account to the cache, returns the Account already cached for its id if there is one"""
+        with self._lock:
+            cached = self.get(account.id)
+            if cached is not None:
+                return cached
+
+            self._accounts[account.id] = account
+            self._keys[account.id] = (uuid, account.server_id)
+            self._ids[(uuid, account.server_id)] = account.id
+
+            # Evict least recently used Accounts
+            while len(self._accounts) > self.maxsize:
+                player_id, _ = self._accounts.popitem(last=False)
+                self._ids.pop(self._keys.pop(player_id), None)
+
+            return account
+
+    def invalidate(self, *player_ids: int):
+        with self._lock:
+            for player_id in player_ids:
+                if self._accounts.pop(player_id, None) is not None:
+                    logger.debug('invalidated account: %s', player_id)
+                    self._ids.pop(self._keys.pop(player_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._accounts.clear()
+            self._keys.clear()
+            self._ids.clear()
+
+
+cache = AccountCache()
+database_operation.user_change_listeners.append(cache.invalidate)
+database_operation.rollback_listeners.append(cache.clear)
+
+
 def get_account_from_db(ctx: commands.Context, connection: sqlite3.Connection, player_id: int):
     """Returns Account of player_id
 
@@ -152,23 +349,113 @@ def get_account_from_db(ctx: commands.Context, connection: sqlite3.Connection, p
     - `<player_id>` id of players acc in database
 
     """
-    logger.debug(f'get_account_from_db: {player_id}')
+    logger.debug('get_account_from_db: %s', player_id)
+
+    # Return cached Account if loaded already
+    account = cache.get(player_id)
+    if account is not None:
+        return refresh_member(ctx, account)
 
     # get player_info from database to use to create a Account
     player_info = database_operation.get_player_info(connection, player_id)
-    logger.debug(f'player_info: {player_info}')
+    logger.debug('player_info: %s', player_info)
     # check that player_info has player information return 0 if it doesn't
     if not player_info:
         logger.error('player_info is empty')
         raise exception.UnexpectedEmpty(attribute='users')
 
     # create and place new Account into acc to return
-    account = Account(player_info[0], du.get_member_by_uuid(ctx, player_info[1]), player_info[2], player_info[3],
-                      player_info[4], player_info[5], player_info[6])
-    logger.debug(f'acc: {account}')
+    return account_from_row(ctx, player_info)
+
+
+class AccountLoader:
+    """Loads the Accounts referenced by a result set together
+
+    Accounts already in the cache are used as is, the rest are read with a single query. load_pending runs in the
+    database job that read the rows, so using an AccountRef later never waits on the database.
+
+    """
+
+    def __init__(self, ctx: commands.Context):
+        self.ctx = ctx
+        self.pending = set()
+        self.accounts = {}
+
+    def ref(self, player_id: int) -> 'AccountRef':
+        """Returns AccountRef of player_id, loaded with every other pending Account by load_pending"""
+        if player_id not in self.accounts:
+            self.pending.add(player_id)
+        return AccountRef(player_id, self)
+
+    def get(self, player_id: int) -> Account:
+        account = self.accounts.get(player_id)
+        if account is None:
+            logger.error('Unable to load account: %s', player_id)
+            raise exception.UnexpectedEmpty(attribute='users')
+        return account
+
+    def load_pending(self):
+        logger.debug('AccountLoader.load_pending: %s', self.pending)
+
+        missing = []
+        for player_id in self.pending:
+            account = cache.get(player_id)
+            if account is not None:
+                self.accounts[player_id] = refresh_member(self.ctx, account)
+            else:
+                missing.append(player_id)
+        self.pending.clear()
+
+        if not missing:
+            return
+        rows = database_operation.get_player_info_many(database_setup.DbHandler.db_cnc, missing)
+        if isinstance(rows, int):
+            raise exception.UnableToRead(attribute='users')
+        for row in rows:
+            self.accounts[row.id] = account_from_row(self.ctx, row)
+
+
+class AccountRef(relations.Reference):
+    """Account that's loaded by its AccountLoader when it's first used"""
+    __slots__ = ('loader',)
+
+    def __init__(self, id: int, loader: AccountLoader):
+        super().__init__(id)
+        self.loader = loader
+
+    def resolve(self) -> Account:
+        return self.loader.get(self.id)
+
+
+def refresh_member(ctx: commands.Context, account: Account) -> Account:
+    """Looks for the member of a cached Account again if they weren't in the guild when it was loaded"""
+    if not account.member:
+        account.member = du.get_member_by_uuid(ctx, cache.uuid(account.id))
     return account
 
 
+def account_from_row(ctx: commands.Context, player_info) -> Account:
+    """Returns Account for a row of users, using the cached Account if it's loaded already
+
+    **Arguments**
+
+    - `<ctx>` Context used to get member.
+    - `<player_info>` UserRow of player
+
+    """
+    account = cache.get(player_info.id)
+    if account is not None:
+        return refresh_member(ctx, account)
+
+    account = Account(player_info.id, du.get_member_by_uuid(ctx, player_info.uuid), player_info.nickname,
+                      player_info.marbles, player_info.server_id, player_info.wins, player_info.loses)
+    logger.debug('acc: %s', account)
+    # Rows read on reader threads may predate a write still being made, only the writer fills the cache
+    if database_setup.DbHandler.reading():
+        return account
+    return cache.add(account, player_info.uuid)
+
+
 def get_account(ctx: commands.Context, connection: sqlite3.Connection, member: Union[discord.Member, str]):
     """Returns Account of member
 
@@ -179,23 +466,26 @@ def get_account(ctx: commands.Context, connection: sqlite3.Connection, member: U
     - `<member>` member who's acc we wish to get
 
     """
-    logger.debug(f'get_account: {member}')
+    logger.debug('get_account: %s', member)
     # Check if ctx.channel is dm, return 0 if it is
     if isinstance(ctx.channel, discord.DMChannel):
         logger.error('ctx channel is dm, get_account not allowed in dms')
         raise exception.DiscordDM
 
-    # Get id from database and put into player_id
+    # Get id from database and put into player_id, members Accounts may be cached already
     if isinstance(member, discord.Member):
+        account = cache.get_by_uuid(member.id, ctx.guild.id)
+        if account is not None:
+            return account
         player_id = database_operation.get_player_id(connection, member.id, ctx.guild.id)
     else:
-        player_id = database_operation.get_player_id_by_username(connection, member)
+        player_id, suggestions = nicknames.resolve(connection, ctx.guild.id, member)
 
     # If player_id is 0, no index in database, return 0
     if not player_id:
         logger.error('player_id was not found')
         if isinstance(member, str):
-            raise exception.InvalidNickname
+            raise exception.InvalidNickname(suggestions=suggestions)
         raise exception.UnexpectedEmpty(attribute='user')
 
     # Get Account from database
@@ -204,7 +494,7 @@ def get_account(ctx: commands.Context, connection: sqlite3.Connection, member: U
     if not account:
         logger.error('Unable to create acc')
         raise exception.UnexpectedEmpty(class_='Account', attribute='account')
-    logger.debug(f'acc: {account}')
+    logger.debug('acc: %s', account)
 
     return account
 
@@ -219,11 +509,11 @@ def get_account_server_all(ctx: commands.Context, connection: sqlite3.Connection
     - `<server_id>` Server_id to get all accounts for
 
     """
-    logger.debug(f'get_account_server_all: {server_id}')
+    logger.debug('get_account_server_all: %s', server_id)
 
     # Get player_list from database and validate
     player_list = database_operation.get_player_info_all_by_server(connection, server_id)
-    logger.debug(f'player_list: {player_list}')
+    logger.debug('player_list: %s', player_list)
     if not player_list:
         logger.error('Unable to get player_list')
         raise exception.UnableToRead(attribute='user')
@@ -231,9 +521,13 @@ def get_account_server_all(ctx: commands.Context, connection: sqlite3.Connection
     # Create list to return, and propagate list with accounts from player_list
     account_list = []
     for player in player_list:
-        logger.debug(f'player: {player}')
-        account_list.append(Account(player[0], du.get_member_by_uuid(ctx, player[1]), player[2],
-                                    player[3], player[4], player[5], player[6]))
+        logger.debug('player: %s', player)
+        # Use cached Account if loaded, others aren't added to not evict the whole cache on large servers
+        account = cache.get(player.id)
+        if account is None:
+            account = Account(player.id, du.get_member_by_uuid(ctx, player.uuid), player.nickname,
+                              player.marbles, player.server_id, player.wins, player.loses)
+        account_list.append(account)
 
     # Check if list has been propagated
     if not len(account_list):
@@ -243,6 +537,30 @@ def get_account_server_all(ctx: commands.Context, connection: sqlite3.Connection
     return account_list
 
 
+def get_leaderboard(ctx: commands.Context, connection: sqlite3.Connection, server_id: int, stat: str,
+                    limit: int = 10) -> list:
+    """Returns list of top limit Accounts on a server by stat
+
+    **Arguments**
+
+    - `<ctx>` Context used to get information
+    - `<connection>` Connection for database
+    - `<server_id>` Server_id to get leaderboard for
+    - `<stat>` Stat to order by, one of statements.LEADERBOARD_STATS
+    - `<limit>` Amount of Accounts to return
+
+    """
+    logger.debug('get_leaderboard: %s, %s, %s', server_id, stat, limit)
+
+    # Get top rows from database and validate
+    player_list = database_operation.get_leaderboard(connection, server_id, stat, limit)
+    if isinstance(player_list, int):
+        logger.error('Unable to get player_list')
+        raise exception.UnableToRead(attribute='user')
+
+    return [account_from_row(ctx, player) for player in player_list]
+
+
 def get_account_by_nick(ctx: commands.Context, nickname: str):
     """Returns an account from a nickname
 
@@ -252,13 +570,17 @@ def get_account_by_nick(ctx: commands.Context, nickname: str):
     - `<nickname>` Nickname of users account to get
 
     """
-    logger.debug(f'get_account_by_nick: {nickname}')
+    logger.debug('get_account_by_nick: %s', nickname)
+
+    if isinstance(ctx.channel, discord.DMChannel):
+        logger.error('ctx channel is dm, get_account_by_nick not allowed in dms')
+        raise exception.DiscordDM
 
     # Get player_id from nickname, and validate
-    player_id = database_operation.get_player_id_by_username(database_setup.DbHandler.db_cnc, nickname)
-    logger.debug(f'player_id: {player_id}')
+    player_id, suggestions = nicknames.resolve(database_setup.DbHandler.db_cnc, ctx.guild.id, nickname)
+    logger.debug('player_id: %s', player_id)
     if not player_id:
-        logger.debug(f'Unable to get player_id for nickname')
-        raise exception.InvalidNickname
+        logger.debug('Unable to get player_id for nickname')
+        raise exception.InvalidNickname(suggestions=suggestions)
 
     return get_account_from_db(ctx, database_setup.DbHandler.db_cnc, player_id)
@@ -13,32 +13,51 @@ import utils.account as account
 import utils.exception as exception
 import utils.discord_utils as du
 import utils.matches as matches
+import utils.relations as relations
+import utils.settlement as settlement
+from utils.slots import slotted
 
 logger = logging.getLogger(f'marble_match.{__name__}')
 
 
+@slotted
 @dataclass(order=True)
 class Bet:
     id: int
     _amount: int
     match: matches.Match
-    bettor: account.Account
+    _bettor: account.Account
     _bet_target: account.Account
     _winner: account.Account = field(default=None)
     _bet_time: datetime.datetime = field(default=None)
     _is_history: bool = field(default=False)
 
+    # Accounts may be AccountRefs, resolved from the loader that read them
+    bettor = relations.Lazy('_bettor')
+
+    @property
+    def match_id(self) -> int:
+        return self.match.id
+
+    @property
+    def bettor_id(self) -> int:
+        return self._bettor.id
+
+    @property
+    def bet_target_id(self) -> int:
+        return self._bet_target.id
+
     @property
     def amount(self) -> int:
         return self._amount
 
     @amount.setter
     def amount(self, amount):
-        logger.debug(f'amount_setter" {amount}')
+        logger.debug('amount_setter" %s', amount)
 
         # Update amount in database, check if write was successful then update Bet info
         if database_operation.update_bet(DbHandler.db_cnc, self.id, self._bet_target.id, amount):
-            logger.debug(f'amount updated')
+            logger.debug('amount updated')
             self._amount = amount
         else:
             logger.error('Unable to update amount')
@@ -46,14 +65,14 @@ class Bet:
 
     @property
     def bet_target(self) -> account.Account:
-        return self._bet_target
+        return relations.resolve(self, '_bet_target')
 
     @bet_target.setter
     def bet_target(self, bet_target: account.Account):
-        logger.debug(f'bet_target: {bet_target}')
+        logger.debug('bet_target: %s', bet_target)
 
-        if database_operation.update_bet(DbHandler.db_cnc, self._amount, bet_target.id, self._amount):
-            logger.debug(f'Updated bet_target')
+        if database_operation.update_bet(DbHandler.db_cnc, self.id, bet_target.id, self._amount):
+            logger.debug('Updated bet_target')
             self._bet_target = bet_target
         else:
             logger.error('Unable to write bet_target')
@@ -61,19 +80,19 @@ class Bet:
 
     @property
     def winner(self) -> account.Account:
-        return self._winner
+        return relations.resolve(self, '_winner')
 
     @winner.setter
     def winner(self, winner: account.Account):
-        logger.debug(f'winner: {winner}')
+        logger.debug('winner: %s', winner)
 
         # Check if winner, is either match.challenger/recipient
         if winner == self.match.challenger or winner == self.match.recipient:
-            logger.debug(f'winner is equal to challenger or recipient: '
-                         f'{winner}, {self.match.challenger}, {self.match.recipient}')
+            logger.debug('winner is equal to challenger or recipient: %s, %s, %s',
+                         winner, self.match.challenger, self.match.recipient)
             self._winner = winner
         else:
-            logger.error(f'Attempted to change winner to invalid Account: {self}')
+            logger.error('Attempted to change winner to invalid Account: %s', self)
             raise exception.UnexpectedValue(class_='Bet', attribute='winner', value=winner,
                                             expected_values=[self.match.challenger, self.match.recipient])
 
@@ -83,7 +102,7 @@ class Bet:
 
     @is_history.setter
     def is_history(self, is_history: bool):
-        logger.debug(f'is_history: {is_history}')
+        logger.debug('is_history: %s', is_history)
 
         # Check if bet is already history
         if self._is_history:
@@ -99,13 +118,13 @@ class Bet:
 
     @bet_time.setter
     def bet_time(self, time: datetime.datetime):
-        logger.debug(f'bet_time: {time}')
+        logger.debug('bet_time: %s', time)
         self._bet_time = time
 
     def delete_bet(self) -> bool:
         """Deletes bet
         """
-        logger.debug(f'delete_bet: {self}')
+        logger.debug('delete_bet: %s', self)
 
         # Check if delete was successful
         if database_operation.delete_bet(DbHandler.db_cnc, self.id):
@@ -116,7 +135,7 @@ class Bet:
             raise exception.UnableToDelete(class_='Bet', attribute='bet')
 
     def is_winner(self) -> bool:
-        logger.debug(f'is_winner: {self}')
+        logger.debug('is_winner: %s', self)
 
         # Return if bet_target == winner
         return self.bet_target == self.winner
@@ -125,7 +144,7 @@ class Bet:
         """Creates a instance of bet in bet_history in database
 
         """
-        logger.debug(f'bet.create_history: {self}')
+        logger.debug('bet.create_history: %s', self)
 
         # Check if needed fields are not None
         if self._winner is None or self._bet_time is None or self._is_history is None:
@@ -134,21 +153,22 @@ class Bet:
                                           attribute='winner, bet_time, is_history')
 
         # Check if create_bet_history was successful, return true if it was
-        if database_operation.create_bet_history(DbHandler.db_cnc, self.id, self._amount, self.match.id,
-                                                 self.bettor.id, self._bet_target.id, self._winner.id, self._bet_time):
+        if database_operation.create_bet_history(DbHandler.db_cnc, self.id, self._amount, self.match_id,
+                                                 self.bettor_id, self.bet_target_id, self._winner.id, self._bet_time):
             logger.debug('Wrote bet to bet_history')
             # Delete bet from table, raise exception if unable to write
             if not database_operation.delete_bet(DbHandler.db_cnc, self.id):
-                logger.error(f'Unable to delete bet({self.id}) from bets')
+                logger.error('Unable to delete bet(%s) from bets', self.id)
                 raise exception.UnableToDelete(attribute='bets')
             return True
         else:
-            logger.error(f'Unable to write bet({self.id}) to bet_history')
+            logger.error('Unable to write bet(%s) to bet_history', self.id)
             raise exception.UnableToWrite(attribute='bet_history')
 
 
 def get_bet_all(ctx: commands.Context, user: account.Account, user2: account.Account = None,
-                history: bool = False) -> Union[list, int]:
+                history: bool = False, limit: int = None, before_id: int = None,
+                after_id: int = None) -> Union[list, int]:
     """Returns list of all Bets with user
 
     **Arguments**
@@ -157,67 +177,44 @@ def get_bet_all(ctx: commands.Context, user: account.Account, user2: account.Acc
     - `<user>` User who's bet you wish to get
     - `<user2>` User who you wanna search for as well
     - `<history>` Used to get either match history or active matches
+    - `<limit>` If set only a page of this many history bets is returned, newest page if no id is given
+    - `<before_id>` Return the page of history bets directly older than this id
+    - `<after_id>` Return the page of history bets directly newer than this id
 
     """
-    logger.debug(f'bets.get_bet_all: {user}, {user2}, {history}')
+    logger.debug('bets.get_bet_all: %s, %s, %s, %s, %s, %s', user, user2, history, limit, before_id, after_id)
 
-    # Get all bets with user.id, check if bets is valid
+    # Get all bets with user.id on user2.id, joined with their match and users rows, check if bets is valid
+    user2_id = user2.id if user2 is not None else None
     if history:
-        bets = database_operation.get_bet_history_info_all(DbHandler.db_cnc, user.id)
+        bets = database_operation.get_bet_history_joined(DbHandler.db_cnc, user.id, user2_id,
+                                                         limit, before_id, after_id)
     else:
-        bets = database_operation.get_bet_info_all(DbHandler.db_cnc, user.id)
+        bets = database_operation.get_bet_info_joined(DbHandler.db_cnc, user.id, user2_id)
     if not bets:
         logger.error('bets is zero')
         return 0
 
-    # Create bet list to return
+    # Create bets and their matches from rows, Accounts are shared between rows
     bet_list = []
-
     for bet in bets:
-        # Get bettor and check if valid
-        bettor = account.get_account_from_db(ctx, DbHandler.db_cnc, bet[3])
-        logger.debug(f'bettor: {bettor}')
-        if not bettor:
-            logger.error('Unable to get bettor account')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-        # Get bet_target and check if valid
-        bet_target = account.get_account_from_db(ctx, DbHandler.db_cnc, bet[4])
-        logger.debug(f'bet_target: {bet_target}')
-        if not bet_target:
-            logger.error('Unable to get bet_target account')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-        # Get match and check if valid
-        match = matches.get_match(ctx, bet[2], history)
-        logger.debug(f'match: {match}')
-        if not match:
-            logger.error('Unable to get match')
-            raise exception.UnableToRead(class_='Match', attribute='match')
-
-        # Create match depending on if history is true or not
-        if history:
-            logger.debug('history is true')
+        bettor = account.account_from_row(ctx, bet.bettor)
+        bet_target = account.account_from_row(ctx, bet.bet_target)
+        challenger = account.account_from_row(ctx, bet.challenger)
+        recipient = account.account_from_row(ctx, bet.recipient)
 
-            # Get winner and check if valid
-            winner = account.get_account_from_db(ctx, DbHandler.db_cnc, bet[5])
-            logger.debug(f'winner: {winner}')
-            if not winner:
-                logger.error('Unable to get winner account')
-                raise exception.UnableToRead(class_='Account', attribute='account')
-
-            append_bet = Bet(bet[0], bet[1], match, bettor, bet_target, winner, bet[6], True)
+        if history:
+            match = matches.Match(bet.match_id, bet.match_amount, True, challenger, recipient, True,
+                                  account.account_from_row(ctx, bet.match_winner), bet.match_time, bet.game,
+                                  bet.format, True)
+            append_bet = Bet(bet.id, bet.amount, match, bettor, bet_target, account.account_from_row(ctx, bet.winner),
+                             bet.bet_time, True)
         else:
-            append_bet = Bet(bet[0], bet[1], match, bettor, bet_target)
-
-        logger.debug(f'append_bet: {append_bet}')
+            match = matches.Match(bet.match_id, bet.match_amount, bet.active, challenger, recipient, bet.accepted,
+                                  _game=bet.game, _format=bet.format)
+            append_bet = Bet(bet.id, bet.amount, match, bettor, bet_target)
 
-        # Check if append_bet is filled
-        if append_bet:
-            bet_list.append(append_bet)
-
-    # Check if list has been propagated, return 0 otherwise
-    if not len(bet_list):
-        logger.debug('bet_list length is zero')
-        return 0
+        bet_list.append(append_bet)
 
     # Return bets
     return bet_list
@@ -228,11 +225,11 @@ def create_bet(ctx: commands.Context, bet_id: int, amount: int, match: matches.M
     """Creates a bet in database and returns the bet from database as a Bet
 
     """
-    logger.debug(f'bet.create_bet: {bet_id}, {amount}, {match}, {bettor}, {bet_target}')
+    logger.debug('bet.create_bet: %s, %s, %s, %s, %s', bet_id, amount, match, bettor, bet_target)
 
     # Assuming bet_id is None, refill bet_id with results of bet_create, if zero write was unsuccessful
     bet_id = database_operation.create_bet(DbHandler.db_cnc, bet_id, amount, match.id, bettor.id, bet_target.id)
-    logger.debug(f'bet_id: {bet_id}')
+    logger.debug('bet_id: %s', bet_id)
 
     # Check if bet_id is valid (Non zero)
     if not bet_id:
@@ -241,7 +238,7 @@ def create_bet(ctx: commands.Context, bet_id: int, amount: int, match: matches.M
 
     # Create bet from bet_id if bet_id is valid
     bet = get_bet(ctx, bet_id)
-    logger.debug(f'bet: {bet}')
+    logger.debug('bet: %s', bet)
     if not bet:
         logger.error('Unable to create bet')
         raise exception.UnableToRead(class_='Bet', attribute='bet')
@@ -250,7 +247,7 @@ def create_bet(ctx: commands.Context, bet_id: int, amount: int, match: matches.M
 
 
 def get_bet(ctx: commands.Context, bet_id: int, history: bool = False) -> Union[Bet, int]:
-    """Returns a Bet for Bet with bet_id
+    """Returns a Bet for Bet with bet_id, its Match and every Account are loaded together
 
     **Arguments**
     - `<ctx>` Context used to get members and other information
@@ -258,7 +255,7 @@ def get_bet(ctx: commands.Context, bet_id: int, history: bool = False) -> Union[
     - `<history>` Used to specify if you'd like to get a bet from bet_history or bets
 
     """
-    logger.debug(f'get_bet: {bet_id}, {history}')
+    logger.debug('get_bet: %s, %s', bet_id, history)
 
     # Check if ctx.channel is dm, return zero if true
     if isinstance(ctx.channel, discord.DMChannel):
@@ -273,156 +270,60 @@ def get_bet(ctx: commands.Context, bet_id: int, history: bool = False) -> Union[
         bet_info = database_operation.get_bet_history_info(DbHandler.db_cnc, bet_id)
     else:
         bet_info = database_operation.get_bet_info(DbHandler.db_cnc, bet_id)
-    logger.debug(f'bet_info: {bet_info}')
+    logger.debug('bet_info: %s', bet_info)
 
     # Check if bet_info is zero, if true return. Is non zero when filled with data
     if not bet_info:
-        logger.error(f'bet_info is zero')
+        logger.error('bet_info is zero')
         return 0
 
-    # Get match from id in bet_info and validate
-    match = matches.get_match(ctx, bet_info[2])
-    logger.debug(f'match: {match}')
+    # The match's Accounts load with the bet's in one query
+    loader = account.AccountLoader(ctx)
+    match = matches.get_match(ctx, bet_info.match_id, history, loader)
     if not match:
         logger.error('match is zero')
         raise exception.UnableToRead(class_='Match', attribute='match')
-
-    # Get bettor from bet_info and validate
-    bettor = account.get_account_from_db(ctx, DbHandler.db_cnc, bet_info[3])
-    logger.debug(f'bettor: {bettor}')
-    if not bettor:
-        logger.error('bettor is zero')
-        raise exception.UnableToRead(class_='Account', attribute='account')
-
-    # Get bet_target from bet_info and validate
-    bet_target = account.get_account_from_db(ctx, DbHandler.db_cnc, bet_info[4])
-    logger.debug(f'bet_target: {bet_target}')
-    if not bet_target:
-        logger.error('bet_target is zero')
-        raise exception.UnableToRead(class_='Account', attribute='account')
+    bettor = loader.ref(bet_info.better_id)
+    bet_target = loader.ref(bet_info.participant1)
 
     # Check history to get data specific to history matches
     if history:
         logger.debug('history bet')
-
-        # Get winner from bet_info and validate
-        winner = account.get_account_from_db(ctx, DbHandler.db_cnc, bet_info[5])
-        logger.debug(f'winner: {winner}')
-        if not winner:
-            logger.error('winner is zero')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-
-        # Create Bet with bet_info data
-        bet = Bet(bet_info[0], bet_info[1], match, bettor, bet_target, winner, bet_info[6])
+        winner = loader.ref(bet_info.winner_id)
+        bet = Bet(bet_info.id, bet_info.amount, match, bettor, bet_target, winner, bet_info.bet_time, True)
     else:
-        bet = Bet(bet_info[0], bet_info[1], match, bettor, bet_target)
-    logger.debug(f'bet: {bet}')
+        bet = Bet(bet_info.id, bet_info.amount, match, bettor, bet_target)
+    logger.debug('bet: %s', bet)
+
+    loader.load_pending()
 
     return bet
 
 
 def process_bets(ctx, match: matches.Match) -> bool:
-    """Processes all the bets for a given match
+    """Processes all the bets for a given match, paying out and moving them to bet_history in one transaction
     """
-    logger.debug(f'process_bets: {match}')
+    logger.debug('process_bets: %s', match)
 
     # Check if match is a history match
     if not match.is_history:
-        logger.error(f"Passed a match that isn't history to process_bets")
+        logger.error("Passed a match that isn't history to process_bets")
         return False
 
     # Get all bets for match, validate that it's not empty
     bet_data = database_operation.get_bet_info_match_all(DbHandler.db_cnc, match.id)
-    if not len(bet_data):
-        logger.debug(f"No bets placed on this match")
-        return False
-
-    # Create list of bets to be filled and processed
-    bets = []
-    for bet in bet_data:
-        # Check if bet and match.id are equal
-        if bet[2] == match.id:
-            logger.debug(f'Valid bet({bet[0]})')
-
-        # Get bettor account and bet target account, validate
-        bettor = account.get_account_from_db(ctx, DbHandler.db_cnc, bet[3])
-        bet_target = account.get_account_from_db(ctx, DbHandler.db_cnc, bet[4])
-        if not bettor or not bet_target:
-            logger.error(f'Unable to get accounts from bet')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-
-        # Create bet to append onto bets
-        bet_temp = Bet(bet[0], bet[1], match, bettor, bet_target, match.winner)
-        logger.debug(f'bet_temp: {bet_temp}')
-        if not bet_temp:
-            logger.error(f'Unable to create bet')
-            raise exception.UnableToWrite(class_='Bet', attribute='bet')
-        bets.append(bet_temp)
-
-    # Check if bets has been propagated
-    if not len(bets):
-        logger.error(f'bets was not propagated')
+    if not bet_data:
+        logger.debug("No bets placed on this match")
         return False
 
-    # Total marble count
-    marble_pot = 0
+    # Calculate payouts and history rows, then write them together
+    loser = match.recipient if match.winner == match.challenger else match.challenger
+    bet_settlement = settlement.Settlement(match, match.winner, loser)
+    settlement.add_bets(bet_settlement, bet_data)
 
-    # Total of loser marbles and losers
-    loser_count = 0
-    loser_pot = 0
-
-    # Total of winner marbles and winners
-    winner_count = 0
-    winner_pot = 0
-
-    # Calculations that need all bets
-    for process_bet in bets:
-        # Check if bet is winner
-        if process_bet.is_winner():
-            # Increment winner count and add bet amount to winner pool
-            winner_count += 1
-            winner_pot += process_bet.amount
-        else:
-            # Increment loser count and add bet amount to loser pool
-            loser_count += 1
-            loser_pot += process_bet.amount
-        # Increment total marbles
-        marble_pot += process_bet.amount
-
-    logger.debug(f'marble_pot: {marble_pot}, '
-                 f'loser: sum({loser_pot}),count({loser_count}), '
-                 f'winner: sum({winner_pot}),count({winner_count})')
-
-    # Calculate winner_pot_ratio and winnings per bet
-    for calculate_bets in bets:
-        if calculate_bets.is_winner():
-            # Ratio of your bet in winner_pot
-            winner_pot_ratio = calculate_bets.amount/winner_pot
-            logger.debug(f'pot_ratio: {winner_pot_ratio}')
-
-            # If loser pot* winner_pot_ratio < 1: return bet amount + one marble
-            if (loser_pot*winner_pot_ratio) < 1:
-                bet_returns = calculate_bets.amount + 1
-            else:
-                bet_returns = calculate_bets.amount + (loser_pot*winner_pot_ratio)
-
-            # If no losers, house matches bet and returns double amount
-            if loser_count == 0:
-                bet_returns = calculate_bets.amount * 2
-
-            logger.debug(f'user: {calculate_bets.bettor.nickname}'
-                         f'winner_pot_ratio: {winner_pot_ratio}'
-                         f'bet_returns: {bet_returns}')
-
-            # Add bet_returns to bettors marbles
-            calculate_bets.bettor.marbles += bet_returns
-
-        # Update calculate_bet to prep for making into history
-        calculate_bets.bet_time = datetime.datetime.utcnow()
-        calculate_bets.is_history = True
-        # Delete bet
-        calculate_bets.delete_bet()
-        # Make bet history
-        calculate_bets.create_history()
+    if not database_operation.settle_bets(DbHandler.db_cnc, match.id, bet_settlement.ledger_entries,
+                                          bet_settlement.bet_history):
+        logger.error('Unable to settle bets')
+        raise exception.UnableToWrite(attribute='bet_history')
 
     return True
@@ -6,6 +6,7 @@ import discord
 from discord.ext import commands
 
 import database.database_operation as database_operation
+import utils.members as members
 
 logger = logging.getLogger('marble_match.discord_utils')
 
@@ -34,21 +35,16 @@ def get_member_by_player_id(ctx: commands.Context, connection: sqlite3.Connectio
     - `<player_id>` Database index of player you to get discord.Member from.
 
     """
-    logger.debug(f'get_member_by_player_id: {ctx}, {connection}, {player_id}')
+    logger.debug('get_member_by_player_id: %s, %s, %s', ctx, connection, player_id)
 
     player_info = database_operation.get_player_info(connection, player_id)
-    logger.debug(f'player_info: {player_info}')
+    logger.debug('player_info: %s', player_info)
 
     if player_info is None:
         logger.debug('player_info is empty')
         return 0
 
-    for member in ctx.guild.members:
-        if str(member) == player_info[1]:
-            logger.debug(f'Found member matching player_info: {member}')
-            return member
-
-    return 0
+    return get_member_by_uuid(ctx, player_info.uuid)
 
 
 def get_id_by_member(ctx: commands.Context, connection: sqlite3.Connection, member: discord.Member) -> int:
@@ -61,13 +57,13 @@ def get_id_by_member(ctx: commands.Context, connection: sqlite3.Connection, memb
     - `<member>` Member who's player id you'd like to receive.
 
     """
-    logger.debug(f'get_id_by_member: {ctx}, {connection}, {member}')
+    logger.debug('get_id_by_member: %s, %s, %s', ctx, connection, member)
     if isinstance(ctx.channel, discord.DMChannel):
         logger.debug('Ctx channel is dm, get_id_by_member not allowed in dms')
         return 0
 
     player_id = database_operation.get_player_id(connection, member.id, ctx.guild.id)
-    logger.debug(f'player_id: {player_id}')
+    logger.debug('player_id: %s', player_id)
     return player_id
 
 
@@ -80,20 +76,20 @@ def get_member_by_uuid(ctx: commands.Context, uuid: int) -> Union[discord.Member
     - `<uuid>` Unique discord user id to get member for
 
     """
-    logger.debug(f'get_member_by_uuid: {uuid}')
+    logger.debug('get_member_by_uuid: %s', uuid)
 
     # Checks if ctx.channel is dm, before grabbing member list
     if isinstance(ctx.channel, discord.DMChannel):
-        logger.debug(f'ctx.channel is discord dm: {ctx}')
+        logger.debug('ctx.channel is discord dm: %s', ctx)
         return 0
 
-    # Get member from ctx.guild.members with id
-    member = discord.utils.get(ctx.guild.members, id=uuid)
-    logger.debug(f'member: {member}')
+    # Get member from index of ctx.guild members with id
+    member = members.index.get(ctx, uuid)
+    logger.debug('member: %s', member)
 
     # Validate member
     if isinstance(member, discord.Member):
-        logger.debug(f'member is type discord.Member')
+        logger.debug('member is type discord.Member')
         return member
 
     return 0
@@ -108,30 +104,30 @@ def get_member_by_username(ctx: commands.Context, username: str) -> Union[discor
     - `<username>` String containing username to get member for
 
     """
-    logger.debug(f'get_member_by_username: {username}')
+    logger.debug('get_member_by_username: %s', username)
 
     # Checks if ctx.channel is dm, before grabbing member list
     if isinstance(ctx.channel, discord.DMChannel):
-        logger.debug(f'ctx.channel is discord channel: {ctx}')
+        logger.debug('ctx.channel is discord channel: %s', ctx)
         return 0
 
     # Split username into name and discriminator ex. 'cchan#0000'
     user_split = username.split('#')
-    logger.debug(f'user_split: {user_split}')
+    logger.debug('user_split: %s', user_split)
 
     # Check if username length is 2, so we know if split was done
     if len(user_split) != 2:
-        logger.error(f'Unexpected user_split length: {username}, {user_split}')
+        logger.error('Unexpected user_split length: %s, %s', username, user_split)
         return 0
 
-    # Get member from ctx.guild.members with name and discriminator
-    member = discord.utils.get(ctx.guild.members, name=user_split[0], discriminator=user_split[1])
-    logger.debug(f'member: {member}')
+    # Get member from index of ctx.guild members with name and discriminator
+    member = members.index.get_by_tag(ctx, f'{user_split[0]}#{user_split[1]}')
+    logger.debug('member: %s', member)
 
     # Check if member is discord.Member
     if isinstance(member, discord.Member):
-        logger.debug(f'member is type discord.Member')
+        logger.debug('member is type discord.Member')
         return member
 
-    logger.error(f'member is not type discord.Member')
+    logger.error('member is not type discord.Member')
     return 0
@@ -0,0 +1,125 @@
+import itertools
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+import database.database_operation as database_operation
+
+logger = logging.getLogger(f'marble_match.{__name__}')
+
+# Percentiles reported in EconomySummary.percentiles
+PERCENTILES = (10, 25, 75, 90)
+# Population shares the Lorenz curve is sampled at
+LORENZ_POINTS = np.linspace(0, 1, 11)
+# Share of the richest players counted as top holders
+TOP_SHARE = 0.1
+
+
+@dataclass
+class EconomySummary:
+    players: int
+    circulation: int
+    mean: float
+    median: float
+    percentiles: Dict[int, float]
+    gini: float
+    lorenz: Tuple[Tuple[float, float], ...]
+    top_share: float
+
+
+def summarize(balances: np.ndarray) -> Optional[EconomySummary]:
+    """Returns EconomySummary of balances sorted lowest first, None if there are none
+
+    **Arguments**
+
+    - `<balances>` Sorted 1d array of marble counts
+
+    """
+    n = balances.shape[0]
+    if not n:
+        return None
+
+    circulation = int(balances.sum())
+    percentiles = np.percentile(balances, PERCENTILES)
+
+    # Cumulative share of marbles held by the poorest part of players, starting at (0, 0)
+    cumulative = np.concatenate(([0], np.cumsum(balances, dtype=np.float64)))
+    if circulation:
+        cumulative /= circulation
+        # Gini from the sorted balances, 0 is perfectly equal and close to 1 is one player holding everything
+        index = np.arange(1, n + 1)
+        gini = float((2 * np.dot(index, balances)) / (n * circulation) - (n + 1) / n)
+    else:
+        cumulative[:] = np.linspace(0, 1, n + 1)
+        gini = 0.0
+    lorenz_shares = np.interp(LORENZ_POINTS, np.linspace(0, 1, n + 1), cumulative)
+
+    top = max(1, int(np.ceil(n * TOP_SHARE)))
+    top_share = float(balances[-top:].sum() / circulation) if circulation else 0.0
+
+    return EconomySummary(n, circulation, float(balances.mean()), float(np.median(balances)),
+                          dict(zip(PERCENTILES, percentiles.tolist())), gini,
+                          tuple(zip(LORENZ_POINTS.tolist(), lorenz_shares.tolist())), top_share)
+
+
+class SummaryCache:
+    """Last EconomySummary of every guild, valid while the guild's ledger version doesn't change"""
+
+    def __init__(self):
+        self._summaries: Dict[int, Tuple[int, Optional[EconomySummary]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, server_id: int, version: int):
+        with self._lock:
+            cached = self._summaries.get(server_id)
+        if cached is not None and cached[0] == version:
+            return cached
+        return None
+
+    def set(self, server_id: int, version: int, summary: Optional[EconomySummary]):
+        with self._lock:
+            self._summaries[server_id] = (version, summary)
+
+    def clear(self):
+        with self._lock:
+            self._summaries.clear()
+
+
+cache = SummaryCache()
+# Balances rebuilt outside the ledger don't change the version
+database_operation.rollback_listeners.append(cache.clear)
+
+
+def get_summary(connection: sqlite3.Connection, server_id: int) -> Optional[EconomySummary]:
+    """Returns EconomySummary of server_id, None if it has no players
+
+    Only the ledger version is read while the cached summary is current, otherwise balances are read into an array
+    with a single query.
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<server_id>` Server to summarize
+
+    """
+    logger.debug('get_summary: %s', server_id)
+
+    version = database_operation.get_ledger_version(connection, server_id)
+    cached = cache.get(server_id, version)
+    if cached is not None:
+        logger.debug('summary cached')
+        return cached[1]
+
+    rows = database_operation.get_server_balances(connection, server_id)
+    if isinstance(rows, int):
+        return None
+
+    balances = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=len(rows))
+    summary = summarize(balances)
+    cache.set(server_id, version, summary)
+
+    return summary
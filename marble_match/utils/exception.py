@@ -135,8 +135,38 @@ class UnexpectedValue(commands.CommandError):
 
 
 class InvalidNickname(commands.CommandError):
-    """Raised when a nickname is invalid"""
+    """Raised when a nickname is invalid
 
-    def __init__(self, message='Invalid nickname'):
+    **Attributes**
+
+    - `message` Main message to display, includes suggestions if there are any
+    - `suggestions` Existing nicknames similar to the invalid one
+
+    """
+
+    def __init__(self, message='Invalid nickname', suggestions=None):
+        self.suggestions = suggestions or []
+        if self.suggestions:
+            message = f'{message}, did you mean {", ".join(self.suggestions)}?'
         self.message = message
         super().__init__(self.message)
+
+
+class NotEnoughMarbles(commands.CommandError):
+    """Raised when a player doesn't have the marbles they're staking
+
+    **Attributes**
+
+    - `message` Main message to display
+    - `nickname` Nickname of the player
+    - `marbles` Marbles the player has
+    - `needed` Marbles the player needed
+
+    """
+
+    def __init__(self, nickname: str, marbles: int, needed: int):
+        self.nickname = nickname
+        self.marbles = marbles
+        self.needed = needed
+        self.message = f'{nickname} does not have enough marbles, they have {marbles} and need {needed}'
+        super().__init__(self.message)
@@ -0,0 +1,102 @@
+import atexit
+import configparser
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Used for settings missing from the LOGGING section of marble_bot.ini
+LEVEL = 'INFO'
+CONSOLE_LEVEL = 'ERROR'
+FILE = 'log.log'
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+FORMAT = '%(asctime)s : %(module)s : %(levelname)s : %(message)s'
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that queues records as they are, so messages are only formatted on the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class SizedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that formats each record once, it rolls over by the characters it wrote instead of checking
+    the file on disk for every record"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.size = self.stream.seek(0, 2)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            msg = self.format(record) + self.terminator
+            if self.maxBytes > 0 and self.size and self.size + len(msg) >= self.maxBytes:
+                self.doRollover()
+                self.size = 0
+            self.stream.write(msg)
+            self.size += len(msg)
+        except Exception:
+            self.handleError(record)
+
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    """QueueListener that flushes its handlers once the queue is empty, rather than after every record"""
+
+    def handle(self, record: logging.LogRecord):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+
+
+def subsystem_levels(config: configparser.ConfigParser) -> dict:
+    """Returns dict of logger name to level from the LOG_LEVELS section of config
+
+    Keys are logger names such as marble_match.database or marble_match.acc, a level set on a logger applies to
+    the loggers below it.
+
+    """
+    if not config.has_section('LOG_LEVELS'):
+        return {}
+    defaults = config.defaults()
+    return {name: level.upper() for name, level in config['LOG_LEVELS'].items() if name not in defaults}
+
+
+def configure(config: configparser.ConfigParser, name: str = 'marble_match') -> logging.handlers.QueueListener:
+    """Sets up logger name to hand records to a queue, written to a rotating file by a background thread
+
+    Records below the level of their logger are dropped before their message is formatted. The rest are queued as
+    they are, the listener thread formats and writes them. Returns the started QueueListener, it's stopped when the
+    interpreter exits.
+
+    **Arguments**
+
+    - `<config>` Parsed marble_bot.ini, read from its LOGGING and LOG_LEVELS sections
+    - `<name>` Name of the logger to set up
+
+    """
+    settings = config['LOGGING'] if config.has_section('LOGGING') else {}
+
+    file_handler = SizedRotatingFileHandler(settings.get('file', FILE),
+                                            maxBytes=int(settings.get('max_bytes', MAX_BYTES)),
+                                            backupCount=int(settings.get('backup_count', BACKUP_COUNT)),
+                                            encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setLevel(settings.get('console_level', CONSOLE_LEVEL).upper())
+
+    log_queue = queue.SimpleQueue()
+    listener = FlushingQueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(settings.get('level', LEVEL).upper())
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    for subsystem, level in subsystem_levels(config).items():
+        logging.getLogger(subsystem).setLevel(level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,6 +1,6 @@
 import logging
 import datetime
-from typing import Union
+from typing import Optional, Union
 from dataclasses import dataclass, field
 
 import discord
@@ -10,17 +10,20 @@ import database.database_operation as database_operation
 from database.database_setup import DbHandler
 import utils.account as acc
 import utils.exception as exception
+import utils.relations as relations
+from utils.slots import slotted
 
 logger = logging.getLogger(f'marble_match.{__name__}')
 
 
+@slotted
 @dataclass(order=True)
 class Match:
     id: int
     amount: int
     _active: bool
-    challenger: acc.Account
-    recipient: acc.Account
+    _challenger: acc.Account
+    _recipient: acc.Account
     _accepted: bool
     _winner: acc.Account = field(default=None)
     _match_time: datetime.datetime = field(default=None)
@@ -28,13 +31,29 @@ class Match:
     _format: str = field(default='Bo3')
     _is_history: bool = field(default=False)
 
+    # Accounts may be AccountRefs, resolved from the loader that read them
+    challenger = relations.Lazy('_challenger')
+    recipient = relations.Lazy('_recipient')
+
+    @property
+    def challenger_id(self) -> int:
+        return self._challenger.id
+
+    @property
+    def recipient_id(self) -> int:
+        return self._recipient.id
+
+    @property
+    def winner_id(self) -> Optional[int]:
+        return self._winner.id if self._winner is not None else None
+
     @property
     def active(self) -> bool:
         return self._active
 
     @active.setter
     def active(self, activity: bool):
-        logger.debug(f'active_setter: {activity}')
+        logger.debug('active_setter: %s', activity)
 
         # Update active in database, check if write was successful then update Match info
         if database_operation.update_match_activity(DbHandler.db_cnc, self.id, int(activity)):
@@ -50,7 +69,7 @@ class Match:
 
     @accepted.setter
     def accepted(self, accepted: bool):
-        logger.debug(f'accepted_setter: {accepted}')
+        logger.debug('accepted_setter: %s', accepted)
 
         # Update accepted in database, check if write was successful then update Match info
         if database_operation.update_match_accepted(DbHandler.db_cnc, self.id, int(accepted)):
@@ -62,18 +81,18 @@ class Match:
 
     @property
     def winner(self) -> acc.Account:
-        return self._winner
+        return relations.resolve(self, '_winner')
 
     @winner.setter
     def winner(self, winner_id: acc.Account):
-        logger.debug(f'winner_setter: {winner_id}')
+        logger.debug('winner_setter: %s', winner_id)
         # Check if winner_id, is either challenger/recipient
         if winner_id == self.challenger or winner_id == self.recipient:
-            logger.debug(f'winner_id is equal to challenger or recipient: '
-                         f'{winner_id}, {self.challenger}, {self.recipient}')
+            logger.debug('winner_id is equal to challenger or recipient: %s, %s, %s',
+                         winner_id, self.challenger, self.recipient)
             self._winner = winner_id
         else:
-            logger.error(f'Attempted to change winner_id to invalid id: {self}')
+            logger.error('Attempted to change winner_id to invalid id: %s', self)
             raise exception.UnexpectedValue(class_='Match', attribute='winner', value=winner_id,
                                             expected_values=[self.challenger, self.recipient])
 
@@ -83,11 +102,11 @@ class Match:
 
     @is_history.setter
     def is_history(self, history: bool):
-        logger.debug(f'is_history_setter: {history}')
+        logger.debug('is_history_setter: %s', history)
 
         # Check if match is already history
         if self._is_history:
-            logger.debug(f'Attempted to set is_history flag, when flag is already true')
+            logger.debug('Attempted to set is_history flag, when flag is already true')
             return
 
         # Change history flag
@@ -99,7 +118,7 @@ class Match:
 
     @match_time.setter
     def match_time(self, time: datetime.datetime):
-        logger.debug(f'match_time_setter: {time}')
+        logger.debug('match_time_setter: %s', time)
         self._match_time = time
 
     @property
@@ -115,10 +134,10 @@ class Match:
         return f'{self._game}[{self._format}]'
 
     def create_history(self) -> bool:
-        logger.debug(f'match.create_History: {self}')
+        logger.debug('match.create_History: %s', self)
         # Check if create_match_history was successful, return True if it was
-        if database_operation.create_match_history(DbHandler.db_cnc, self.id, self.amount, self.challenger.id,
-                                                   self.recipient.id, self._winner.id, self._match_time,
+        if database_operation.create_match_history(DbHandler.db_cnc, self.id, self.amount, self.challenger_id,
+                                                   self.recipient_id, self._winner.id, self._match_time,
                                                    self._game, self._format):
             logger.debug('Wrote match to match_history')
             # Delete match from table, raise exception if unable to write
@@ -135,12 +154,13 @@ class Match:
 def create_match(ctx, match_id: int, amount: int, challenger: acc.Account, recipient: acc.Account,
                  active: bool = False, accepted: bool = False,
                  game: str = 'melee', format: str = 'Bo3') -> Union[Match, int]:
-    logger.debug(f'match.create_match: {match_id}, {amount}, {challenger}, {recipient}, {active}, {accepted}')
+    logger.debug('match.create_match: %s, %s, %s, %s, %s, %s',
+                 match_id, amount, challenger, recipient, active, accepted)
 
     # Assuming match_id is None, refill match_id with results of create_match, if zero write was unsuccessful
     match_id = database_operation.create_match(DbHandler.db_cnc, match_id, amount, challenger.id, recipient.id, active,
                                                accepted, game, format)
-    logger.debug(f'match_id: {match_id}')
+    logger.debug('match_id: %s', match_id)
 
     # Check if match_id is valid (Non zero)
     if not match_id:
@@ -149,7 +169,7 @@ def create_match(ctx, match_id: int, amount: int, challenger: acc.Account, recip
 
     # Create Match from match_id, check if match is valid
     match = get_match(ctx, match_id)
-    logger.debug(f'match: {match}')
+    logger.debug('match: %s', match)
     if not match:
         logger.error('Unable to create match')
         raise exception.UnableToRead(class_='Match', attribute='match')
@@ -157,7 +177,8 @@ def create_match(ctx, match_id: int, amount: int, challenger: acc.Account, recip
     return match
 
 
-def get_matches_all(ctx, user: acc.Account, user2: acc.Account = None, history: bool = False) -> Union[list, int]:
+def get_matches_all(ctx, user: acc.Account, user2: acc.Account = None, history: bool = False,
+                    limit: int = None, before_id: int = None, after_id: int = None) -> Union[list, int]:
     """Returns list of all Matches with user
 
     **Arguments**
@@ -166,79 +187,45 @@ def get_matches_all(ctx, user: acc.Account, user2: acc.Account = None, history:
     - `<user>` User who's matches you wish to get
     - `<user2>` User who you wanna search for as well
     - `<history>` Used to get either match history or active matches
+    - `<limit>` If set only a page of this many history matches is returned, newest page if no id is given
+    - `<before_id>` Return the page of history matches directly older than this id
+    - `<after_id>` Return the page of history matches directly newer than this id
 
     """
-    logger.debug(f'get_matches_all: {user}, {user2}, {history}')
+    logger.debug('get_matches_all: %s, %s, %s, %s, %s, %s', user, user2, history, limit, before_id, after_id)
 
-    # Get all matches with user.id
+    # Get all matches with user.id and user2.id, joined with the participants users rows
+    user2_id = user2.id if user2 is not None else None
     if history:
-        matches = database_operation.get_match_history_info_all(DbHandler.db_cnc, user.id)
+        matches = database_operation.get_match_history_joined(DbHandler.db_cnc, user.id, user2_id,
+                                                              limit, before_id, after_id)
     else:
-        matches = database_operation.get_match_info_all(DbHandler.db_cnc, user.id)
-    logger.debug(f'matches: {matches}')
+        matches = database_operation.get_match_info_joined(DbHandler.db_cnc, user.id, user2_id)
+    logger.debug('matches: %s', matches)
 
     # Check if matches is valid
-    if not matches:
+    if isinstance(matches, int):
         logger.error('matches is zero')
         if history:
-            raise exception.UnableToRead(attribute='matches')
-        else:
             raise exception.UnableToRead(attribute='matches_history')
+        else:
+            raise exception.UnableToRead(attribute='matches')
 
-    # Create match list to return
+    # Create Matches from rows, Accounts are shared between rows
     match_list = []
-
-    # Loop through matches and create matches to return
     for match in matches:
-        # Get challenger Account and check if valid
-        if history:
-            challenger_id = match[2]
-        else:
-            challenger_id = match[4]
-        challenger = acc.get_account_from_db(ctx, DbHandler.db_cnc, challenger_id)
-        logger.debug(f'challenger: {challenger}')
-        if not challenger:
-            logger.error('Unable to get challenger acc')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-
-        # Get recipient Account and check if valid
-        if history:
-            recipient_id = match[3]
-        else:
-            recipient_id = match[4]
-        recipient = acc.get_account_from_db(ctx, DbHandler.db_cnc, recipient_id)
-        logger.debug(f'recipient: {recipient}')
-        if not recipient:
-            logger.error('Unable to get challenger acc')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-
-        # Check if user2 is not none, to change search to games with user2
-        if user2 is not None:
-            logger.debug('user2 is not None')
-            if challenger.id == user2.id or recipient.id == user2.id:
-                pass
-            else:
-                continue
-
-        # Create match and check if valid before appending to list
-        if history:
-            logger.debug('history is true')
-            # Get winner Account and check if valid
-            winner = acc.get_account_from_db(ctx, DbHandler.db_cnc, match[4])
-            logger.debug(f'winner: {winner}')
-            if not winner:
-                logger.error('Unable to get winner account')
-                raise exception.UnableToRead(class_='Account', attribute='account')
-            append_match = Match(match[0], match[1], True, challenger, recipient, True, winner,
-                                 match[5], match[6], match[7], True)
+        challenger = acc.account_from_row(ctx, match.challenger)
+        recipient = acc.account_from_row(ctx, match.recipient)
 
+        if history:
+            winner = acc.account_from_row(ctx, match.winner)
+            append_match = Match(match.id, match.amount, True, challenger, recipient, True, winner,
+                                 match.match_time, match.game, match.format, True)
         else:
-            append_match = Match(match[0], match[1], match[2], challenger, recipient, match[5],
-                                 _game=match[6], _format=match[7])
+            append_match = Match(match.id, match.amount, match.active, challenger, recipient, match.accepted,
+                                 _game=match.game, _format=match.format)
 
-        logger.debug(f'append_match: {append_match}')
-        if isinstance(append_match, Match):
-            match_list.append(append_match)
+        match_list.append(append_match)
 
     # Check if list has been propagated, return 0 if not
     if not len(match_list):
@@ -249,17 +236,20 @@ def get_matches_all(ctx, user: acc.Account, user2: acc.Account = None, history:
     return match_list
 
 
-def get_match(ctx: commands.Context, match_id: int, history: bool = False) -> Union[Match, int]:
-    """Returns Match for Match with match_id
+def get_match(ctx: commands.Context, match_id: int, history: bool = False,
+              loader: acc.AccountLoader = None) -> Union[Match, int]:
+    """Returns Match for Match with match_id, its Accounts are loaded together with one query
 
     **Arguments**
 
     - `<ctx>` Context used to get members and other information
     - `<match_id>` Id of the match to get
     - `<history>` Used to specify if you'd like to get a match from match_history or matches
+    - `<loader>` AccountLoader to load Accounts with, shared with other results if given. The caller then runs
+      its load_pending once every result is read
 
     """
-    logger.debug(f'get_match: {match_id}, {history}')
+    logger.debug('get_match: %s, %s', match_id, history)
 
     # Check if ctx.channel is dm, return zero if true
     if isinstance(ctx.channel, discord.DMChannel):
@@ -274,88 +264,33 @@ def get_match(ctx: commands.Context, match_id: int, history: bool = False) -> Un
         match_info = database_operation.get_match_history_info(DbHandler.db_cnc, match_id)
     else:
         match_info = database_operation.get_match_info_by_id(DbHandler.db_cnc, match_id)
-    logger.debug(f'match_info: {match_info}')
+    logger.debug('match_info: %s', match_info)
 
     # Checks if match_info is int, if true return. Is tuple when filled with data
     if isinstance(match_info, int):
-        logger.error(f'match_info was type int')
+        logger.error('match_info was type int')
         return 0
 
+    # Accounts are referenced by id until the loader reads them
+    shared = loader is not None
+    if not shared:
+        loader = acc.AccountLoader(ctx)
+    challenger = loader.ref(match_info.participant1)
+    recipient = loader.ref(match_info.participant2)
+
     # Check history to get data specific to history matches
     if history:
-        # Get Account of challenger
-        challenger = acc.get_account_from_db(ctx, DbHandler.db_cnc, match_info[2])
-        logger.debug(f'challenger: {challenger}')
-        # Checks if challenger is int, if true return 0
-        if isinstance(challenger, int):
-            logger.error('challenger is type int')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-
-        # Get Account of recipient
-        recipient = acc.get_account_from_db(ctx, DbHandler.db_cnc, match_info[3])
-        logger.debug(f'recipient: {recipient}')
-        # Check if recipient is int, if true return 0
-        if isinstance(recipient, int):
-            logger.error('recipient is type int')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-
-        # Get Account for winner
-        winner = acc.get_account_from_db(ctx, DbHandler.db_cnc, match_info[4])
-        logger.debug(f'winner: {winner}')
-        # Checks if winner is int, if true return 0
-        if isinstance(winner, int):
-            logger.error('winner is type int')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-
-        # Create Match with match_info data
-        match = Match(match_info[0], match_info[1], True, challenger, recipient, True, winner, match_info[5],
-                      match_info[6], match_info[7], True)
-        logger.debug(f'match: {match}')
-        # Checks if match is type int, if true return 0
-        if isinstance(match, int):
-            logger.error('match is type int')
-            raise exception.UnableToWrite(class_='Match', attribute='match')
-
-        # Return match
-        return match
+        winner = loader.ref(match_info.winner_id)
+        match = Match(match_info.id, match_info.amount, True, challenger, recipient, True, winner,
+                      match_info.match_time, match_info.game, match_info.format, True)
     else:
-        # Get Account of challenger
-        challenger = acc.get_account_from_db(ctx, DbHandler.db_cnc, match_info[3])
-        logger.debug(f'challenger: {challenger}')
-        # Checks if challenger is int, if true return 0
-        if isinstance(challenger, int):
-            logger.error('challenger is type int')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-
-        # Get Account of recipient
-        recipient = acc.get_account_from_db(ctx, DbHandler.db_cnc, match_info[4])
-        logger.debug(f'recipient: {recipient}')
-        # Check if recipient is int, if true return 0
-        if isinstance(recipient, int):
-            logger.error('recipient is type int')
-            raise exception.UnableToRead(class_='Account', attribute='account')
-        # Create match with match_info data
-        match = Match(match_info[0], match_info[1], match_info[2], challenger, recipient, match_info[5],
-                      _game=match_info[6], _format=match_info[7])
-
-        # Checks if match is type int, if true return 0
-        if isinstance(match, int):
-            logger.error('match is type int')
-            raise exception.UnableToWrite(class_='Match', attribute='match')
-
-        # Return match
-        return match
-
-
-def get_matches(ctx, user: acc.Account) -> Union[list, int]:
-    logger.debug(f'get_match: {user}')
-
-    # Get matches for Account, check if valid
-    match_list = get_matches_all(ctx, user)
-    logger.debug(f'match_list: {match_list}')
-    if isinstance(match_list, int):
-        logger.error('match_list is zero')
-        return 0
+        match = Match(match_info.id, match_info.amount, match_info.active, challenger, recipient,
+                      match_info.accepted, _game=match_info.game, _format=match_info.format)
+    logger.debug('match: %s', match)
 
-    # Return match_list
-    return match_list
+    # Load Accounts here, on the database thread, so reading them later doesn't wait on the database
+    if not shared:
+        loader.load_pending()
+
+    # Return match
+    return match
@@ -0,0 +1,122 @@
+import logging
+import threading
+from typing import Dict, Optional
+
+import discord
+from discord.ext import commands
+
+logger = logging.getLogger(f'marble_match.{__name__}')
+
+
+class GuildMembers:
+    """Members of a guild by id and name#discriminator"""
+
+    def __init__(self, guild: discord.Guild):
+        self.by_id: Dict[int, discord.Member] = {}
+        self.by_tag: Dict[str, discord.Member] = {}
+        # Tag every member was indexed under, so it can be removed after the member has changed
+        self.keys: Dict[int, str] = {}
+
+        for member in guild.members:
+            self.add(member)
+
+    def add(self, member: discord.Member):
+        self.remove(member.id)
+        tag = str(member)
+        self.by_id[member.id] = member
+        self.by_tag[tag] = member
+        self.keys[member.id] = tag
+
+    def remove(self, member_id: int):
+        tag = self.keys.pop(member_id, None)
+        if tag is None:
+            return
+        del self.by_id[member_id]
+        if self.by_tag.get(tag) is not None and self.by_tag[tag].id == member_id:
+            del self.by_tag[tag]
+
+
+class MemberIndex:
+    """GuildMembers of every guild looked up in, built on first lookup and kept current with member events"""
+
+    def __init__(self):
+        self.guilds: Dict[int, GuildMembers] = {}
+        self.bot = None
+        # Lookups can run on the database executor while events are handled on the event loop
+        self._lock = threading.RLock()
+
+    def attach(self, bot: commands.Bot):
+        """Registers the member listeners on bot, only the first call has any effect
+
+        **Arguments**
+
+        - `<bot>` Bot to listen to member events of
+
+        """
+        if self.bot is not None:
+            return
+        self.bot = bot
+        bot.add_listener(self.on_member_join, 'on_member_join')
+        bot.add_listener(self.on_member_update, 'on_member_update')
+        bot.add_listener(self.on_member_remove, 'on_member_remove')
+        bot.add_listener(self.on_user_update, 'on_user_update')
+        bot.add_listener(self.on_guild_remove, 'on_guild_remove')
+
+    def guild(self, ctx: commands.Context) -> GuildMembers:
+        """Returns GuildMembers of ctx.guild, building it from ctx.guild.members if it isn't indexed yet
+
+        **Arguments**
+
+        - `<ctx>` Context of guild to get members of
+
+        """
+        with self._lock:
+            members = self.guilds.get(ctx.guild.id)
+            if members is None:
+                logger.debug('Indexing members of %s', ctx.guild.id)
+                self.attach(ctx.bot)
+                members = GuildMembers(ctx.guild)
+                self.guilds[ctx.guild.id] = members
+            return members
+
+    def get(self, ctx: commands.Context, member_id: int) -> Optional[discord.Member]:
+        with self._lock:
+            return self.guild(ctx).by_id.get(member_id)
+
+    def get_by_tag(self, ctx: commands.Context, tag: str) -> Optional[discord.Member]:
+        with self._lock:
+            return self.guild(ctx).by_tag.get(tag)
+
+    def _update(self, member: discord.Member):
+        with self._lock:
+            members = self.guilds.get(member.guild.id)
+            if members is not None:
+                members.add(member)
+
+    async def on_member_join(self, member: discord.Member):
+        self._update(member)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        # Keeps the newest Member, with its current nickname and roles
+        self._update(after)
+
+    async def on_member_remove(self, member: discord.Member):
+        with self._lock:
+            members = self.guilds.get(member.guild.id)
+            if members is not None:
+                members.remove(member.id)
+
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        # Username and discriminator changes are sent once for every guild the user is in
+        with self._lock:
+            for members in self.guilds.values():
+                member = members.by_id.get(after.id)
+                if member is not None:
+                    members.add(member)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        with self._lock:
+            self.guilds.pop(guild.id, None)
+
+
+index = MemberIndex()
@@ -0,0 +1,291 @@
+import asyncio
+import configparser
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from discord.ext import commands
+
+import database.database_setup as database_setup
+
+logger = logging.getLogger(f'marble_match.{__name__}')
+
+# Used for settings missing from the METRICS section of marble_bot.ini, a file ending in .json is written as JSON,
+# anything else in the Prometheus text format
+FILE = 'metrics.prom'
+INTERVAL = 60
+
+# Upper bounds in seconds of the latency histogram buckets, a last bucket holds everything slower
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Database work done outside of a command, by listeners and background tasks, is recorded under this name
+BACKGROUND = '(background)'
+
+
+class CommandStats:
+    """Totals of a command since the bot started"""
+    __slots__ = ('name', 'runs', 'errors', 'buckets', 'seconds', 'max_seconds', 'statements', 'commits', 'rows',
+                 'db_seconds')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.runs = 0
+        self.errors = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.statements = 0
+        self.commits = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+
+    def observe(self, seconds: float, failed: bool):
+        """Records a run that took seconds"""
+        index = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+        with _lock:
+            self.runs += 1
+            self.errors += failed
+            self.buckets[index] += 1
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Returns upper bound of the bucket the q quantile of runs falls in, no more than the slowest run"""
+        if not self.runs:
+            return 0.0
+        target = q * self.runs
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+    def as_dict(self) -> dict:
+        values = {slot: getattr(self, slot) for slot in self.__slots__}
+        values['buckets'] = list(self.buckets)
+        return values
+
+
+# Guards every CommandStats, they're updated from the event loop and the database threads
+_lock = threading.Lock()
+registry: Dict[str, CommandStats] = {BACKGROUND: CommandStats(BACKGROUND)}
+
+# Stats of the command the current task or database call runs for, None outside of commands
+current: contextvars.ContextVar = contextvars.ContextVar('marble_command', default=None)
+
+# Periodic write of the metrics file, see start
+_settings = {'file': FILE, 'interval': INTERVAL}
+_task: Optional[asyncio.Task] = None
+
+
+def stats(name: str) -> CommandStats:
+    """Returns CommandStats of command name, created the first time it's asked for"""
+    command_stats = registry.get(name)
+    if command_stats is None:
+        with _lock:
+            command_stats = registry.setdefault(name, CommandStats(name))
+    return command_stats
+
+
+def _current() -> CommandStats:
+    return current.get() or registry[BACKGROUND]
+
+
+def trace(statement: str):
+    """Trace callback of every connection, counts statements and commits of the current command"""
+    command_stats = _current()
+    with _lock:
+        if statement.startswith('COMMIT'):
+            command_stats.commits += 1
+        elif not statement.startswith(('BEGIN', 'ROLLBACK', 'PRAGMA')):
+            command_stats.statements += 1
+
+
+def add_rows(rows: int):
+    command_stats = _current()
+    with _lock:
+        command_stats.rows += rows
+
+
+def timed(func, *args, **kwargs):
+    """Calls func with args, recording the time it takes as database time of the current command"""
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        command_stats = _current()
+        with _lock:
+            command_stats.db_seconds += elapsed
+
+
+def attach(connection: sqlite3.Connection):
+    connection.set_trace_callback(trace)
+
+
+class MeteredCursor(sqlite3.Cursor):
+    """Cursor that counts the rows fetched through it as rows read by the current command"""
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            add_rows(1)
+        return row
+
+    def fetchmany(self, size: int = None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        add_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        add_rows(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        add_rows(1)
+        return row
+
+
+class MeteredConnection(sqlite3.Connection):
+    """Connection whose cursors, including the ones execute makes, are MeteredCursors"""
+
+    def cursor(self, factory=MeteredCursor):
+        return super().cursor(factory)
+
+
+async def before_invoke(ctx: commands.Context):
+    ctx.metrics_token = current.set(stats(ctx.command.qualified_name))
+    ctx.metrics_start = time.perf_counter()
+
+
+async def after_invoke(ctx: commands.Context):
+    start = getattr(ctx, 'metrics_start', None)
+    if start is None:
+        return
+    current.get().observe(time.perf_counter() - start, ctx.command_failed)
+    current.reset(ctx.metrics_token)
+
+
+def configure(config: configparser.ConfigParser):
+    """Meters every connection opened from now on and reads where metrics are written from the METRICS section
+
+    Has to be called before the database is first used, connections that are already open aren't metered.
+
+    **Arguments**
+
+    - `<config>` Parsed marble_bot.ini
+
+    """
+    settings = config['METRICS'] if config.has_section('METRICS') else {}
+    _settings['file'] = settings.get('file', FILE)
+    _settings['interval'] = float(settings.get('interval', INTERVAL))
+
+    database_setup.connection_factory = MeteredConnection
+    if attach not in database_setup.connection_listeners:
+        database_setup.connection_listeners.append(attach)
+
+
+def install(bot: commands.Bot):
+    """Times every command bot runs, and records the database work done for it"""
+    bot.before_invoke(before_invoke)
+    bot.after_invoke(after_invoke)
+
+
+def snapshot() -> list:
+    """Returns list of every CommandStats as a dict, most database time first"""
+    with _lock:
+        rows = [command_stats.as_dict() for command_stats in registry.values()]
+    return sorted(rows, key=lambda row: row['db_seconds'], reverse=True)
+
+
+def to_json() -> str:
+    return json.dumps({'buckets': BUCKETS, 'commands': snapshot()}, indent=2)
+
+
+def to_prometheus() -> str:
+    lines = ['# HELP marble_command_seconds Time commands take, from before to after invoke',
+             '# TYPE marble_command_seconds histogram']
+    rows = snapshot()
+    for row in rows:
+        label = row['name'].replace('\\', '\\\\').replace('"', '\\"')
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), row['buckets']):
+            cumulative += count
+            lines.append(f'marble_command_seconds_bucket{{command="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'marble_command_seconds_sum{{command="{label}"}} {row["seconds"]}')
+        lines.append(f'marble_command_seconds_count{{command="{label}"}} {row["runs"]}')
+
+    for metric, key, kind, description in (('errors_total', 'errors', 'counter', 'Runs of commands that failed'),
+                                           ('statements_total', 'statements', 'counter', 'SQL statements executed'),
+                                           ('commits_total', 'commits', 'counter', 'Transactions committed'),
+                                           ('rows_read_total', 'rows', 'counter', 'Rows fetched from the database'),
+                                           ('db_seconds_total', 'db_seconds', 'counter',
+                                            'Time spent in database calls')):
+        lines.append(f'# HELP marble_command_{metric} {description}')
+        lines.append(f'# TYPE marble_command_{metric} {kind}')
+        for row in rows:
+            label = row['name'].replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'marble_command_{metric}{{command="{label}"}} {row[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def table(top: int = 10) -> str:
+    """Returns the top commands by database time as a text table"""
+    lines = [f'{"command":<16}{"runs":>6}{"err":>5}{"p50ms":>7}{"p95ms":>7}{"sql":>6}{"cmt":>5}{"rows":>7}'
+             f'{"db ms":>9}']
+    for row in snapshot()[:top]:
+        command_stats = registry[row['name']]
+        runs = row['runs'] or 1
+        lines.append(f'{row["name"][:15]:<16}{row["runs"]:>6}{row["errors"]:>5}'
+                     f'{command_stats.quantile(0.5) * 1000:>7.1f}{command_stats.quantile(0.95) * 1000:>7.1f}'
+                     f'{row["statements"] / runs:>6.1f}{row["commits"] / runs:>5.1f}{row["rows"] / runs:>7.1f}'
+                     f'{row["db_seconds"] * 1000:>9.0f}')
+    return '\n'.join(lines)
+
+
+def write(path: str):
+    """Writes every CommandStats to path, replacing it only once the new file is complete"""
+    text = to_json() if path.endswith('.json') else to_prometheus()
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(temporary, path)
+
+
+async def _export(path: str, interval: float):
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, write, path)
+        except OSError as e:
+            logger.error('Unable to write metrics to %s: %s', path, e)
+
+
+def start():
+    """Starts writing the metrics file every interval on the running event loop, unless no file is set"""
+    global _task
+    if not _settings['file'] or (_task is not None and not _task.done()):
+        return
+    _task = asyncio.ensure_future(_export(_settings['file'], _settings['interval']))
+
+
+def stop():
+    """Stops the periodic write and writes the metrics file a last time"""
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    _task = None
+    try:
+        write(_settings['file'])
+    except OSError as e:
+        logger.error('Unable to write metrics to %s: %s', _settings['file'], e)
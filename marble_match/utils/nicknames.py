@@ -0,0 +1,145 @@
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+
+import database.database_operation as database_operation
+
+logger = logging.getLogger(f'marble_match.{__name__}')
+
+# Most suggestions given for a nickname that doesn't exist
+SUGGESTIONS = 3
+# Lowest trigram similarity a nickname needs to be suggested, prefix matches are always suggested
+MIN_SIMILARITY = 0.25
+
+
+def normalize(nickname: str) -> str:
+    """Returns nickname as it's compared, compatibility normalized, case-folded and without outer whitespace"""
+    return unicodedata.normalize('NFKC', nickname).casefold().strip()
+
+
+def trigrams(normalized: str) -> Set[str]:
+    """Returns trigrams of a normalized nickname, padded so the first letters count more than the rest"""
+    padded = f'  {normalized} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NicknameIndex:
+    """Nicknames of a server by exact and normalized value, with trigram postings for suggestions"""
+
+    def __init__(self, rows: List[Tuple[int, str]]):
+        self.names: Dict[int, str] = {}
+        self.exact: Dict[str, int] = {}
+        self.normalized: Dict[str, List[int]] = {}
+        self.grams: Dict[int, Set[str]] = {}
+        self.postings: Dict[str, Set[int]] = {}
+
+        for player_id, nickname in rows:
+            key = normalize(nickname)
+            self.names[player_id] = nickname
+            self.exact[nickname] = player_id
+            self.normalized.setdefault(key, []).append(player_id)
+            self.grams[player_id] = trigrams(key)
+            for gram in self.grams[player_id]:
+                self.postings.setdefault(gram, set()).add(player_id)
+
+    def lookup(self, nickname: str) -> int:
+        """Returns player_id of nickname, matched exactly or else case-insensitively, 0 if there's no single match
+
+        **Arguments**
+
+        - `<nickname>` Nickname to find
+
+        """
+        player_id = self.exact.get(nickname)
+        if player_id is not None:
+            return player_id
+
+        # Nicknames only unique by case can't be told apart without the exact spelling
+        matches = self.normalized.get(normalize(nickname), [])
+        if len(matches) == 1:
+            return matches[0]
+        return 0
+
+    def suggest(self, nickname: str, limit: int = SUGGESTIONS) -> List[str]:
+        """Returns nicknames most similar to nickname, best first
+
+        **Arguments**
+
+        - `<nickname>` Nickname that wasn't found
+        - `<limit>` Most nicknames to return
+
+        """
+        key = normalize(nickname)
+        grams = trigrams(key)
+
+        # Only nicknames sharing a trigram with nickname are scored
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        scored = []
+        for player_id, count in shared.items():
+            similarity = count / (len(grams) + len(self.grams[player_id]) - count)
+            prefix = normalize(self.names[player_id]).startswith(key)
+            if prefix or similarity >= MIN_SIMILARITY:
+                scored.append((not prefix, -similarity, self.names[player_id]))
+
+        scored.sort()
+        return [name for _, _, name in scored[:limit]]
+
+
+class NicknameCache:
+    """NicknameIndex of every server looked up in, dropped when a nickname of the server changes"""
+
+    def __init__(self):
+        self._indexes: Dict[int, NicknameIndex] = {}
+        self._lock = threading.Lock()
+
+    def get(self, connection: sqlite3.Connection, server_id: int) -> NicknameIndex:
+        with self._lock:
+            index = self._indexes.get(server_id)
+        if index is not None:
+            return index
+
+        rows = database_operation.get_server_nicknames(connection, server_id)
+        index = NicknameIndex(rows if not isinstance(rows, int) else [])
+        with self._lock:
+            self._indexes[server_id] = index
+        return index
+
+    def clear(self, server_id: int = None):
+        with self._lock:
+            if server_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(server_id, None)
+
+
+cache = NicknameCache()
+database_operation.nickname_listeners.append(cache.clear)
+database_operation.rollback_listeners.append(cache.clear)
+
+
+def resolve(connection: sqlite3.Connection, server_id: int, nickname: str) -> Tuple[int, List[str]]:
+    """Returns (player_id, []) of nickname on server_id, or (0, suggestions) if it doesn't match a player
+
+    **Arguments**
+
+    - `<connection>` Connection to database
+    - `<server_id>` Server the player is on
+    - `<nickname>` Nickname of player, case-insensitive
+
+    """
+    logger.debug('resolve: %s, %s', server_id, nickname)
+
+    index = cache.get(connection, server_id)
+    player_id = index.lookup(nickname)
+    if player_id:
+        return player_id, []
+
+    suggestions = index.suggest(nickname)
+    logger.debug('suggestions: %s', suggestions)
+    return 0, suggestions
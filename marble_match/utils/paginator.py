@@ -0,0 +1,197 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict
+
+import discord
+from discord.ext import commands
+
+import utils.discord_utils as du
+
+logger = logging.getLogger(f'marble_match.{__name__}')
+
+LEFT = '\U00002B05'  # ⬅️
+RIGHT = '\U000027A1'  # ➡️
+
+
+class Paginator:
+    """Message with ⬅️/➡️ controls, pages are rendered on first view and kept for the lifetime of the message"""
+
+    def __init__(self, ctx: commands.Context, pages: int, render: Callable[[int], Awaitable[str]],
+                 cur_page: int, timeout: float):
+        self.ctx = ctx
+        self.author_id = ctx.author.id
+        self.pages = pages
+        self.render = render
+        self.cur_page = cur_page
+        self.timeout = timeout
+        self.message = None
+        self.rendered = {}
+        self.lock = asyncio.Lock()
+        self.timer = None
+
+    async def page_text(self, page: int) -> str:
+        """Returns text of page with page counter, rendering it if it hasn't been shown yet
+
+        **Arguments**
+
+        - `<page>` Index of page to get
+
+        """
+        if page not in self.rendered:
+            self.rendered[page] = await self.render(page)
+
+        text = self.rendered[page]
+        if self.pages > 1:
+            text += f'Page {page+1} of {self.pages}\n'
+        return text
+
+    async def turn(self, emoji: str):
+        """Edits message to the page left or right of the current one, if there is one
+
+        **Arguments**
+
+        - `<emoji>` LEFT or RIGHT
+
+        """
+        # Reactions from the same user are handled in order, so pages move one at a time
+        async with self.lock:
+            if emoji == LEFT and self.cur_page > 0:
+                page = self.cur_page - 1
+            elif emoji == RIGHT and self.cur_page < self.pages - 1:
+                page = self.cur_page + 1
+            else:
+                return
+
+            text = await self.page_text(page)
+            self.cur_page = page
+            await self.message.edit(content=f'```\n{text}```')
+
+    async def close(self):
+        """Removes reaction controls from message, in one request if the bot is allowed to"""
+        logger.debug('Paginator.close: %s', self.message.id)
+        try:
+            await self.message.clear_reactions()
+        except discord.Forbidden:
+            # Without manage messages the bot can only remove its own reactions
+            for emoji in (LEFT, RIGHT):
+                await self.message.remove_reaction(emoji, self.ctx.me)
+        except discord.HTTPException as e:
+            logger.error('Unable to remove reactions from %s: %s', self.message.id, e)
+
+
+class PaginatorDispatcher:
+    """Routes reaction events to open Paginators by message id, one listener for every Paginator"""
+
+    def __init__(self):
+        self.paginators: Dict[int, Paginator] = {}
+        self.bot = None
+
+    def attach(self, bot: commands.Bot):
+        """Registers the reaction listener on bot, only the first call has any effect
+
+        **Arguments**
+
+        - `<bot>` Bot to listen to reactions of
+
+        """
+        if self.bot is not None:
+            return
+        self.bot = bot
+        bot.add_listener(self.on_reaction_add, 'on_reaction_add')
+
+    def open(self, paginator: Paginator):
+        self.paginators[paginator.message.id] = paginator
+        self.reset_timer(paginator)
+
+    def reset_timer(self, paginator: Paginator):
+        """Closes paginator after its timeout unless it's used again before then"""
+        if paginator.timer is not None:
+            paginator.timer.cancel()
+        loop = asyncio.get_event_loop()
+        paginator.timer = loop.call_later(paginator.timeout, self.expire, paginator)
+
+    def expire(self, paginator: Paginator):
+        logger.debug('expire: %s', paginator.message.id)
+        if self.paginators.pop(paginator.message.id, None) is not None:
+            asyncio.ensure_future(paginator.close())
+
+    async def on_reaction_add(self, reaction: discord.Reaction, user: discord.User):
+        # Dict lookup, so events for other messages cost the same no matter how many paginators are open
+        paginator = self.paginators.get(reaction.message.id)
+        if paginator is None or user.id != paginator.author_id:
+            return
+
+        emoji = str(reaction.emoji)
+        if emoji in (LEFT, RIGHT):
+            self.reset_timer(paginator)
+            await paginator.turn(emoji)
+
+        # Remove users reaction
+        try:
+            await reaction.message.remove_reaction(reaction, user)
+        except discord.HTTPException as e:
+            logger.error('Unable to remove reaction: %s', e)
+
+
+dispatcher = PaginatorDispatcher()
+
+
+def keyset_render(fetch: Callable[..., Awaitable[list]], row_text: Callable[[object], str]):
+    """Returns a render function for paginate, for rows loaded a page at a time by id cursor
+
+    Pages are only ever reached from a neighbour, so every page is fetched as the rows before the first id of the
+    page after it, or after the last id of the page before it, the first page rendered is the newest.
+
+    **Arguments**
+
+    - `<fetch>` Coroutine function taking before_id or after_id keywords and returning a list of rows with id
+    - `<row_text>` Function returning text of a row
+
+    """
+    bounds = {}
+
+    async def render(page: int) -> str:
+        if page + 1 in bounds:
+            rows = await fetch(before_id=bounds[page + 1][0])
+        elif page - 1 in bounds:
+            rows = await fetch(after_id=bounds[page - 1][1])
+        else:
+            rows = await fetch()
+
+        if not rows:
+            return ''
+        bounds[page] = (rows[0].id, rows[-1].id)
+        return ''.join(row_text(row) for row in rows)
+
+    return render
+
+
+async def paginate(ctx: commands.Context, pages: int, render: Callable[[int], Awaitable[str]],
+                   cur_page: int = None, timeout: float = 60) -> discord.Message:
+    """Sends page cur_page of a paginated message, and lets ctx.author change pages with reactions
+
+    **Arguments**
+
+    - `<ctx>` Context to send message to
+    - `<pages>` Amount of pages
+    - `<render>` Coroutine function returning text of a page from its index, only called once per page
+    - `<cur_page>` Index of page to show first, defaults to the last page
+    - `<timeout>` Seconds without a reaction before controls are removed
+
+    """
+    logger.debug('paginate: %s, %s', pages, cur_page)
+
+    if cur_page is None:
+        cur_page = pages - 1
+
+    paginator = Paginator(ctx, pages, render, cur_page, timeout)
+    paginator.message = await du.code_message(ctx, await paginator.page_text(cur_page))
+
+    # Single page messages don't need controls
+    if pages > 1:
+        dispatcher.attach(ctx.bot)
+        dispatcher.open(paginator)
+        await paginator.message.add_reaction(LEFT)
+        await paginator.message.add_reaction(RIGHT)
+
+    return paginator.message
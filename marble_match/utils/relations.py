@@ -0,0 +1,45 @@
+import abc
+
+
+class Reference(abc.ABC):
+    """Placeholder for a related model that hasn't been loaded yet, knows only its id"""
+    __slots__ = ('id',)
+
+    def __init__(self, id: int):
+        self.id = id
+
+    @abc.abstractmethod
+    def resolve(self):
+        """Returns the related model"""
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(id={self.id})'
+
+
+def resolve(obj, slot: str):
+    """Returns value of slot on obj, replacing a Reference stored there with the model it resolves to"""
+    value = getattr(obj, slot)
+    if isinstance(value, Reference):
+        value = value.resolve()
+        setattr(obj, slot, value)
+    return value
+
+
+class Lazy:
+    """Model attribute backed by slot, loads the related model the first time it's read
+
+    The id of a related model is available from the slot without loading it, References have the same id attribute
+    as models.
+
+    """
+
+    def __init__(self, slot: str):
+        self.slot = slot
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        return resolve(obj, self.slot)
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
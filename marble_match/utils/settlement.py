@@ -0,0 +1,147 @@
+import logging
+from dataclasses import dataclass, field
+
+import database.database_operation as database_operation
+from database.database_setup import DbHandler
+import utils.account as account
+import utils.exception as exception
+import utils.matches as matches
+
+logger = logging.getLogger(f'marble_match.{__name__}')
+
+
+@dataclass
+class Settlement:
+    """Everything that changes when a match is settled, computed before anything is written"""
+    match: matches.Match
+    winner: account.Account
+    loser: account.Account
+    marble_deltas: dict = field(default_factory=dict)
+    ledger_entries: list = field(default_factory=list)
+    bet_history: list = field(default_factory=list)
+
+    def add_marbles(self, player_id: int, amount: int, reason: str, reference_id: int):
+        self.marble_deltas[player_id] = self.marble_deltas.get(player_id, 0) + amount
+        self.ledger_entries.append(database_operation.ledger_params(player_id, amount, reason, reference_id))
+
+
+def calculate_payouts(bet_info: list, winner_id: int) -> dict:
+    """Returns dict of bet_id to marbles returned, for every winning bet
+
+    **Arguments**
+
+    - `<bet_info>` List of BetRows
+    - `<winner_id>` Player id of the match winner
+
+    """
+    logger.debug('calculate_payouts: %s, %s', bet_info, winner_id)
+
+    # Total of winner and loser marbles, and amount of losers
+    winner_pot = 0
+    loser_pot = 0
+    loser_count = 0
+    for bet in bet_info:
+        if bet.participant1 == winner_id:
+            winner_pot += bet.amount
+        else:
+            loser_pot += bet.amount
+            loser_count += 1
+
+    payouts = {}
+    for bet in bet_info:
+        if bet.participant1 != winner_id:
+            continue
+
+        # If no losers, house matches bet and returns double amount
+        if loser_count == 0:
+            payouts[bet.id] = bet.amount * 2
+            continue
+
+        # Ratio of your bet in winner_pot, if share of loser_pot is less than one return bet amount + one marble
+        winnings = loser_pot * (bet.amount / winner_pot)
+        if winnings < 1:
+            payouts[bet.id] = bet.amount + 1
+        else:
+            payouts[bet.id] = bet.amount + int(winnings)
+
+    logger.debug('payouts: %s', payouts)
+    return payouts
+
+
+def add_bets(settlement: Settlement, bet_info: list):
+    """Adds payouts and bet_history rows for bet_info to settlement
+
+    **Arguments**
+
+    - `<settlement>` Settlement to add bets to
+    - `<bet_info>` List of BetRows for settlement.match
+
+    """
+    match = settlement.match
+    payouts = calculate_payouts(bet_info, settlement.winner.id)
+
+    for bet in bet_info:
+        if bet.id in payouts:
+            settlement.add_marbles(bet.better_id, payouts[bet.id], database_operation.LEDGER_BET_PAYOUT, bet.id)
+        settlement.bet_history.append((bet.id, bet.amount, match.id, bet.better_id, bet.participant1,
+                                       settlement.winner.id, match.match_time))
+
+
+def compute_settlement(match: matches.Match, bet_info: list) -> Settlement:
+    """Returns the Settlement of match, match.winner and match.match_time need to be set
+
+    **Arguments**
+
+    - `<match>` Match to settle
+    - `<bet_info>` List of BetRows for match
+
+    """
+    logger.debug('compute_settlement: %s', match)
+
+    winner = match.winner
+    loser = match.recipient if winner == match.challenger else match.challenger
+
+    settlement = Settlement(match, winner, loser)
+    # Winner gets both stakes
+    settlement.add_marbles(winner.id, match.amount * 2, database_operation.LEDGER_MATCH_PAYOUT, match.id)
+    add_bets(settlement, bet_info)
+
+    return settlement
+
+
+def settle_match(match: matches.Match) -> Settlement:
+    """Settles match and all bets on it in a single transaction, returns the applied Settlement
+
+    **Arguments**
+
+    - `<match>` Match with winner and match_time set
+
+    """
+    logger.debug('settle_match: %s', match)
+
+    # Check if needed fields are set
+    if match.winner is None or match.match_time is None:
+        logger.error('missing needed field')
+        raise exception.UnableToWrite(message='Unable to write missing needed fields', class_='Match',
+                                      attribute='winner, match_time')
+
+    bet_info = database_operation.get_bet_info_match_all(DbHandler.db_cnc, match.id)
+    settlement = compute_settlement(match, bet_info if bet_info else [])
+
+    if not database_operation.settle_match(DbHandler.db_cnc,
+                                           [match.id, match.amount, match.challenger_id, match.recipient_id,
+                                            settlement.winner.id, match.match_time, match.game, match.format_],
+                                           settlement.winner.id, settlement.loser.id,
+                                           settlement.ledger_entries, settlement.bet_history):
+        logger.error('Unable to settle match')
+        raise exception.UnableToWrite(attribute='matches_history')
+
+    # Reflect written changes on loaded Accounts
+    settlement.winner._marbles += settlement.marble_deltas.get(settlement.winner.id, 0)
+    settlement.winner._wins += 1
+    if settlement.loser.id in settlement.marble_deltas:
+        settlement.loser._marbles += settlement.marble_deltas[settlement.loser.id]
+    settlement.loser._loses += 1
+    match.is_history = True
+
+    return settlement
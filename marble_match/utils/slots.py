@@ -0,0 +1,22 @@
+import dataclasses
+
+
+def slotted(cls):
+    """Returns dataclass cls rebuilt with a __slots__ entry for each of its fields
+
+    Instances then have no __dict__, which is most of the size of a small object. Same as dataclass(slots=True),
+    which needs Python 3.10. Apply it above @dataclass, attributes that aren't fields can't be set on instances.
+
+    """
+    names = tuple(field.name for field in dataclasses.fields(cls))
+    namespace = dict(cls.__dict__)
+    namespace['__slots__'] = names
+    # Defaults are kept by the generated __init__, as class attributes they would conflict with the slots
+    for name in names:
+        namespace.pop(name, None)
+    namespace.pop('__dict__', None)
+    namespace.pop('__weakref__', None)
+
+    slotted_cls = type(cls)(cls.__name__, cls.__bases__, namespace)
+    slotted_cls.__qualname__ = cls.__qualname__
+    return slotted_cls